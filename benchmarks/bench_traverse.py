@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Time tree traversal and index construction on synthetic country data.
+
+Usage: python benchmarks/bench_traverse.py [NODES] [REPEAT]
+"""
+import sys
+import timeit
+import uuid
+
+from unfccc.etf.countrydata import CountryData
+from unfccc.etf.json import JSONTree
+from unfccc.etf.metadata import Metadata
+
+
+def make_country_data(count):
+    nodes = []
+    variables = []
+    grids = []
+    for index in range(count):
+        node_uid = uuid.uuid4().hex
+        node = {
+            'uid': node_uid,
+            'template_node_uid': str(uuid.uuid4()),
+            'name_prefix': f'{index}.',
+            'name': f'node {index}',
+            'node': [{'uid': uuid.uuid4().hex, 'name': f'child {index}',
+                      'attributes': {'unit': 'kt', 'notes': []}}]
+        }
+        nodes.append(node)
+        for _ in range(3):
+            variables.append({'uid': uuid.uuid4().hex, 'node_uid': node_uid,
+                              'template_var_uid': str(uuid.uuid4())})
+        grids.append({
+            'node_uid': node_uid,
+            'group': [{'uid': uuid.uuid4().hex, 'variable_uid': None,
+                       'group': [{'uid': uuid.uuid4().hex,
+                                  'variable_uid': variable['uid'],
+                                  'dimensions': [{'id': 1}, {'id': 2}]}
+                                 for variable in variables[-3:]]}]
+        })
+    return {
+        'country_specific_data': {'nodes': nodes, 'variables': variables,
+                                  'grids': grids},
+        'data': {'values': []}
+    }
+
+
+def main(count=20000, repeat=5):
+    metadata = Metadata({'Metadata': [{
+        'node': [], 'dimension': [{'id': 1, 'name': 'NAVIGATION'}],
+        'dimension_instance': [{'dimension_id': 1, 'uid': 'root',
+                                'children': []}],
+        'grid': [], 'variable': []
+    }]})
+    data = make_country_data(count)
+    tree = JSONTree(data)
+    benchmarks = {
+        'traverse all objects': lambda: sum(1 for _ in tree.traverse(data)),
+        'traverse nodes via "node"': lambda: sum(
+            1 for _ in tree.traverse(data['country_specific_data']['nodes'],
+                                     via='node')
+        ),
+        'build CountryData indexes':
+            lambda: CountryData(metadata, data),
+    }
+    for label, func in benchmarks.items():
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f'{label}: {best * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,104 @@
+import json
+import logging
+import lzma
+import os
+
+from .json import JSONTreeWalker
+from .util import pformat_size
+
+
+logger = logging.getLogger(__name__)
+
+CORE_FILE = 'core.json.xz'
+# collections of the metadata root split by sector
+SECTOR_COLLECTIONS = ('node', 'grid', 'variable')
+
+
+def write_json(path, item):
+    with lzma.open(path, 'wt', encoding='utf-8') as output:
+        json.dump(item, output, ensure_ascii=False, separators=(',', ':'),
+                  default=JSONTreeWalker.encode_object)
+    return os.path.getsize(path)
+
+
+def read_json(path):
+    with lzma.open(path, 'rb') as source:
+        return json.load(source)
+
+
+class MetadataBundle:
+    """Metadata split into a core and one file per sector.
+
+    The core holds everything but the sector nodes and their grids and
+    variables, together with the manifest of sectors and the index
+    of node UIDs to UIDs of their sectors, so that the sector of any
+    node is known before loading it. Sectors are the top level nodes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest = None
+        self.sectors = {}  # sector UID -> (position, file name)
+
+    @classmethod
+    def build(cls, metadata, path):
+        """Write metadata split into bundle files in `path` directory."""
+        os.makedirs(path, exist_ok=True)
+        aliases = {uid: alias
+                   for (alias, uid) in metadata.sector_uids.items()}
+        node_sectors = {}
+        parts = {}
+        for sector in metadata.nodes:
+            parts[sector['uid']] = {key: [] for key in SECTOR_COLLECTIONS}
+            parts[sector['uid']]['node'].append(sector)
+            for node in metadata.traverse(sector, via='node'):
+                node_sectors[node['uid']] = sector['uid']
+        core_root = dict(metadata.root, node=[])
+        for key in ('grid', 'variable'):
+            core_root[key] = []
+            for item in metadata.root.get(key, ()):
+                sector_uid = node_sectors.get(item.get('node_uid'))
+                target = core_root if sector_uid is None \
+                    else parts[sector_uid]
+                target[key].append(item)
+        sectors = []
+        for sector in metadata.nodes:
+            uid = sector['uid']
+            file_name = f'{aliases.get(uid, uid)}.json.xz'
+            size = write_json(os.path.join(path, file_name), parts[uid])
+            logger.info('bundled sector "%s %s" into %s, size %s',
+                        sector.get('name_prefix'), sector.get('name'),
+                        file_name, pformat_size(size))
+            sectors.append({'uid': uid, 'file': file_name})
+        core = dict(metadata.tree, Metadata=[core_root], bundle={
+            'fingerprint': metadata.fingerprint,
+            'sectors': sectors,
+            'node_sectors': node_sectors,
+        })
+        size = write_json(os.path.join(path, CORE_FILE), core)
+        logger.info('bundled core metadata into %s, size %s', CORE_FILE,
+                    pformat_size(size))
+        return cls(path)
+
+    def read_core(self):
+        """Return tree of core metadata, reading the manifest."""
+        path = os.path.join(self.path, CORE_FILE)
+        logger.info('loading %s', path)
+        core = read_json(path)
+        self.manifest = core.pop('bundle')
+        self.sectors = {
+            sector['uid']: (position, sector['file'])
+            for (position, sector) in enumerate(self.manifest['sectors'])
+        }
+        return core
+
+    @property
+    def fingerprint(self):
+        return self.manifest['fingerprint']
+
+    def sector_of(self, node_uid):
+        return self.manifest['node_sectors'].get(node_uid)
+
+    def read_sector(self, uid):
+        """Return node, grid and variable lists of sector."""
+        (_, file_name) = self.sectors[uid]
+        return read_json(os.path.join(self.path, file_name))
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from .util import package_version, pformat_size
+
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'etf-cli')
+
+
+def parse_size(size):
+    """Parse human readable size like `512M` or `2G` into bytes."""
+    size = str(size).strip().upper()
+    for power, suffix in enumerate(['K', 'M', 'G', 'T'], 1):
+        if size.endswith(suffix):
+            return int(float(size[:-1]) * 1024 ** power)
+    return int(size)
+
+
+class ResultCache:
+    """Content-addressed store of command results.
+
+    Results are kept as files named by the hash of everything
+    that determines them: input bytes, metadata, command, options
+    and package version. Hits refresh the file modification time,
+    the least recently used files are evicted when total size
+    exceeds the limit."""
+
+    def __init__(self, path, max_size='1G'):
+        self.path = path
+        self.max_size = parse_size(max_size)
+
+    @staticmethod
+    def make_key(source, metadata_fingerprint, command, options):
+        digest = hashlib.sha256(source)
+        digest.update(json.dumps(
+            [metadata_fingerprint, command, options, package_version()],
+            sort_keys=True, default=str
+        ).encode('utf-8'))
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def entries(self):
+        if not os.path.isdir(self.path):
+            return
+        for subdir in os.scandir(self.path):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.is_file() and not entry.name.startswith('.'):
+                    yield entry
+
+    def open(self, key):
+        """Return cached result opened for reading, or None on miss."""
+        path = self.entry_path(key)
+        try:
+            result = open(path, 'rt', encoding='utf-8')
+        except FileNotFoundError:
+            logger.debug('cache miss %s', key)
+            return None
+        logger.debug('cache hit %s', key)
+        try:
+            os.utime(path)
+        except OSError:
+            # entry has just been pruned by another process, still readable
+            pass
+        return result
+
+    def copy(self, key, output_file):
+        cached = self.open(key)
+        if cached is None:
+            return False
+        with cached:
+            shutil.copyfileobj(cached, output_file, 1024 * 1024)
+        return True
+
+    @contextmanager
+    def store(self, key):
+        """Open cache entry for writing, publish it atomically on success."""
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        (fd, temp_path) = tempfile.mkstemp(dir=os.path.dirname(path),
+                                           prefix='.')
+        try:
+            with open(fd, 'wt', encoding='utf-8') as cache_file:
+                yield cache_file
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.prune()
+
+    def stats(self):
+        count = size = 0
+        for entry in self.entries():
+            count += 1
+            size += entry.stat().st_size
+        return {
+            'path': self.path,
+            'entries': count,
+            'size': size,
+            'max_size': self.max_size
+        }
+
+    def prune(self, max_size=None):
+        """Evict least recently used entries above `max_size` bytes,
+        return number of evicted entries."""
+        max_size = self.max_size if max_size is None else max_size
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                   for entry in self.entries()]
+        total = sum(size for (_, size, _) in entries)
+        evicted = 0
+        for (_, size, path) in sorted(entries):
+            if total <= max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        if evicted:
+            logger.info('evicted %s cached results, %s bytes left',
+                        evicted, pformat_size(total))
+        return evicted
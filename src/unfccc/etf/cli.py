@@ -1,11 +1,31 @@
 #!/usr/bin/env python3
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import io
+import itertools
+import json
 import logging
+import os
+import sqlite3
+import time
 
 import click
 
+from . import metrics
+from .bundle import MetadataBundle
+from .cache import ResultCache, default_cache_dir, parse_size
 from .countrydata import CountryData
+from .diff import diff as diff_trees
+from . import export as export_
+from .export import ValueExport
+from .hashcons import Interner, measure, thaw
+from .index import CountryIndex
+from .json import JSONPath, JSONTree
+from .merge import CountryDataMerger, MergeConflict
 from .metadata import Metadata
-from .util import BiFormatter
+from .overlap import is_compressed, read_input, write_output
+from .uids import uid_modes
+from .util import BiFormatter, pformat_size
 
 
 logger = logging.getLogger()
@@ -17,16 +37,199 @@ logger.setLevel(logging.INFO)
 
 pass_metadata = click.make_pass_decorator(Metadata)
 
+RUN_DURATION = metrics.REGISTRY.gauge(
+    'etf_run_duration_seconds', 'wall time of the last etf run'
+)
+RUN_TIMESTAMP = metrics.REGISTRY.gauge(
+    'etf_run_timestamp_seconds', 'completion time of the last etf run'
+)
+
+
+class YearsParamType(click.ParamType):
+    name = 'years'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, frozenset):
+            return value
+        years = set()
+        try:
+            for part in value.split(','):
+                first, _, last = part.partition('-')
+                (first, last) = (int(first), int(last or first))
+                if first > last:
+                    self.fail(f'"{part}" is a reversed range of years',
+                              param, ctx)
+                years.update(range(first, last + 1))
+        except ValueError:
+            self.fail(f'"{value}" is not a list of years or year ranges '
+                      f'like 1990,2020-2022', param, ctx)
+        return frozenset(years)
+
+
+class SizeParamType(click.ParamType):
+    name = 'size'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        try:
+            return parse_size(value)
+        except ValueError:
+            self.fail(f'"{value}" is not a size like 1M', param, ctx)
+
+
+YEARS = YearsParamType()
+SIZE = SizeParamType()
+years_option = click.option(
+    '-y', '--years', type=YEARS,
+    help='only process given inventory years, like 1990,2020-2022'
+)
+splice_option = click.option(
+    '--splice/--no-splice', default=False,
+    help='copy unchanged parts of input file into output as they are'
+)
+
 
 @click.group()
 @click.option('-v', '--verbose', count=True)
 @click.option('-m', '--metadata-file', type=click.File('rb'),
               help='override built-in metadata definition with custom version')
+@click.option('--metadata-bundle', type=click.Path(exists=True,
+                                                   file_okay=False),
+              help='read metadata from bundle built by "metadata bundle", '
+              'loading sectors on demand')
+@click.option('--records/--no-records', default=False,
+              help='keep objects in compact records to save memory')
+@click.option('--shared-metadata/--no-shared-metadata', default=False,
+              help='store identical metadata subtrees once, read-only')
+@click.option('--cache/--no-cache', envvar='ETF_CACHE', default=False,
+              help='reuse results of identical runs')
+@click.option('--cache-dir', envvar='ETF_CACHE_DIR',
+              type=click.Path(file_okay=False), default=default_cache_dir(),
+              show_default=True, help='directory of cached results')
+@click.option('--cache-size', envvar='ETF_CACHE_SIZE', type=SIZE,
+              default='1G',
+              show_default=True, help='maximum total size of cached results')
+@click.option('--io-block-size', type=SIZE, default='1M', show_default=True,
+              help='size of blocks read and written by I/O threads')
+@click.option('--io-queue-depth', type=click.IntRange(min=0), default=4,
+              show_default=True,
+              help='blocks queued between I/O threads and processing, '
+              '0 reads and writes without threads')
+@click.option('--parse-jobs', type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help='number of processes parsing inventory years of data '
+              'files, not combined with "data run -j"')
+@click.option('--metrics-file', envvar='ETF_METRICS_FILE',
+              type=click.Path(dir_okay=False),
+              help='write run metrics in Prometheus text format')
 @click.pass_context
-def main(ctx, verbose, metadata_file):
+def main(ctx, verbose, metadata_file, metadata_bundle, records,
+         shared_metadata, cache, cache_dir, cache_size, io_block_size,
+         io_queue_depth, parse_jobs, metrics_file):
     if verbose:
         logger.setLevel(logging.DEBUG)
-    ctx.obj = Metadata(metadata_file)
+    if metrics_file:
+        metrics.enable()
+        ctx.call_on_close(functools.partial(write_metrics, metrics_file,
+                                            time.monotonic()))
+    if cache or ctx.invoked_subcommand == 'cache':
+        ctx.meta['etf.cache'] = ResultCache(cache_dir, cache_size)
+    ctx.meta['etf.cache_enabled'] = cache
+    ctx.meta['etf.io'] = {'block_size': io_block_size,
+                          'depth': io_queue_depth}
+    ctx.meta['etf.parse_jobs'] = parse_jobs
+    ctx.meta['etf.records'] = records
+    if records and shared_metadata:
+        raise click.UsageError(
+            '--shared-metadata cannot be combined with --records'
+        )
+    if ctx.invoked_subcommand == 'cache':
+        # cached results are managed without metadata
+        return
+    if metadata_bundle is not None:
+        if metadata_file is not None or records or shared_metadata:
+            raise click.UsageError(
+                '--metadata-bundle cannot be combined with -m, --records '
+                'or --shared-metadata'
+            )
+        ctx.obj = Metadata.from_bundle(metadata_bundle)
+        return
+    ctx.obj = Metadata(metadata_file, records=records,
+                       shared=shared_metadata)
+
+
+def write_metrics(path, started):
+    RUN_DURATION.set(time.monotonic() - started)
+    RUN_TIMESTAMP.set(time.time())
+    metrics.REGISTRY.write_textfile(path)
+
+
+# parameters of commands not affecting their results
+UNKEYED_PARAMS = {'input_file', 'input_files', 'output_file', 'jobs'}
+
+
+def load_country_data(ctx, metadata, input_file, output_file):
+    """Load country data from input file.
+
+    With caching enabled return None if the result of the same command
+    has been found in the cache and copied to output file."""
+    records = ctx.meta.get('etf.records', False)
+    years = ctx.params.get('years')
+    uid_mode = ctx.params.get('uid_mode')
+    splice = ctx.params.get('splice', False)
+    parse_jobs = ctx.meta.get('etf.parse_jobs', 1)
+    source_file = CountryData.source_file(input_file)
+    if not ((splice or parse_jobs > 1) and source_file is not None
+            and not is_compressed(source_file)):
+        # spliced regular files are kept, parts of them are copied
+        # into output by the kernel, and parsing workers map them;
+        # compressed ones are decompressed and used from memory
+        input_file = read_input(input_file, **ctx.meta.get('etf.io', {}))
+    if not ctx.meta.get('etf.cache_enabled'):
+        return CountryData(metadata, input_file, records=records,
+                           years=years, uid_mode=uid_mode or 'random',
+                           splice=splice, parse_jobs=parse_jobs)
+    cache = ctx.meta['etf.cache']
+    source = CountryData.read_source(input_file)
+    options = {
+        name: value for name, value in ctx.params.items()
+        if name not in UNKEYED_PARAMS
+        and not hasattr(value, 'read') and not hasattr(value, 'write')
+    }
+    key = cache.make_key(source, metadata.fingerprint, ctx.command_path,
+                         options)
+    if cache.copy(key, output_file):
+        logger.info('using cached result of identical run')
+        return None
+    # runs of several files in threads share the context
+    ctx.meta.setdefault('etf.cache_keys', {})[output_file] = key
+    # cached results must not depend on randomness
+    return CountryData(metadata, source, records=records, years=years,
+                       uid_mode=uid_mode or 'deterministic', splice=splice,
+                       parse_jobs=parse_jobs)
+
+
+def dump_result(ctx, result, output_file):
+    """Write country data or JSON result to output file,
+    storing it in the cache if enabled."""
+    dump = result.dump if isinstance(result, CountryData) \
+        else functools.partial(json.dump, result)
+    if not (isinstance(result, CountryData) and result.spans is not None):
+        # encoding overlaps with writes of encoded blocks, spliced
+        # output is written directly
+        dump = functools.partial(write_output, dump,
+                                 **ctx.meta.get('etf.io', {}))
+    key = ctx.meta.get('etf.cache_keys', {}).pop(output_file, None)
+    if key is None:
+        dump(output_file)
+        return
+    cache = ctx.meta['etf.cache']
+    with cache.store(key) as cache_file:
+        dump(cache_file)
+    if not cache.copy(key, output_file):
+        # evicted right away by size limit, produce output anyway
+        dump(output_file)
 
 
 @main.group(help='group of commands for processing ETF metadata files')
@@ -54,106 +257,420 @@ def find(metadata, sector):
                     dimension_instance["uid"], path)
 
 
+@metadata.command(help='report memory taken by the ETF metadata tree '
+                       'as loaded and with identical subtrees shared')
+@pass_metadata
+def stats(metadata):
+    if metadata.records:
+        raise click.UsageError('stats cannot be measured with --records')
+    plain = thaw(metadata.tree) if metadata.shared else metadata.tree
+    for (label, tree) in [('plain', plain),
+                          ('shared', Interner().freeze(plain))]:
+        logger.info('%(label)s: %(objects)s objects, %(arrays)s arrays, '
+                    '%(strings)s strings, %(size)s',
+                    dict(measure(tree), label=label))
+
+
+@metadata.command(help='split ETF metadata into a core and compressed '
+                  'files per sector, to be read by --metadata-bundle')
+@pass_metadata
+@click.argument('output_dir', type=click.Path(file_okay=False))
+def bundle(metadata, output_dir):
+    # metadata read from a bundle is bundled again whole
+    metadata.load_sectors()
+    MetadataBundle.build(metadata, output_dir)
+
+
 @main.group(help='group of commands for processing ETF country report files')
 def data():
     pass
 
 
+sector_option = click.option(
+    '-s', '--sector', type=str, required=True,
+    help='name or UID of navigation node to filter the output'
+)
+requirements_option = click.option(
+    '-r', '--requirements', required=True, multiple=True,
+    type=click.Choice(['GRIDS', 'PARENTS', 'ALL']), default=['ALL'],
+    help='type(s) of import requirements to satisfy'
+)
+uid_mode_option = click.option(
+    '--uid-mode', type=click.Choice(sorted(uid_modes)),
+    help='UIDs of added objects: random, or derived from names '
+         'of their templates to reproduce output '
+         '[default: random, deterministic with --cache]'
+)
+
+# steps of `data run` pipelines: name -> click command parsing step options
+pipeline_steps = {}
+
+
+def pipeline_step(*options):
+    """Register function as a step of `data run` pipelines. The step
+    is called with country data and its options, and returns country
+    data to pass on, or None if it only reports on the data."""
+    def decorator(func):
+        name = func.__name__[:-len('_step')]
+        command = click.Command(name, callback=func)
+        for option in reversed(options):
+            option(command)
+        pipeline_steps[name] = command
+        return func
+    return decorator
+
+
+@pipeline_step(sector_option)
+def filter_step(country_data, sector):
+    country_data.filter_sector(sector)
+    return country_data
+
+
+@pipeline_step(requirements_option, uid_mode_option)
+def fix_step(country_data, requirements=('ALL',), uid_mode=None):
+    country_data.fix(requirements, uid_mode)
+    return country_data
+
+
+@pipeline_step()
+def stats_step(country_data):
+    log_statistics(country_data.count_statistics())
+
+
+def log_statistics(statistics):
+    for stat in statistics:
+        logger.info('%(label)s: %(objects_flat)s direct children, '
+                    '%(objects_nested)s objects, %(size)s bytes', stat)
+
+
 @data.command(help='output part of data file filtered by sector')
 @pass_metadata
-@click.option('-s', '--sector', type=str, required=True,
-              help='name or UID of navigation node to filter the output')
+@sector_option
+@years_option
+@splice_option
+@click.option('--from-index', type=click.Path(dir_okay=False),
+              help='read data from index built by "data index" instead '
+              'of input file, the only file argument is then the output')
+@click.argument('input_file', type=click.Path(dir_okay=False, allow_dash=True),
+                default='-')
+@click.argument('output_file', type=click.File('w'),
+                default=click.get_text_stream('stdout'))
+@click.pass_context
+def filter(ctx, metadata, sector, years, splice, from_index, input_file,
+           output_file):
+    if from_index is not None:
+        if ctx.get_parameter_source('output_file') \
+                is not click.core.ParameterSource.DEFAULT:
+            raise click.UsageError(
+                'input file cannot be given with --from-index', ctx
+            )
+        try:
+            result = CountryIndex(from_index).filter_sector(
+                metadata, sector, years,
+                records=ctx.meta.get('etf.records', False)
+            )
+        except FileNotFoundError as exc:
+            raise click.FileError(from_index, str(exc))
+        with click.open_file(input_file, 'w') as output_file:
+            result.dump(output_file)
+        return
+    with click.open_file(input_file, 'rb') as input_file:
+        country_data = load_country_data(ctx, metadata, input_file,
+                                         output_file)
+        if country_data is None:
+            return
+        dump_result(ctx, filter_step(country_data, sector), output_file)
+
+
+@data.command(help='correct errors in data file')
+@pass_metadata
+@requirements_option
+@uid_mode_option
+@years_option
+@splice_option
 @click.argument('input_file', type=click.File('rb'),
                 default=click.get_text_stream('stdin'))
 @click.argument('output_file', type=click.File('w'),
                 default=click.get_text_stream('stdout'))
-def filter(metadata, sector, input_file, output_file):
-    country_data = CountryData(metadata, input_file)
-    filter_ = metadata.get_sector_filter(sector)
-    sector_uids = country_data.collect_sector_uids(filter_)
-    sector_node_uids = sector_uids['nodes']
-    # country specific nodes can form the tree,
-    # but flat list filtering should still work
-    # because if the node /not/ belongs to specified sector
-    # then all its children are the same
-    deleted = country_data.filter_out(
-        country_data.nodes,
-        lambda node: (
-            node['uid'] in sector_node_uids
-            or node.get('parent_uid') in sector_node_uids
-            or node.get('template_node_uid') in sector_node_uids
-        ),
-        sector_node_uids
-    )
-    logger.info('filtered out %s nodes not belonging to sector "%s"',
-                len(deleted), sector)
-    sector_variable_uids = sector_uids['variables']
-    deleted = country_data.filter_out(
-        country_data.variables,
-        lambda variable: (
-            variable['uid'] in sector_variable_uids
-            or variable.get('node_uid') in sector_node_uids
-        ),
-        sector_variable_uids
-    )
-    logger.info('filtered out %s variables not belonging to sector "%s"',
-                len(deleted), sector)
-    deleted = country_data.filter_out(
-        country_data.grids,
-        lambda grid: grid['node_uid'] in sector_node_uids
-    )
-    logger.info('filtered out %s grids not belonging to sector "%s"',
-                len(deleted), sector)
-    deleted = country_data.filter_out(
-        country_data.line_descriptions,
-        lambda line_desc: line_desc['variable_uid'] in sector_variable_uids
-    )
-    logger.info('filtered out %s line descriptions '
-                'not belonging to sector "%s"', len(deleted), sector)
-    for inventory in country_data.data:
-        year = inventory['inventory_year']
-        deleted = country_data.filter_out(
-            inventory['values'],
-            lambda value: value['variable_uid'] in sector_variable_uids
+@click.pass_context
+def fix(ctx, metadata, requirements, uid_mode, years, splice, input_file,
+        output_file):
+    country_data = load_country_data(ctx, metadata, input_file, output_file)
+    if country_data is None:
+        return
+    # UID mode has been applied on loading
+    dump_result(ctx, fix_step(country_data, requirements), output_file)
+
+
+@data.command(help='output statistics for data file')
+@pass_metadata
+@years_option
+@click.argument('input_file', type=click.File('rb'),
+                default=click.get_text_stream('stdin'))
+@click.pass_context
+def stats(ctx, metadata, years, input_file):
+    output = io.StringIO()
+    country_data = load_country_data(ctx, metadata, input_file, output)
+    if country_data is not None:
+        dump_result(ctx, country_data.count_statistics(), output)
+    log_statistics(json.loads(output.getvalue()))
+
+
+def parse_pipeline(ctx, args):
+    """Split arguments of `data run` into steps separated by `then`,
+    return list of (step function, parsed options)."""
+    result = []
+    for is_separator, group in itertools.groupby(
+        args, lambda arg: arg == 'then'
+    ):
+        if is_separator:
+            continue
+        (name, *step_args) = group
+        command = pipeline_steps.get(name)
+        if command is None:
+            raise click.UsageError(
+                f'unknown step "{name}", expected one of '
+                f'{", ".join(sorted(pipeline_steps))}', ctx
+            )
+        # usage errors refer to "<group> run <step>"
+        step_ctx = command.make_context(f'{ctx.info_name} {name}',
+                                        step_args, parent=ctx.parent)
+        result.append((command.callback, step_ctx.params))
+    if not result:
+        raise click.UsageError('no steps to run', ctx)
+    return result
+
+
+@data.command(help='run steps over data file loaded once, like '
+              '"filter -s 1 then fix -r ALL then stats"; the data is '
+              'written unless the last step only reports on it',
+              context_settings={'ignore_unknown_options': True,
+                                'allow_interspersed_args': False})
+@pass_metadata
+@years_option
+@splice_option
+@click.option('-i', '--input-file', 'input_files', multiple=True,
+              type=click.Path(dir_okay=False, allow_dash=True),
+              default=['-'], help='data file(s) to read, standard input '
+              'by default')
+@click.option('-o', '--output-file', default='-',
+              help='file to write result into, standard output by default; '
+              'pattern of file names like "{stem}.fixed.json" for several '
+              'input files')
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help='number of input files processed concurrently')
+@click.argument('steps', nargs=-1, required=True, type=click.UNPROCESSED)
+@click.pass_context
+def run(ctx, metadata, years, splice, input_files, output_file, jobs,
+        steps):
+    pipeline = parse_pipeline(ctx, steps)
+    output_files = [output_file]
+    if len(input_files) > 1:
+        if '{stem}' not in output_file:
+            raise click.BadParameter(
+                'must be a pattern of file names with "{stem}" '
+                'for several input files', param_hint="'-o'"
+            )
+        output_files = [output_file.format(stem=file_stem(path))
+                        for path in input_files]
+    run_file = functools.partial(run_pipeline, ctx, metadata, pipeline)
+    if jobs == 1 or len(input_files) == 1:
+        list(map(run_file, input_files, output_files))
+        return
+    if ctx.meta.get('etf.parse_jobs', 1) > 1:
+        # parsing workers would be forked from a multithreaded process
+        raise click.UsageError(
+            '--parse-jobs cannot be combined with -j/--jobs', ctx
         )
-        logger.info('filtered out %s data values for year %s '
-                    'not belonging to sector "%s"', len(deleted), year, sector)
-    country_data.dump(output_file)
+    # threads share metadata, which is read-only once frozen
+    metadata.freeze()
+    with ThreadPoolExecutor(jobs) as executor:
+        list(executor.map(run_file, input_files, output_files))
 
 
-@data.command(help='correct errors in data file')
+def run_pipeline(ctx, metadata, pipeline, input_path, output_path):
+    with click.open_file(input_path, 'rb') as input_file, \
+            click.open_file(output_path, 'w', lazy=True) as output_file:
+        country_data = load_country_data(ctx, metadata, input_file,
+                                         output_file)
+        if country_data is None:
+            return
+        result = country_data
+        for (step, options) in pipeline:
+            logger.info('running step "%s" on %s',
+                        step.__name__[:-len('_step')], input_path)
+            result = step(country_data, **options)
+        if result is not None:
+            dump_result(ctx, result, output_file)
+
+
+@data.command(help='export data values as table rows joined with names '
+              'of their nodes, reading one inventory year at a time')
 @pass_metadata
-@click.option('-r', '--requirements', required=True, multiple=True,
-              type=click.Choice(['GRIDS', 'PARENTS', 'ALL']), default=['ALL'],
-              help='type(s) of import requirements to satisfy')
+@click.option('-f', '--format', 'format_', default='ndjson',
+              show_default=True,
+              type=click.Choice(sorted(export_.formats)),
+              help='format of output rows')
+@click.option('-s', '--sector', type=str,
+              help='name or UID of navigation node to filter the output')
+@years_option
 @click.argument('input_file', type=click.File('rb'),
                 default=click.get_text_stream('stdin'))
 @click.argument('output_file', type=click.File('w'),
                 default=click.get_text_stream('stdout'))
-def fix(metadata, requirements, input_file, output_file):
-    country_data = CountryData(metadata, input_file)
-    if 'PARENTS' in requirements or 'ALL' in requirements:
-        logger.info('transforming node list into tree')
-        for node, parent_node in country_data.reparent_nodes():
-            logger.debug('moving child node "%s" under parent node "%s"',
-                         node['uid'], parent_node['uid'])
-    if 'GRIDS' in requirements or 'ALL' in requirements:
-        logger.info('adding required template grids')
-        for node in country_data.traverse(country_data.nodes):
-            if node.get('template_node_uid'):
-                country_data.fix_node_grid(node)
-    country_data.dump(output_file)
+def export(metadata, format_, sector, years, input_file, output_file):
+    (country_data, inventories) = CountryData.stream(metadata, input_file,
+                                                     years=years)
+    ValueExport(country_data, sector).write(inventories, output_file,
+                                            format_)
 
 
-@data.command(help='output statistics for data file')
+@data.command(help='build SQLite database of data file, for querying '
+              'and filtering without parsing it again')
 @pass_metadata
+@click.argument('input_file', type=click.File('rb'))
+@click.argument('database', type=click.Path(dir_okay=False))
+def index(metadata, input_file, database):
+    CountryIndex.build(database, metadata, input_file)
+    logger.info('indexed %s into %s', input_file.name, database)
+
+
+@data.command(help='output rows of SQL query over database built by '
+              '"data index"')
+@click.option('-f', '--format', 'format_', default='ndjson',
+              show_default=True,
+              type=click.Choice(sorted(export_.formats)),
+              help='format of output rows')
+@click.argument('database', type=click.Path(exists=True, dir_okay=False))
+@click.argument('sql', type=str)
+@click.argument('output_file', type=click.File('w'),
+                default=click.get_text_stream('stdout'))
+def sql(format_, database, sql, output_file):
+    try:
+        (columns, rows) = CountryIndex(database).query(sql)
+    except sqlite3.Error as exc:
+        raise click.BadParameter(str(exc), param_hint='SQL')
+    count = export_.formats[format_](columns, rows, output_file)
+    logger.info('found %s rows', count)
+
+
+def file_stem(name):
+    """Return name of file without directory and extension."""
+    if not name or name == '-' or name.startswith('<'):
+        return 'country_data'
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+@data.command(help='split data file into files per inventory year')
+@click.option('--by', type=click.Choice(['year']), default='year',
+              show_default=True, help='how to split the data file')
+@click.option('-o', '--output-dir', default='.', show_default=True,
+              type=click.Path(file_okay=False, writable=True),
+              help='directory to write files into')
+@click.option('-p', '--pattern', default='{stem}.{year}.json',
+              show_default=True, help='pattern of output file names')
 @click.argument('input_file', type=click.File('rb'),
                 default=click.get_text_stream('stdin'))
-def stats(metadata, input_file):
-    country_data = CountryData(metadata, input_file)
-    for stat in country_data.count_statistics():
-        logger.info('%(label)s: %(objects_flat)s direct children, '
-                    '%(objects_nested)s objects, %(size)s bytes', stat)
+def split(by, output_dir, pattern, input_file):
+    stem = file_stem(getattr(input_file, 'name', ''))
+    os.makedirs(output_dir, exist_ok=True)
+    for year, tree in CountryData.iter_years(input_file):
+        path = os.path.join(output_dir, pattern.format(stem=stem, year=year))
+        logger.info('writing inventory year %s into %s', year, path)
+        with open(path, 'w') as output_file:
+            JSONTree(tree).dump(output_file)
+
+
+@data.command(help='output items of data file matching JSON path, '
+              'one per line')
+@click.argument('path', type=str)
+@click.argument('input_file', type=click.File('rb'),
+                default=click.get_text_stream('stdin'))
+@click.argument('output_file', type=click.File('w'),
+                default=click.get_text_stream('stdout'))
+def query(path, input_file, output_file):
+    try:
+        json_path = JSONPath.compile(path)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint='PATH')
+    count = 0
+    for count, item in enumerate(json_path.select(JSONTree(input_file).tree),
+                                 1):
+        json.dump(item, output_file)
+        output_file.write('\n')
+    logger.info('found %s matching items', count)
+
+
+@data.command(help='merge several partial data files into one')
+@click.option('-c', '--conflicts', default='error',
+              type=click.Choice(CountryDataMerger.policies),
+              help='which of conflicting objects to keep, or fail')
+@click.option('-o', '--output-file', type=click.File('w'),
+              default=click.get_text_stream('stdout'),
+              help='file to write merged data into')
+@click.argument('input_files', type=click.File('rb'), nargs=-1,
+                required=True)
+def merge(conflicts, output_file, input_files):
+    merger = CountryDataMerger(conflicts)
+    try:
+        tree = merger.merge_files(input_files)
+    except MergeConflict as exc:
+        raise click.ClickException(str(exc))
+    if merger.conflicts:
+        logger.info('resolved %s conflicts keeping %s value',
+                    len(merger.conflicts), conflicts)
+    JSONTree(tree).dump(output_file)
+
+
+@data.command(help='output differences between two versions of data file')
+@click.option('-f', '--format', 'format_', default='text',
+              type=click.Choice(['text', 'json']), help='output format')
+@click.argument('old_file', type=click.File('rb'))
+@click.argument('new_file', type=click.File('rb'))
+@click.argument('output_file', type=click.File('w'),
+                default=click.get_text_stream('stdout'))
+def diff(format_, old_file, new_file, output_file):
+    changes = diff_trees(JSONTree(old_file), JSONTree(new_file))
+    count = 0
+    if format_ == 'json':
+        output_file.write('[')
+    for count, change in enumerate(changes, 1):
+        if format_ == 'json':
+            output_file.write(',\n' if count > 1 else '\n')
+            json.dump(change, output_file)
+            continue
+        fields = change.get('fields')
+        output_file.write(
+            '{change} {section} {key} at {json_path}'.format(**change)
+            + (f': {", ".join(fields)}\n' if fields else '\n')
+        )
+    if format_ == 'json':
+        output_file.write('\n]\n')
+    logger.info('found %s differences', count)
+
+
+@main.group(help='group of commands for managing cached results')
+def cache():
+    pass
+
+
+@cache.command(name='stats', help='output size of cached results')
+@click.pass_context
+def cache_stats(ctx):
+    stats = ctx.meta['etf.cache'].stats()
+    stats['size'] = pformat_size(stats['size'])
+    stats['max_size'] = pformat_size(stats['max_size'])
+    logger.info('%(path)s: %(entries)s cached results, '
+                '%(size)s of %(max_size)s bytes', stats)
+
+
+@cache.command(help='evict least recently used cached results')
+@click.option('--max-size', type=SIZE, default=None,
+              help='size to shrink the cache to, 0 clears the cache')
+@click.pass_context
+def prune(ctx, max_size):
+    ctx.meta['etf.cache'].prune(max_size)
 
 
 if __name__ == '__main__':
@@ -1,14 +1,50 @@
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import functools
+import json
 import logging
-import secrets
+import marshal
+import mmap
+import os
+import re
+import stat
 
+from . import metrics, scanner
+from .cow import CowList, overlay, resolve
 from .json import JSONCatalog, JSONTree
+from .records import (
+    Grid, Inventory, LineDescription, Node, Value, Variable, convert_list,
+    record_hook
+)
+from .splice import SourceSpans, SpliceWriter
+from .uids import make_allocator
 from .util import pformat_size, sizeof_dict
 
 
 logger = logging.getLogger(__name__)
 
+INVENTORY_YEAR = re.compile(rb'\{\s*"inventory_year"\s*:\s*')
+INVENTORY_VALUES = re.compile(rb'\s*,\s*"values"\s*:\s*(?=\[)')
+
+FILTERED_ITEMS = metrics.REGISTRY.counter(
+    'etf_filter_items_total', 'items checked by CountryData.filter_out',
+    ['result']
+)
+
+
+def parse_block(source, span, load_options):
+    """Parse JSON block in a worker process. The block is `source`
+    bytes, or the `span` of the file at `source` path, mapped into
+    memory. Plain values are returned marshalled, which is the fastest
+    to load back."""
+    if span is not None:
+        with open(source, 'rb') as source_file, \
+                mmap.mmap(source_file.fileno(), 0,
+                          access=mmap.ACCESS_READ) as buffer:
+            source = buffer[span[0]:span[1]]
+    result = json.loads(source, **load_options)
+    return result if load_options else marshal.dumps(result)
+
 
 class CountryData(JSONTree):
 
@@ -22,22 +58,283 @@ class CountryData(JSONTree):
         ('Country specific line descriptions',
          'country_specific_data.line_description'),
         ('Country specific (meta)data', 'country_specific_data'),
-        ('Country data', 'data')
+        ('Country data', 'data'),
+        ('Country data values', 'data.values[*].values')
     ]
 
-    def __init__(self, metadata, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    spans = None  # source positions of containers, for splicing dumps
+
+    def __init__(self, metadata, data, uid_mode='random', records=False,
+                 years=None, splice=False, parse_jobs=1, **kwargs):
+        # records replace plain dicts of entities, see records.Record
+        if records:
+            kwargs.setdefault('object_pairs_hook', record_hook)
+        source_file = self.source_file(data) if splice else None
+        if splice:
+            data = self.read_source(data)
+        if years is not None:
+            source = data
+            data = self.read_years(data, years)
+            if data is not source:
+                source_file = None
+        buffer = data
+        if parse_jobs > 1:
+            data = self.parse_parallel(data, parse_jobs, **kwargs)
+        super().__init__(data, **kwargs)
+        if splice and isinstance(buffer, (bytes, bytearray)):
+            self.spans = self.scan_spans(buffer, source_file)
+        self.records = records
         self.metadata = metadata
+        # deterministic UIDs are reproducible, as required by caching
+        self.uid_mode = uid_mode
+        self.uid_allocator = make_allocator(uid_mode)
+        self.issued_uids = set()
         self.node_index = JSONCatalog(
             ['uid', 'parent_uid', 'template_node_uid', 'name_prefix', 'name'],
-            self.traverse(self.nodes)
+            self.traverse(self.nodes, via='node'),
+            name='country_nodes'
         )
         self.variable_index = JSONCatalog(
             ['uid', 'node_uid', 'template_var_uid'],
-            self.variables
+            self.variables,
+            name='country_variables',
+            # answers lookups of variables required by cloned grids
+            composite=[('node_uid', 'template_var_uid')]
+        )
+        self.grid_index = JSONCatalog(['node_uid'], self.grids,
+                                      name='country_grids')
+        # catalogs of collections, kept in sync by filter_out()
+        self.catalogs = {
+            id(self.nodes): self.node_index,
+            id(self.variables): self.variable_index,
+            id(self.grids): self.grid_index,
+        }
+        if years is not None and 'data' in self.tree:
+            # exact selection, in case source could not be cut
+            self.filter_out(
+                self['data']['values'],
+                lambda inventory: inventory['inventory_year'] in years
+            )
+
+    def variant(self, uid_mode=None):
+        """Return country data sharing the tree of this one, with its
+        changes recorded in copy-on-write overlays, see cow.Overlay.
+
+        Variants cost the memory of their differences only. The shared
+        tree must not be modified while variants are in use."""
+        result = self.__class__(
+            self.metadata,
+            {key: overlay(value) for (key, value) in self.tree.items()},
+            uid_mode=uid_mode or self.uid_mode
+        )
+        # overlays track their modifications, spans are only read
+        result.spans = self.spans
+        result.issued_uids.update(self.issued_uids)
+        return result
+
+    @staticmethod
+    def read_source(data):
+        if hasattr(data, 'read'):
+            logger.info('reading %s', getattr(data, 'name', 'input'))
+            data = data.read()
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+        return data
+
+    @staticmethod
+    def source_file(data):
+        """Return binary file, which content will be read whole,
+        or None."""
+        try:
+            if 'b' in data.mode and data.tell() == 0 \
+                    and stat.S_ISREG(os.fstat(data.fileno()).st_mode):
+                return data
+        except (AttributeError, OSError, TypeError, ValueError):
+            pass
+        return None
+
+    def scan_spans(self, buffer, source_file=None):
+        """Locate containers of the tree in the source, down to
+        items of country specific collections and inventory years."""
+        spans = SourceSpans(buffer, source_file)
+        inventories = self.tree.get('data', {}).get('values')
+        located = scanner.anchored_elements(buffer, 'inventory_year')
+        if located is not None and inventories is not None:
+            (start, end, elements) = located
+            if [year for (year, _, _) in elements] == \
+                    [inventory['inventory_year'] for inventory in inventories]:
+                # inventory years are not scanned, as being the bulk of data
+                spans.add(inventories, start, end)
+                for (inventory, (_, begin, finish)) in \
+                        zip(inventories, elements):
+                    spans.add(inventory, begin, finish, inventories)
+                    self.scan_inventory_values(spans, inventory, begin,
+                                               finish)
+        spans.scan(self.tree, scanner.start_position(buffer), depth=3)
+        logger.debug('located %s containers in source', len(spans.spans))
+        return spans
+
+    @staticmethod
+    def scan_inventory_values(spans, inventory, start, end):
+        # common layout {"inventory_year": ..., "values": [...]}
+        # is recognised without scanning the values
+        if tuple(inventory) != ('inventory_year', 'values'):
+            return
+        buffer = spans.buffer
+        match = INVENTORY_YEAR.match(buffer, start)
+        if match is None:
+            return
+        match = INVENTORY_VALUES.match(
+            buffer, scanner.skip_value(buffer, match.end())
         )
-        self.grid_index = JSONCatalog(['node_uid'],
-                                      self.traverse(self.grids))
+        closing = scanner.skip_back(buffer, end - 1)
+        if match is not None and buffer[closing:closing + 1] == b']':
+            spans.add(inventory['values'], match.end(), closing + 1,
+                      inventory)
+
+    @classmethod
+    def read_years(cls, data, years):
+        """Read JSON source cutting out data values of inventory years
+        other than given, without parsing them."""
+        data = cls.read_source(data)
+        if not isinstance(data, (bytes, bytearray)):
+            return data
+        located = scanner.anchored_elements(data, 'inventory_year')
+        if located is None:
+            logger.debug('inventory years not located, parsing all of them')
+            return data
+        (start, end, inventories) = located
+        selected = [data[begin:finish]
+                    for (year, begin, finish) in inventories if year in years]
+        logger.info('skipping %s of %s inventory years',
+                    len(inventories) - len(selected), len(inventories))
+        return b''.join([data[:start], b'[', b','.join(selected), b']',
+                         data[end:]])
+
+    @classmethod
+    def iter_years(cls, data):
+        """Iterate over (inventory year, tree) pairs, where each tree
+        only holds data values of one inventory year. If the source can
+        be cut, only one inventory year is parsed at a time."""
+        data = cls.read_source(data)
+        located = None
+        if isinstance(data, (bytes, bytearray)):
+            located = scanner.anchored_elements(data, 'inventory_year')
+        if located is not None:
+            (start, end, inventories) = located
+            for (year, begin, finish) in inventories:
+                yield year, JSONTree(b''.join([
+                    data[:start], b'[', data[begin:finish], b']', data[end:]
+                ])).tree
+            return
+        tree = JSONTree(data).tree
+        for inventory in tree['data']['values']:
+            # shallow copies share everything but the list of years
+            yield inventory['inventory_year'], dict(
+                tree, data=dict(tree['data'], values=[inventory])
+            )
+
+    @classmethod
+    def map_source(cls, data):
+        """Map regular file into memory, otherwise read it."""
+        source_file = cls.source_file(data)
+        if source_file is not None:
+            try:
+                return mmap.mmap(source_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # empty or not mappable file
+                pass
+        return cls.read_source(data)
+
+    @classmethod
+    def parse_parallel(cls, data, jobs, **load_options):
+        """Return tree parsed from JSON source, with inventory years
+        parsed by `jobs` worker processes, while the rest of the tree is
+        parsed by this one. Return the source as it is, if it cannot be
+        cut into inventory years."""
+        source = cls.map_source(data)
+        try:
+            return cls._parse_parallel(source, cls.source_file(data), jobs,
+                                       **load_options)
+        finally:
+            if isinstance(source, mmap.mmap):
+                source.close()
+
+    @classmethod
+    def _parse_parallel(cls, source, source_file, jobs, **load_options):
+
+        def serially(reason, *args):
+            logger.debug(reason + ', parsing serially', *args)
+            return source[:] if isinstance(source, mmap.mmap) else source
+
+        located = None
+        if isinstance(source, (bytes, bytearray, mmap.mmap)):
+            located = scanner.anchored_elements(source, 'inventory_year')
+        if located is None or len(located[2]) < 2:
+            return serially('inventory years not located')
+        (start, end, elements) = located
+        skeleton = b''.join([source[:start], b'[]', source[end:]])
+        # workers map regular files themselves, other sources are
+        # passed to them in slices
+        path = source_file.name if isinstance(source, mmap.mmap) else None
+        logger.info('parsing %s inventory years in %s processes',
+                    len(elements), min(jobs, len(elements)))
+        try:
+            with ProcessPoolExecutor(min(jobs, len(elements))) as executor:
+                futures = [
+                    executor.submit(parse_block, path, (begin, finish),
+                                    load_options) if path is not None
+                    else executor.submit(parse_block, source[begin:finish],
+                                         None, load_options)
+                    for (_, begin, finish) in elements
+                ]
+                tree = cls.from_json_bytes(skeleton, **load_options)
+                inventories = [future.result() for future in futures]
+        except (BrokenProcessPool, OSError, ValueError) as exc:
+            # no processes on this platform, workers killed, or blocks
+            # not cut at inventory years
+            return serially('parallel parsing failed: %s', exc)
+        if not load_options:
+            inventories = [marshal.loads(inventory)
+                           for inventory in inventories]
+        values = tree.get('data', {}).get('values')
+        if values != []:
+            return serially('inventory years are not data values')
+        values.extend(inventories)
+        return tree
+
+    @classmethod
+    def cut_years(cls, data, years=None):
+        """Return JSON source without data values, and iterator over
+        inventories parsed one at a time. Return the whole source and
+        None if it cannot be cut."""
+        source = cls.map_source(data)
+        located = None
+        if isinstance(source, (bytes, bytearray, mmap.mmap)):
+            located = scanner.anchored_elements(source, 'inventory_year')
+        if located is None:
+            if isinstance(source, mmap.mmap):
+                source = source[:]
+            return source, None
+        (start, end, elements) = located
+
+        def inventories():
+            for (year, begin, finish) in elements:
+                if years is None or year in years:
+                    yield json.loads(source[begin:finish])
+
+        return b''.join([source[:start], b'[]', source[end:]]), inventories()
+
+    @classmethod
+    def stream(cls, metadata, data, years=None, **kwargs):
+        """Return country data without data values, and iterator over
+        inventories parsed one at a time, if the source can be cut."""
+        (source, inventories) = cls.cut_years(data, years)
+        if inventories is None:
+            country_data = cls(metadata, source, years=years, **kwargs)
+            return country_data, iter(country_data.data)
+        return cls(metadata, source, **kwargs), inventories
 
     @functools.cached_property
     def root(self):
@@ -47,25 +344,39 @@ class CountryData(JSONTree):
     def country_metadata(self):
         return self.root['country_specific_data']
 
+    def as_records(self, items, record_type, via=None):
+        return convert_list(items, record_type, via) if self.records \
+            else items
+
     @functools.cached_property
     def nodes(self):
-        return self.country_metadata['nodes']
+        return self.as_records(self.country_metadata['nodes'], Node, 'node')
 
     @functools.cached_property
     def variables(self):
-        return self.country_metadata['variables']
+        return self.as_records(self.country_metadata['variables'], Variable)
+
+    def collection(self, key):
+        if key not in self.country_metadata:
+            self.country_metadata[key] = []
+            self.invalidate(self.country_metadata)
+        return self.country_metadata[key]
 
     @functools.cached_property
     def grids(self):
-        return self.country_metadata.setdefault('grids', [])
+        return self.as_records(self.collection('grids'), Grid)
 
     @functools.cached_property
     def line_descriptions(self):
-        return self.country_metadata.setdefault('line_description', [])
+        return self.as_records(self.collection('line_description'),
+                               LineDescription)
 
     @functools.cached_property
     def data(self):
-        return self['data']['values']
+        inventories = self.as_records(self['data']['values'], Inventory)
+        for inventory in inventories:
+            self.as_records(inventory['values'], Value)
+        return inventories
 
     @staticmethod
     def is_metadata_uid(uid):
@@ -89,48 +400,96 @@ class CountryData(JSONTree):
         old_len = len(sector_uids)
         for node in self.nodes:
             if 'parent_uid' in node and node['parent_uid'] in sector_uids:
-                for child in self.traverse(node):
+                for child in self.traverse(node, via='node'):
                     sector_uids.add(child['uid'])
         logger.info('collected %s country specific node uids',
                     len(sector_uids) - old_len)
         return result
 
-    @staticmethod
-    def filter_out(item_list, filter_func, valid_uids=None):
+    def filter_out(self, item_list, filter_func, valid_uids=None):
+        """Remove items rejected by `filter_func` from the list in place,
+        keeping indexes in sync. Return indexes of removed items."""
         to_delete = []
-        for index, item in enumerate(item_list):
+        kept = []
+        # overlays are filtered by their contents, not wrapping each item
+        is_overlay = type(item_list) is CowList
+        items = item_list.contents() if is_overlay else item_list
+        for index, item in enumerate(items):
             if filter_func(item):
+                kept.append(item)
                 if valid_uids is not None:
                     valid_uids.add(item['uid'])
             else:
                 to_delete.append(index)
-        for index in reversed(to_delete):
-            del item_list[index]
+        if metrics.enabled:
+            FILTERED_ITEMS.inc('kept', amount=len(kept))
+            FILTERED_ITEMS.inc('dropped', amount=len(to_delete))
+        if to_delete:
+            catalog = self.catalogs.get(id(item_list))
+            if catalog is not None:
+                for index in to_delete:
+                    for item in self.traverse(item_list[index], via='node'):
+                        catalog.unindex(item)
+            if is_overlay:
+                item_list.assign(kept)
+            else:
+                item_list[:] = kept
+            self.invalidate(item_list)
         return to_delete
 
-    @staticmethod
-    def make_uid():
-        return secrets.token_hex(12)
+    def is_uid_taken(self, uid):
+        return uid in self.issued_uids \
+            or self.node_index.first(uid=uid) is not None \
+            or self.variable_index.first(uid=uid) is not None
+
+    def invalidate(self, *changed):
+        super().invalidate(*changed)
+        if self.spans is not None:
+            for item in changed:
+                self.spans.mark_dirty(item)
+
+    def json_value(self):
+        # overlays are resolved upfront, so that the encoder does not
+        # call `default` for each of them
+        return {key: resolve(value) for (key, value) in self.tree.items()}
+
+    def dump(self, output, **kwargs):
+        if self.spans is None:
+            return super().dump(output, **kwargs)
+        SpliceWriter(self.spans, indent=kwargs.get('indent', 4),
+                     default=kwargs.get('default', self.encode_object)
+                     ).write(self.tree, output)
+
+    def make_uid(self, *name):
+        """Allocate new UID, derived from `name` in deterministic mode."""
+        uid = self.uid_allocator(*name)
+        while self.is_uid_taken(uid):
+            logger.debug('UID "%s" is taken, allocating another one', uid)
+            uid = self.uid_allocator(*name)
+        self.issued_uids.add(uid)
+        return uid
 
     def make_variable(self, node_uid, template_var_uid):
         result = {
-            'uid': self.make_uid(),
+            'uid': self.make_uid('variable', node_uid, template_var_uid),
             'node_uid': node_uid,
             'template_var_uid': template_var_uid
         }
         self.variables.append(result)
         self.variable_index.index(result)
+        self.invalidate(self.variables)
         return result
 
     def clone_grid_from_template(self, template_node_uid, node_uid):
-        result = deepcopy(self.get_grid(template_node_uid))
+        # template is shared by the clone, except for modified parts
+        result = overlay(self.get_grid(template_node_uid))
         result['node_uid'] = node_uid
         for group in self.traverse(result['group']):
             if 'uid' not in group or 'variable_uid' not in group:
                 # only traverse nested groups
                 continue
             group['template_group_uid'] = group['uid']
-            group['uid'] = self.make_uid()
+            group['uid'] = self.make_uid('group', node_uid, group['uid'])
             template_var_uid = group['variable_uid']
             if template_var_uid is None:
                 continue
@@ -172,7 +531,12 @@ class CountryData(JSONTree):
             self.node_index.clear()
             for index in reversed(nested_nodes):
                 del self.nodes[index]
-            self.node_index.index_iterable(self.traverse(self.nodes))
+            self.node_index.index_iterable(
+                self.traverse(self.nodes, via='node')
+            )
+            # moved nodes may be nested below located ones
+            self.invalidate(self.nodes, *self.traverse(self.nodes,
+                                                       via='node'))
 
     def fix_node_grid(self, node):
         if 'template_node_uid' not in node:
@@ -184,29 +548,106 @@ class CountryData(JSONTree):
         grid = self.get_grid(node_uid, fallback_to_metadata=False)
         if grid is not None:
             return
-        logger.debug('detected country specific node without grid, '
-                     'uid="%s", path "%s"', node_uid, self.json_path(node))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('detected country specific node without grid, '
+                         'uid="%s", path "%s"', node_uid,
+                         self.json_path(node))
         template_node_uid = node['template_node_uid']
         new_grid = self.clone_grid_from_template(template_node_uid, node_uid)
         self.grids.append(new_grid)
         self.grid_index.index(new_grid)
+        self.invalidate(self.grids)
+
+    def filter_sector(self, sector):
+        """Remove objects and data values not belonging to the sector,
+        given by name or UID of navigation node. Return UIDs of sector
+        variables."""
+        filter_ = self.metadata.get_sector_filter(sector)
+        sector_uids = self.collect_sector_uids(filter_)
+        sector_node_uids = sector_uids['nodes']
+        # country specific nodes can form the tree,
+        # but flat list filtering should still work
+        # because if the node /not/ belongs to specified sector
+        # then all its children are the same
+        deleted = self.filter_out(
+            self.nodes,
+            lambda node: (
+                node['uid'] in sector_node_uids
+                or node.get('parent_uid') in sector_node_uids
+                or node.get('template_node_uid') in sector_node_uids
+            ),
+            sector_node_uids
+        )
+        logger.info('filtered out %s nodes not belonging to sector "%s"',
+                    len(deleted), sector)
+        sector_variable_uids = sector_uids['variables']
+        deleted = self.filter_out(
+            self.variables,
+            lambda variable: (
+                variable['uid'] in sector_variable_uids
+                or variable.get('node_uid') in sector_node_uids
+            ),
+            sector_variable_uids
+        )
+        logger.info('filtered out %s variables not belonging to sector "%s"',
+                    len(deleted), sector)
+        deleted = self.filter_out(
+            self.grids,
+            lambda grid: grid['node_uid'] in sector_node_uids
+        )
+        logger.info('filtered out %s grids not belonging to sector "%s"',
+                    len(deleted), sector)
+        deleted = self.filter_out(
+            self.line_descriptions,
+            lambda line_desc: line_desc['variable_uid'] in sector_variable_uids
+        )
+        logger.info('filtered out %s line descriptions '
+                    'not belonging to sector "%s"', len(deleted), sector)
+        for inventory in self.data:
+            year = inventory['inventory_year']
+            deleted = self.filter_out(
+                inventory['values'],
+                lambda value: value['variable_uid'] in sector_variable_uids
+            )
+            logger.info('filtered out %s data values for year %s '
+                        'not belonging to sector "%s"',
+                        len(deleted), year, sector)
+        return sector_variable_uids
+
+    def fix(self, requirements=('ALL',), uid_mode=None):
+        """Satisfy import requirements: PARENTS, GRIDS or ALL."""
+        if uid_mode is not None:
+            self.uid_mode = uid_mode
+            self.uid_allocator = make_allocator(uid_mode)
+        if 'PARENTS' in requirements or 'ALL' in requirements:
+            logger.info('transforming node list into tree')
+            for node, parent_node in self.reparent_nodes():
+                logger.debug('moving child node "%s" under parent node "%s"',
+                             node['uid'], parent_node['uid'])
+        if 'GRIDS' in requirements or 'ALL' in requirements:
+            logger.info('adding required template grids')
+            # parents are recorded for paths of nodes logged on debug
+            for node in self.traverse(self.nodes, via='node',
+                                      record_parents=True):
+                if node.get('template_node_uid'):
+                    self.fix_node_grid(node)
 
     def count_statistics(self):
         result = []
         for (label, json_path) in self.stat_points:
-            item = self.locate(json_path)
-            length = index = size = 0
-            if item is not None:
+            length = count = size = 0
+            # wildcard paths sum up statistics of all matching items
+            for item in self.select(json_path):
                 if not self.is_object(item):
                     # JSON array, report also flat length
-                    length = len(item)
-                for index, child in enumerate(self.traverse(item)):
+                    length += len(item)
+                for child in self.traverse(item):
+                    count += 1
                     size += sizeof_dict(child)
-                index += 1
             result.append({
                 'label': label,
                 'objects_flat': length,
-                'objects_nested': index,
+                'objects_nested': count,
                 'size': pformat_size(size)
             })
         return result
@@ -0,0 +1,260 @@
+from collections.abc import MutableMapping, MutableSequence
+from copy import deepcopy
+import weakref
+
+from .json import JSONTreeWalker
+
+
+class Overlay:
+    """Copy-on-write overlay of JSON container.
+
+    Reads fall through to the base container, which is never modified.
+    The first write makes a shallow copy of the base container only,
+    nested containers are wrapped in overlays of their own when read,
+    so unchanged subtrees stay shared with the base.
+
+    Overlays of base children are remembered weakly, so each child has
+    one overlay while it is referenced. Modified overlays are pinned by
+    their parent overlay and stay alive with it."""
+
+    __slots__ = ('base', 'parent', 'modified', '_own', '_children',
+                 '_pinned', '_new', '__weakref__')
+
+    def __init__(self, base, parent=None):
+        self.base = base
+        self.parent = parent
+        # overlay differs from base, by itself or by descendants
+        self.modified = False
+        self._own = None  # shallow copy of base, made on first write
+        self._children = None  # id of base child -> its overlay
+        self._pinned = None  # id of base child -> its modified overlay
+        self._new = None  # ids of objects added into the overlay
+
+    def _contents(self):
+        return self.base if self._own is None else self._own
+
+    def _wrap(self, value):
+        """Return overlay of child container read from contents."""
+        if type(value) in OVERLAY_TYPES \
+                or not JSONTreeWalker.is_json_container(value):
+            return value
+        object_id = id(value)
+        if self._new is not None and object_id in self._new:
+            return value
+        if self._pinned is not None \
+                and (child := self._pinned.get(object_id)) is not None:
+            return child
+        if self._children is None:
+            self._children = weakref.WeakValueDictionary()
+        child = self._children.get(object_id)
+        if child is None:
+            child = self._children[object_id] = overlay(value, self)
+        return child
+
+    def _store(self, value):
+        """Return value to keep in own contents for written `value`."""
+        if type(value) in OVERLAY_TYPES:
+            value.parent = self
+            if value.modified:
+                return value
+            # unmodified overlay is kept as its base, found by _wrap()
+            if self._children is None:
+                self._children = weakref.WeakValueDictionary()
+            self._children[id(value.base)] = value
+            return value.base
+        if JSONTreeWalker.is_array(value):
+            # added arrays get overlays too, keeping parents of overlays
+            # moved into them
+            child = CowList(value, self)
+            child.modified = True
+            return child
+        if JSONTreeWalker.is_json_container(value):
+            if self._new is None:
+                self._new = set()
+            self._new.add(id(value))
+        return value
+
+    def _write(self):
+        """Return own contents to be modified."""
+        if self._own is None:
+            self._own = self._copy(self.base)
+        self._touch()
+        return self._own
+
+    def _touch(self):
+        child = self
+        child.modified = True
+        while (parent := child.parent) is not None:
+            if parent._pinned is None:
+                parent._pinned = {}
+            parent._pinned[id(child.base)] = child
+            if parent.modified:
+                break
+            parent.modified = True
+            child = parent
+
+    def _pinned_contents(self):
+        """Return own contents with modified children substituted."""
+        contents = self._contents()
+        if not self._pinned:
+            return contents
+        return self._substitute(contents, self._pinned)
+
+    def contents(self):
+        """Return contents to be read only, with base children as they
+        are and modified children as their overlays."""
+        return self._pinned_contents()
+
+    def json_value(self):
+        """Return JSON encodable value of the overlay, the base itself
+        if not modified."""
+        return self._pinned_contents() if self.modified else self.base
+
+    def __deepcopy__(self, memo):
+        return deepcopy(self.json_value(), memo)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.json_value()!r})'
+
+
+class CowDict(Overlay, MutableMapping):
+
+    __slots__ = ()
+    _copy = dict
+
+    @staticmethod
+    def _substitute(contents, pinned):
+        return {key: pinned.get(id(value), value)
+                for (key, value) in contents.items()}
+
+    def __getitem__(self, key):
+        return self._wrap(self._contents()[key])
+
+    def get(self, key, default=None):
+        contents = self._contents()
+        if key not in contents:
+            return default
+        return self._wrap(contents[key])
+
+    def __contains__(self, key):
+        return key in self._contents()
+
+    def setdefault(self, key, default=None):
+        if key not in self._contents():
+            self[key] = default
+        return self[key]
+
+    def __setitem__(self, key, value):
+        self._write()[key] = self._store(value)
+
+    def __delitem__(self, key):
+        if key not in self._contents():
+            raise KeyError(key)
+        del self._write()[key]
+
+    def __iter__(self):
+        return iter(self._contents())
+
+    def __len__(self):
+        return len(self._contents())
+
+    # lists like those of records, walkers reverse them
+    def values(self):
+        wrap = self._wrap
+        return [wrap(value) for value in self._contents().values()]
+
+    def items(self):
+        wrap = self._wrap
+        return [(key, wrap(value))
+                for (key, value) in self._contents().items()]
+
+
+class CowList(Overlay, MutableSequence):
+
+    __slots__ = ()
+    _copy = list
+
+    @staticmethod
+    def _substitute(contents, pinned):
+        return [pinned.get(id(value), value) for value in contents]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._wrap(value) for value in self._contents()[index]]
+        return self._wrap(self._contents()[index])
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [self._store(item) for item in value]
+        else:
+            value = self._store(value)
+        self._write()[index] = value
+
+    def __delitem__(self, index):
+        # raise IndexError before copying
+        self._contents()[index]
+        del self._write()[index]
+
+    def insert(self, index, value):
+        self._write().insert(index, self._store(value))
+
+    def assign(self, items):
+        """Replace all items with items taken from contents()."""
+        self._write()[:] = items
+
+    def __iter__(self):
+        wrap = self._wrap
+        for value in self._contents():
+            yield wrap(value)
+
+    def __reversed__(self):
+        wrap = self._wrap
+        for value in reversed(self._contents()):
+            yield wrap(value)
+
+    def __len__(self):
+        return len(self._contents())
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, CowList)):
+            return NotImplemented
+        return len(self) == len(other) \
+            and all(item == other_item
+                    for (item, other_item) in zip(self, other))
+
+
+OVERLAY_TYPES = {CowDict, CowList}
+
+JSONTreeWalker.register_object_type(CowDict, Overlay.json_value)
+JSONTreeWalker.register_array_type(CowList, Overlay.json_value)
+
+
+def overlay(item, parent=None):
+    """Return overlay of JSON container, other values as they are."""
+    if type(item) in OVERLAY_TYPES:
+        return item
+    if JSONTreeWalker.is_object(item):
+        return CowDict(item, parent)
+    if JSONTreeWalker.is_array(item):
+        return CowList(item, parent)
+    return item
+
+
+def unwrap(item):
+    """Return base of unmodified overlay, otherwise the item."""
+    if type(item) in OVERLAY_TYPES and not item.modified:
+        return item.base
+    return item
+
+
+def resolve(item):
+    """Return JSON value of item with overlays replaced by plain
+    containers, sharing their unmodified parts."""
+    if type(item) not in OVERLAY_TYPES:
+        return item
+    if not item.modified:
+        return item.base
+    contents = item.contents()
+    if type(item) is CowDict:
+        return {key: resolve(value) for (key, value) in contents.items()}
+    return [resolve(value) for value in contents]
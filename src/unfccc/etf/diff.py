@@ -0,0 +1,203 @@
+from hashlib import blake2b
+import logging
+
+from .json import SCALAR_TYPES, JSONTree, JSONTreeWalker
+
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SIZE = 16
+
+
+def _feed(digest, item):
+    type_ = type(item)
+    if type_ is str:
+        data = item.encode('utf-8')
+        digest.update(b's%d:' % len(data))
+        digest.update(data)
+    elif type_ in SCALAR_TYPES:
+        # numbers, true, false and null, told apart by their repr
+        digest.update(b'n%s;' % repr(item).encode('ascii'))
+    elif JSONTreeWalker.is_json_container(item):
+        # records, overlays and read-only containers of shared
+        # metadata hash as their plain kind
+        digest.update(fingerprint(item))
+    else:
+        raise TypeError(f'{type_.__name__} is not a JSON type')
+
+
+def fingerprint(item, exclude=()):
+    """Return content hash of JSON subtree.
+
+    Object keys are hashed in sorted order, so key order is insignificant,
+    array order is significant. Keys listed in `exclude` are skipped."""
+    if JSONTreeWalker.is_object(item):
+        digest = blake2b(b'{', digest_size=DIGEST_SIZE)
+        for key in sorted(item):
+            if key in exclude:
+                continue
+            _feed(digest, key)
+            _feed(digest, item[key])
+        return digest.digest()
+    is_array = JSONTreeWalker.is_array(item)
+    digest = blake2b(b'[' if is_array else b'', digest_size=DIGEST_SIZE)
+    if is_array:
+        for child in item:
+            _feed(digest, child)
+    else:
+        _feed(digest, item)
+    return digest.digest()
+
+
+class Entity:
+
+    __slots__ = ('key', 'path', 'digest', 'item')
+
+    def __init__(self, key, path, digest, item):
+        self.key = key
+        self.path = path
+        self.digest = digest
+        self.item = item
+
+
+class TreeFingerprints:
+    """Merkle fingerprints of a country data tree.
+
+    Entities are matched by uid in country specific collections
+    and by (inventory_year, variable_uid) in yearly values. Each section
+    fingerprint is combined from fingerprints of its entities,
+    so the whole tree is hashed in one pass."""
+
+    collections = {
+        'dimension_instances': 'uid',
+        'nodes': 'uid',
+        'variables': 'uid',
+        'grids': 'node_uid',
+        'drop_downs': 'uid',
+        'line_description': 'variable_uid',
+    }
+
+    def __init__(self, tree):
+        if isinstance(tree, JSONTree):
+            tree = tree.tree
+        # section name -> (label, digest, {key: Entity})
+        self.sections = {}
+        root_digest = blake2b(b'root', digest_size=DIGEST_SIZE)
+        for key in sorted(tree):
+            value = tree[key]
+            if key == 'country_specific_data' and isinstance(value, dict):
+                self.add_country_metadata(value)
+            elif key == 'data' and isinstance(value, dict) \
+                    and isinstance(value.get('values'), list):
+                self.add_data(value)
+            else:
+                self.add_section(key, {
+                    key: Entity(key, f'.{key}', fingerprint(value), value)
+                })
+            _feed(root_digest, key)
+        for section in sorted(self.sections):
+            root_digest.update(self.sections[section][1])
+        self.digest = root_digest.digest()
+
+    def add_section(self, section, entities, label=None):
+        digest = blake2b(section.encode('utf-8'), digest_size=DIGEST_SIZE)
+        for entity in entities.values():
+            _feed(digest, str(entity.key))
+            digest.update(entity.digest)
+        self.sections[section] = (label or section, digest.digest(), entities)
+
+    def add_country_metadata(self, country_metadata):
+        for collection, items in country_metadata.items():
+            path = f'.country_specific_data.{collection}'
+            key_attr = self.collections.get(collection)
+            if key_attr is None or not isinstance(items, list):
+                self.add_section(collection, {
+                    collection: Entity(collection, path,
+                                       fingerprint(items), items)
+                })
+                continue
+            entities = {}
+            self.add_entities(entities, items, key_attr, path)
+            self.add_section(collection, entities)
+
+    def add_entities(self, entities, items, key_attr, path):
+        for index, item in enumerate(items):
+            item_path = f'{path}[{index}]'
+            key = item.get(key_attr, item_path)
+            children = item.get('node') if key_attr == 'uid' else None
+            if isinstance(children, list):
+                # nested nodes are matched on their own,
+                # the parent only fingerprints their uids
+                digest = blake2b(fingerprint(item, exclude=('node',)),
+                                 digest_size=DIGEST_SIZE)
+                for child in children:
+                    _feed(digest, child.get('uid'))
+                entities[key] = Entity(key, item_path, digest.digest(), item)
+                self.add_entities(entities, children, key_attr,
+                                  f'{item_path}.node')
+            else:
+                entities[key] = Entity(key, item_path, fingerprint(item),
+                                       item)
+
+    def add_data(self, data):
+        # every inventory year is a separate section,
+        # so unchanged years are skipped as a whole
+        for index, inventory in enumerate(data['values']):
+            year = inventory.get('inventory_year')
+            path = f'.data.values[{index}]'
+            entities = {}
+            for value_index, value in enumerate(inventory.get('values', [])):
+                key = (year, value.get('variable_uid'))
+                entities[key] = Entity(key, f'{path}.values[{value_index}]',
+                                       fingerprint(value), value)
+            self.add_section(f'values {year}', entities, 'values')
+        for key, value in data.items():
+            if key != 'values':
+                self.add_section(f'data.{key}', {
+                    key: Entity(key, f'.data.{key}', fingerprint(value), value)
+                })
+
+
+def changed_fields(old, new):
+    if not (isinstance(old, dict) and isinstance(new, dict)):
+        return []
+    return sorted(
+        key for key in old.keys() | new.keys()
+        if key not in old or key not in new
+        or fingerprint(old[key]) != fingerprint(new[key])
+    )
+
+
+def diff(old, new):
+    """Yield differences between two country data trees.
+
+    Each difference is a dict with keys `change` (added, removed or
+    changed), `section`, `key` and `json_path`, changed entities also
+    list names of changed `fields`. Sections with equal fingerprints
+    are skipped without comparing their entities."""
+    old = old if isinstance(old, TreeFingerprints) else TreeFingerprints(old)
+    new = new if isinstance(new, TreeFingerprints) else TreeFingerprints(new)
+    if old.digest == new.digest:
+        return
+    for section in sorted(old.sections.keys() | new.sections.keys()):
+        (label, old_digest, old_entities) = \
+            old.sections.get(section, (None, None, {}))
+        (label, new_digest, new_entities) = \
+            new.sections.get(section, (label, None, {}))
+        if old_digest == new_digest:
+            logger.debug('section %s is unchanged', section)
+            continue
+        for key, entity in old_entities.items():
+            if key not in new_entities:
+                yield {'change': 'removed', 'section': label,
+                       'key': key, 'json_path': entity.path}
+        for key, entity in new_entities.items():
+            old_entity = old_entities.get(key)
+            if old_entity is None:
+                yield {'change': 'added', 'section': label,
+                       'key': key, 'json_path': entity.path}
+            elif old_entity.digest != entity.digest:
+                yield {'change': 'changed', 'section': label,
+                       'key': key, 'json_path': entity.path,
+                       'fields': changed_fields(old_entity.item,
+                                                entity.item)}
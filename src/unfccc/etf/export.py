@@ -0,0 +1,169 @@
+import csv
+import io
+import json
+import logging
+
+from .json import JSONTreeWalker
+
+
+logger = logging.getLogger(__name__)
+
+
+class ValueExport:
+    """Flat rows of inventory data values, joined with their variables,
+    nodes and sectors.
+
+    Joins are precomputed once into a dictionary of variable UID to
+    row columns, so rows are produced by a single lookup per value."""
+
+    columns = ('inventory_year', 'variable_uid', 'value', 'node_uid',
+               'name_prefix', 'name', 'sector', 'template_var_uid')
+    chunk_rows = 10000  # rows written to output at once
+
+    def __init__(self, country_data, sector=None):
+        self.country_data = country_data
+        # rows are joined with nodes of any sector
+        country_data.metadata.load_sectors()
+        self.nodes = self.join_nodes(country_data)
+        self.variables = self.join_variables(country_data, self.nodes)
+        self.selected = None
+        if sector is not None:
+            self.selected = self.sector_variable_uids(country_data, sector)
+
+    @staticmethod
+    def join_nodes(country_data):
+        """Return node UID -> (name_prefix, name, sector) mapping,
+        where sector is the top level metadata node."""
+        result = {}
+        for sector in country_data.metadata.nodes:
+            label = ' '.join(filter(None, [sector.get('name_prefix'),
+                                           sector.get('name')]))
+            for node in JSONTreeWalker.traverse(sector, via='node'):
+                result[node['uid']] = (node.get('name_prefix'),
+                                       node.get('name'), label)
+        # country specific nodes, nested or referring to parents,
+        # belong to the sector of their template or parent
+        country_nodes = {}
+        stack = [(node, None) for node in country_data.nodes]
+        while stack:
+            (node, parent_uid) = stack.pop()
+            country_nodes[node['uid']] = (node, parent_uid)
+            stack.extend((child, node['uid'])
+                         for child in node.get('node') or ())
+
+        def resolve(uid, seen):
+            if uid in result or uid not in country_nodes or uid in seen:
+                return result.get(uid)
+            seen.add(uid)
+            (node, parent_uid) = country_nodes[uid]
+            sector = None
+            for reference in (node.get('template_node_uid'),
+                              node.get('parent_uid'), parent_uid):
+                joined = resolve(reference, seen)
+                if joined is not None:
+                    sector = joined[2]
+                    break
+            result[uid] = (node.get('name_prefix'), node.get('name'), sector)
+            return result[uid]
+
+        for uid in country_nodes:
+            resolve(uid, set())
+        return result
+
+    @staticmethod
+    def join_variables(country_data, nodes):
+        """Return variable UID -> remaining row columns mapping."""
+        result = {}
+        unknown = (None, None, None)
+        for variables in (country_data.metadata.variables,
+                          country_data.variables):
+            for variable in variables:
+                node_uid = variable.get('node_uid')
+                result[variable['uid']] = (
+                    node_uid, *nodes.get(node_uid, unknown),
+                    variable.get('template_var_uid')
+                )
+        return result
+
+    @staticmethod
+    def sector_variable_uids(country_data, sector):
+        filter_ = country_data.metadata.get_sector_filter(sector)
+        sector_uids = country_data.collect_sector_uids(filter_)
+        result = sector_uids['variables']
+        for variable in country_data.variables:
+            if variable.get('node_uid') in sector_uids['nodes']:
+                result.add(variable['uid'])
+        return result
+
+    def rows(self, inventories):
+        variables = self.variables
+        selected = self.selected
+        unknown = (None,) * (len(self.columns) - 3)
+        for inventory in inventories:
+            year = inventory['inventory_year']
+            for value in inventory['values']:
+                uid = value['variable_uid']
+                if selected is not None and uid not in selected:
+                    continue
+                yield (year, uid, value.get('value'),
+                       *variables.get(uid, unknown))
+
+    def write(self, inventories, output, format_='ndjson'):
+        """Write rows of inventories in given format, return row count."""
+        count = formats[format_](self.columns, self.rows(inventories),
+                                 output, self.chunk_rows)
+        logger.info('exported %s data values', count)
+        return count
+
+
+def chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_ndjson(columns, rows, output, chunk_rows=10000):
+    """Write rows as JSON objects, one per line, return row count."""
+    encode = json.JSONEncoder(
+        ensure_ascii=False, default=JSONTreeWalker.encode_object
+    ).encode
+    count = 0
+    for chunk in chunks(rows, chunk_rows):
+        output.write(''.join([encode(dict(zip(columns, row))) + '\n'
+                              for row in chunk]))
+        count += len(chunk)
+    return count
+
+
+def write_csv(columns, rows, output, chunk_rows=10000):
+    """Write rows as CSV with header, nested JSON values are written
+    as JSON text. Return row count."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    count = 0
+    for chunk in chunks(rows, chunk_rows):
+        writer.writerows(
+            [json.dumps(value, default=JSONTreeWalker.encode_object)
+             if JSONTreeWalker.is_json_container(value) else value
+             for value in row]
+            for row in chunk
+        )
+        output.write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+        count += len(chunk)
+    if not count:
+        output.write(buffer.getvalue())
+    return count
+
+
+formats = {
+    'ndjson': write_ndjson,
+    'csv': write_csv,
+}
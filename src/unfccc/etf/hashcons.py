@@ -0,0 +1,154 @@
+import sys
+
+from .json import SCALAR_TYPES, JSONTreeWalker
+from .util import pformat_size
+
+
+class FrozenDict(dict):
+    """Read-only JSON object, shared by all places of identical content."""
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError(f'{self.__class__.__name__} is read-only')
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
+class FrozenList(tuple):
+    """Read-only JSON array, shared by all places of identical content.
+
+    Plain tuples are not JSON arrays, so that parent lookups do not
+    wander through unrelated tuples. Equal to arrays of equal items."""
+
+    __slots__ = ()
+    __hash__ = tuple.__hash__
+
+    def __eq__(self, other):
+        if type(other) is not FrozenList and JSONTreeWalker.is_array(other):
+            return len(self) == len(other) \
+                and all(item == other_item
+                        for (item, other_item) in zip(self, other))
+        return tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+JSONTreeWalker.register_object_type(FrozenDict)
+JSONTreeWalker.register_array_type(FrozenList)
+
+# scalars looked up by value, floats are looked up by their hex form
+# keeping apart 0.0 and -0.0, which are equal
+VALUE_TYPES = SCALAR_TYPES - {float}
+
+
+class Interner:
+    """Table of distinct JSON values, which are hash-consed: identical
+    subtrees are looked up by content and stored once, read-only.
+
+    Containers are looked up by keys, value types and values, where
+    nested containers, being interned before, are given by identity.
+    Value types keep apart 1, 1.0 and true, which are equal, as hex
+    forms of floats do 0.0 and -0.0."""
+
+    def __init__(self):
+        self.table = {}
+        self.shapes = {}  # key and value type tuples, shared by lookups
+        self.containers = self.distinct = 0
+
+    def _intern(self, keys, values, make):
+        kinds = tuple([type(value) for value in values])
+        key = (
+            self.shapes.setdefault(keys, keys),
+            self.shapes.setdefault(kinds, kinds),
+            tuple([value if kind in VALUE_TYPES
+                   else value.hex() if kind is float else id(value)
+                   for (kind, value) in zip(kinds, values)])
+        )
+        self.containers += 1
+        result = self.table.get(key)
+        if result is None:
+            result = self.table[key] = make()
+            self.distinct += 1
+        return result
+
+    def value(self, value):
+        type_ = type(value)
+        if type_ is str:
+            return self.table.setdefault(value, value)
+        if type_ is list or type_ is FrozenList:
+            return self.array(value)
+        return value
+
+    def array(self, items):
+        values = FrozenList([self.value(item) for item in items])
+        return self._intern('[', values, lambda: values)
+
+    def object_pairs_hook(self, pairs):
+        """Return interned object, given as `json.load()` hook."""
+        keys = tuple([key for (key, _) in pairs])
+        values = [self.value(value) for (_, value) in pairs]
+        return self._intern(keys, values,
+                            lambda: FrozenDict(zip(keys, values)))
+
+    def freeze(self, item):
+        """Return interned copy of JSON tree."""
+        if JSONTreeWalker.is_object(item):
+            return self.object_pairs_hook([
+                (key, self.freeze(value)) for (key, value) in item.items()
+            ])
+        if JSONTreeWalker.is_array(item):
+            return self.array([self.freeze(value) for value in item])
+        return self.value(item)
+
+
+def thaw(item):
+    """Return mutable copy of JSON tree."""
+    if JSONTreeWalker.is_object(item):
+        return {key: thaw(value) for (key, value) in item.items()}
+    if JSONTreeWalker.is_array(item):
+        return [thaw(value) for value in item]
+    return item
+
+
+def measure(item):
+    """Return counts of distinct objects, arrays and strings of JSON tree
+    and their total size."""
+    result = {'objects': 0, 'arrays': 0, 'strings': 0, 'size': 0}
+    seen = set()
+    stack = [item]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        result['size'] += sys.getsizeof(item)
+        if JSONTreeWalker.is_object(item):
+            result['objects'] += 1
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif JSONTreeWalker.is_array(item):
+            result['arrays'] += 1
+            stack.extend(item)
+        elif type(item) is str:
+            result['strings'] += 1
+    result['size'] = pformat_size(result['size'])
+    return result
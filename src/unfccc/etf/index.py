@@ -0,0 +1,322 @@
+from contextlib import closing
+import functools
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import tempfile
+
+from .countrydata import CountryData
+from .export import chunks
+from .json import JSONTreeWalker
+from .records import record_hook
+from .util import package_version
+
+
+logger = logging.getLogger(__name__)
+
+# country specific collections -> (table, key columns)
+COLLECTIONS = {
+    'nodes': ('nodes', ('uid', 'parent_uid', 'template_node_uid',
+                        'name_prefix', 'name')),
+    'variables': ('variables', ('uid', 'node_uid', 'template_var_uid',
+                                'name')),
+    'grids': ('grids', ('uid', 'node_uid')),
+    'line_description': ('line_descriptions', ('uid', 'variable_uid')),
+}
+
+SCHEMA = '''
+CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT);
+-- country data with collections and data values left out
+CREATE TABLE skeleton (json TEXT NOT NULL);
+-- position and json are only set for top level items, nested nodes
+-- refer to their parent by parent_uid
+CREATE TABLE nodes (position INTEGER, uid TEXT, parent_uid TEXT,
+    template_node_uid TEXT, name_prefix TEXT, name TEXT, json TEXT);
+CREATE TABLE variables (position INTEGER, uid TEXT, node_uid TEXT,
+    template_var_uid TEXT, name TEXT, json TEXT);
+CREATE TABLE grids (position INTEGER, uid TEXT, node_uid TEXT, json TEXT);
+CREATE TABLE line_descriptions (position INTEGER, uid TEXT,
+    variable_uid TEXT, json TEXT);
+-- inventory json has empty list of values
+CREATE TABLE inventories (position INTEGER, inventory_year INTEGER,
+    json TEXT);
+-- json is only set for values which are not plain
+-- {"variable_uid": ..., "value": <number or string>} objects
+CREATE TABLE "values" (inventory_year INTEGER, position INTEGER,
+    variable_uid TEXT, value, json TEXT);
+CREATE TABLE metadata_nodes (uid TEXT PRIMARY KEY, parent_uid TEXT,
+    template_node_uid TEXT, name_prefix TEXT, name TEXT, sector_uid TEXT,
+    depth INTEGER);
+CREATE TABLE metadata_variables (uid TEXT PRIMARY KEY, node_uid TEXT,
+    name TEXT);
+CREATE TABLE metadata_grids (uid TEXT, node_uid TEXT);
+'''
+
+# created after bulk loading, which is faster than maintaining them
+INDEXES = '''
+CREATE INDEX nodes_uid ON nodes (uid);
+CREATE INDEX nodes_parent_uid ON nodes (parent_uid);
+CREATE INDEX variables_uid ON variables (uid);
+CREATE INDEX variables_node_uid ON variables (node_uid);
+CREATE INDEX grids_node_uid ON grids (node_uid);
+CREATE INDEX line_descriptions_uid ON line_descriptions (uid);
+CREATE INDEX line_descriptions_variable_uid
+    ON line_descriptions (variable_uid);
+CREATE INDEX values_inventory_year ON "values" (inventory_year, position);
+CREATE INDEX values_variable_uid ON "values" (variable_uid);
+CREATE INDEX metadata_nodes_parent_uid ON metadata_nodes (parent_uid);
+CREATE INDEX metadata_variables_node_uid ON metadata_variables (node_uid);
+CREATE INDEX metadata_grids_node_uid ON metadata_grids (node_uid);
+'''
+
+SCALARS = (str, int, float)
+
+
+def dumps(item):
+    return json.dumps(item, ensure_ascii=False,
+                      default=JSONTreeWalker.encode_object)
+
+
+class CountryIndex:
+    """SQLite database of country data and metadata nodes.
+
+    Collections and data values are stored as rows with indexed key
+    columns, together with JSON of the items, so that country data
+    can be restored from the database, whole or in part."""
+
+    batch_size = 10000
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self, readonly=True):
+        if readonly:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f'index "{self.path}" not found')
+            # special characters of the path are escaped in the URI
+            uri = pathlib.Path(self.path).resolve().as_uri() + '?mode=ro'
+            return sqlite3.connect(uri, uri=True)
+        return sqlite3.connect(self.path)
+
+    def insert(self, connection, table, columns, rows):
+        statement = (f'INSERT INTO "{table}" ({", ".join(columns)}) '
+                     f'VALUES ({", ".join("?" * len(columns))})')
+        count = 0
+        for batch in chunks(rows, self.batch_size):
+            connection.executemany(statement, batch)
+            count += len(batch)
+        logger.debug('indexed %s rows of %s', count, table)
+        return count
+
+    @classmethod
+    def build(cls, path, metadata, data):
+        """Index country data read from `data` one inventory year
+        at a time, replace the database at `path` atomically."""
+        (country_data, inventories) = CountryData.stream(metadata, data)
+        directory = os.path.dirname(os.path.abspath(path))
+        (fd, temp_path) = tempfile.mkstemp(dir=directory, prefix='.',
+                                           suffix='.sqlite.tmp')
+        os.close(fd)
+        try:
+            index = cls(temp_path)
+            with closing(index.connect(readonly=False)) as connection:
+                # the file is not published until complete
+                connection.execute('PRAGMA journal_mode = OFF')
+                connection.execute('PRAGMA synchronous = OFF')
+                with connection:
+                    connection.executescript(SCHEMA)
+                    index.load(connection, metadata, country_data,
+                               inventories)
+                    connection.executescript(INDEXES)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return cls(path)
+
+    def load(self, connection, metadata, country_data, inventories):
+        # metadata tables cover all sectors
+        metadata.load_sectors()
+        self.insert(connection, 'info', ('key', 'value'), [
+            ('version', package_version()),
+            ('metadata', metadata.fingerprint),
+        ])
+        country_metadata = country_data.country_metadata
+        skeleton = dict(country_data.tree)
+        skeleton['country_specific_data'] = dict(country_metadata, **{
+            key: [] for key in COLLECTIONS if key in country_metadata
+        })
+        if 'data' in skeleton:
+            skeleton['data'] = dict(skeleton['data'], values=[])
+        self.insert(connection, 'skeleton', ('json',), [(dumps(skeleton),)])
+        for (key, (table, columns)) in COLLECTIONS.items():
+            items = country_metadata.get(key, [])
+            rows = self.collection_rows(items, columns) if key == 'nodes' \
+                else ((position, *[item.get(column) for column in columns],
+                       dumps(item))
+                      for (position, item) in enumerate(items))
+            self.insert(connection, table,
+                        ('position', *columns, 'json'), rows)
+        inventory_rows = []
+        self.insert(connection, 'values',
+                    ('inventory_year', 'position', 'variable_uid', 'value',
+                     'json'),
+                    self.value_rows(inventories, inventory_rows))
+        self.insert(connection, 'inventories',
+                    ('position', 'inventory_year', 'json'), inventory_rows)
+        self.insert(connection, 'metadata_nodes',
+                    ('uid', 'parent_uid', 'template_node_uid',
+                     'name_prefix', 'name', 'sector_uid', 'depth'),
+                    self.metadata_node_rows(metadata))
+        self.insert(connection, 'metadata_variables',
+                    ('uid', 'node_uid', 'name'),
+                    ((variable['uid'], variable.get('node_uid'),
+                      variable.get('name'))
+                     for variable in metadata.variables))
+        self.insert(connection, 'metadata_grids', ('uid', 'node_uid'),
+                    ((grid.get('uid'), grid.get('node_uid'))
+                     for grid in metadata.grids))
+
+    @staticmethod
+    def collection_rows(nodes, columns):
+        # nested nodes are flattened, with the parent they are nested in
+        stack = [(position, node, None)
+                 for (position, node) in reversed(list(enumerate(nodes)))]
+        while stack:
+            (position, node, parent_uid) = stack.pop()
+            row = [node.get(column) for column in columns]
+            if parent_uid is not None:
+                row[columns.index('parent_uid')] = parent_uid
+            yield (position, *row,
+                   dumps(node) if position is not None else None)
+            stack.extend((None, child, node['uid'])
+                         for child in reversed(node.get('node') or ()))
+
+    @staticmethod
+    def value_rows(inventories, inventory_rows):
+        """Iterate over rows of data values, collecting rows
+        of their inventories into `inventory_rows`."""
+        for (position, inventory) in enumerate(inventories):
+            year = inventory['inventory_year']
+            inventory_rows.append((position, year,
+                                   dumps(dict(inventory, values=[]))))
+            for (index, value) in enumerate(inventory['values']):
+                plain = len(value) == 2 and 'variable_uid' in value \
+                    and isinstance(value.get('value'), SCALARS) \
+                    and not isinstance(value.get('value'), bool)
+                yield (year, index, value.get('variable_uid'),
+                       value.get('value') if plain else None,
+                       None if plain else dumps(value))
+            logger.info('indexed %s data values of inventory year %s',
+                        len(inventory['values']), year)
+
+    @staticmethod
+    def metadata_node_rows(metadata):
+        stack = [(node, None, node['uid'], 0)
+                 for node in reversed(metadata.nodes)]
+        while stack:
+            (node, parent_uid, sector_uid, depth) = stack.pop()
+            yield (node['uid'], node.get('parent_uid', parent_uid),
+                   node.get('template_node_uid'), node.get('name_prefix'),
+                   node.get('name'), sector_uid, depth)
+            stack.extend((child, node['uid'], sector_uid, depth + 1)
+                         for child in reversed(node.get('node') or ()))
+
+    def query(self, sql, parameters=()):
+        """Return column names and iterator over rows of query result."""
+        connection = self.connect()
+        try:
+            cursor = connection.execute(sql, parameters)
+        except sqlite3.Error:
+            connection.close()
+            raise
+        columns = [column[0] for column in cursor.description or ()]
+
+        def rows():
+            with closing(connection):
+                while batch := cursor.fetchmany(self.batch_size):
+                    yield from batch
+
+        return columns, rows()
+
+    def check_metadata(self, connection, metadata):
+        """Warn if the index has been built with other metadata, which
+        its metadata tables and UIDs of country data refer to."""
+        row = connection.execute(
+            "SELECT value FROM info WHERE key = 'metadata'").fetchone()
+        if row is None or row[0] != metadata.fingerprint:
+            logger.warning('index "%s" has been built with other metadata',
+                           self.path)
+
+    def restore(self, metadata, years=None, values=True, **kwargs):
+        """Return country data restored from the index, without
+        data values if `values` is false."""
+        # records replace plain dicts of entities as when parsing
+        hook = record_hook if kwargs.get('records') else dict
+        loads = functools.partial(json.loads, object_pairs_hook=hook)
+        with closing(self.connect()) as connection:
+            self.check_metadata(connection, metadata)
+            (skeleton,) = connection.execute(
+                'SELECT json FROM skeleton').fetchone()
+            tree = loads(skeleton)
+            country_metadata = tree['country_specific_data']
+            for (key, (table, _)) in COLLECTIONS.items():
+                if key in country_metadata:
+                    country_metadata[key] = [
+                        loads(item) for (item,) in connection.execute(
+                            f'SELECT json FROM {table} WHERE position '
+                            f'IS NOT NULL ORDER BY position'
+                        )
+                    ]
+            inventories = [
+                loads(item) for (year, item) in connection.execute(
+                    'SELECT inventory_year, json FROM inventories '
+                    'ORDER BY position'
+                ) if years is None or year in years
+            ]
+            if values:
+                self.restore_values(connection, inventories, hook=hook)
+            if 'data' in tree:
+                tree['data']['values'] = inventories
+        return CountryData(metadata, tree, **kwargs)
+
+    @staticmethod
+    def restore_values(connection, inventories, variable_uids=None,
+                       hook=dict):
+        """Fill values of inventories, only of given variables if any,
+        with objects made by `object_pairs_hook` like `hook`."""
+        query = ('SELECT variable_uid, value, json FROM "values" '
+                 'WHERE inventory_year = ? ORDER BY position')
+        if variable_uids is not None:
+            connection.execute('CREATE TEMP TABLE IF NOT EXISTS selected '
+                               '(uid TEXT PRIMARY KEY)')
+            connection.execute('DELETE FROM selected')
+            connection.executemany('INSERT OR IGNORE INTO selected VALUES (?)',
+                                   ((uid,) for uid in variable_uids))
+            query = ('SELECT variable_uid, value, json FROM "values" '
+                     'WHERE inventory_year = ? AND variable_uid IN '
+                     '(SELECT uid FROM selected) ORDER BY position')
+        for inventory in inventories:
+            inventory['values'].extend(
+                json.loads(item, object_pairs_hook=hook) if item is not None
+                else hook([('variable_uid', variable_uid), ('value', value)])
+                for (variable_uid, value, item) in connection.execute(
+                    query, (inventory['inventory_year'],)
+                )
+            )
+
+    def filter_sector(self, metadata, sector, years=None, **kwargs):
+        """Return country data filtered by sector, reading only data
+        values of the sector variables from the index."""
+        country_data = self.restore(metadata, years, values=False, **kwargs)
+        variable_uids = country_data.filter_sector(sector)
+        with closing(self.connect()) as connection:
+            self.restore_values(
+                connection, country_data.data, variable_uids,
+                hook=record_hook if kwargs.get('records') else dict
+            )
+        country_data.invalidate(*(inventory['values']
+                                  for inventory in country_data.data))
+        return country_data
@@ -1,73 +1,144 @@
-from collections import deque
+from collections import OrderedDict, deque
+from collections.abc import Mapping
 import functools
 import gc
 import io
+import itertools
 import json
 import logging
 import os
 import re
+import threading
+import types
+import weakref
 
+from . import metrics
 from .util import pairwise, pformat_size
 
 
 logger = logging.getLogger(__name__)
 
+TRAVERSED_OBJECTS = metrics.REGISTRY.histogram(
+    'etf_traverse_objects', 'JSON objects yielded per traversal', ['via']
+)
+PARENT_LOOKUPS = metrics.REGISTRY.counter(
+    'etf_parent_lookups_total',
+    'lookups of parent JSON container by source (cache or gc referrers)',
+    ['source']
+)
+CATALOG_SEARCHES = metrics.REGISTRY.counter(
+    'etf_catalog_searches_total', 'JSONCatalog searches by result',
+    ['catalog', 'method', 'result']
+)
+CATALOG_POSTINGS = metrics.REGISTRY.histogram(
+    'etf_catalog_posting_size',
+    'sizes of posting sets looked up by JSONCatalog searches', ['catalog']
+)
+# guards totals of released trees and catalogs, which are added
+# by finalizers running in any thread, also during other updates
+RELEASED_LOCK = threading.RLock()
+
 
 class JSONTreeRoot(dict):
     pass
 
 
+class hybridmethod:
+    """Method bound to the instance if called on one, else to the class,
+    so that instance attributes override class level defaults."""
+
+    def __init__(self, func):
+        self.func = func
+        functools.update_wrapper(self, func)
+
+    def __get__(self, instance, owner=None):
+        return types.MethodType(self.func,
+                                owner if instance is None else instance)
+
+
+SCALAR_TYPES = frozenset([str, int, float, bool, type(None)])
+
+
 class JSONTreeWalker:
 
-    _parents = {}  # no weakref support for dict() and list()
+    # parents recorded by traversals called on the class, trees keep
+    # their own; no weakref support for dict() and list()
+    _parents = {}
+
+    # exact types checked first, mappings and sequences are registered
+    # here; other subclasses of dict and list are containers too
+    object_types = {dict, JSONTreeRoot}
+    array_types = {list}
+    container_types = {dict, JSONTreeRoot, list}
+    # type -> function returning JSON encodable value, for encode_object()
+    json_encoders = {}
+    # frozen trees are not modified, not even by caching their parents
+    frozen = False
+
+    @classmethod
+    def register_object_type(cls, type_, encoder=None):
+        cls.object_types.add(type_)
+        cls.container_types.add(type_)
+        if encoder is not None:
+            cls.json_encoders[type_] = encoder
 
     @classmethod
+    def register_array_type(cls, type_, encoder=list):
+        cls.array_types.add(type_)
+        cls.container_types.add(type_)
+        cls.json_encoders[type_] = encoder
+
+    @hybridmethod
     def _cache_parent(cls, item, parent):
         cls._parents[id(item)] = parent
 
-    @classmethod
+    @hybridmethod
     def _cached_parent(cls, item):
         return cls._parents.get(id(item))
 
-    @staticmethod
-    def is_json_container(item):
-        return isinstance(item, (dict, list))
-
-    @staticmethod
-    def is_object(item):
-        return isinstance(item, dict)
+    @classmethod
+    def is_json_container(cls, item):
+        return type(item) in cls.container_types \
+            or isinstance(item, (dict, list))
 
-    @staticmethod
-    def _iter_json_children(container):
-        if isinstance(container, dict):
-            return container.items()
-        if isinstance(container, list):
-            return enumerate(container)
-        type_ = type(container)
-        raise ValueError(f'unsupported JSON container type {type_}')
+    @classmethod
+    def is_object(cls, item):
+        return type(item) in cls.object_types or isinstance(item, dict)
 
     @classmethod
+    def is_array(cls, item):
+        return type(item) in cls.array_types or isinstance(item, list)
+
+    @staticmethod
+    def encode_object(item):
+        """`default` hook of `json.dump()` for registered types."""
+        encoder = JSONTreeWalker.json_encoders.get(type(item))
+        if encoder is not None:
+            return encoder(item)
+        if isinstance(item, Mapping):
+            return dict(item.items())
+        raise TypeError(f'Object of type {item.__class__.__name__} '
+                        f'is not JSON serializable')
+
+    @hybridmethod
     def _walk_up(cls, item):
-        if (parent := cls._cached_parent(item)):
+        # overlays of cow module link to their parent overlays
+        if (parent := cls._cached_parent(item)
+                or getattr(item, 'parent', None)):
+            if metrics.enabled:
+                PARENT_LOOKUPS.inc('cache')
             yield parent
             return
+        if metrics.enabled:
+            PARENT_LOOKUPS.inc('gc')
         locals_ = locals()
         for parent in gc.get_referrers(item):
             if parent is not locals_ \
                     and parent is not cls._parents \
+                    and parent is not JSONTreeWalker._parents \
                     and cls.is_json_container(parent):
                 yield parent
 
-    @classmethod
-    def _walk_down(cls, item):
-        # reversed() is significant for stable traversal order:
-        # _traverse_graph() appends children to the right of the queue,
-        # so the first child should be yielded last
-        for (_, child) in reversed(list(cls._iter_json_children(item))):
-            if cls.is_json_container(child):
-                yield child
-                cls._cache_parent(child, item)
-
     @staticmethod
     def _traverse_graph(start_item, neighbour_func):
         queue = deque([(start_item,)])
@@ -84,36 +155,94 @@ class JSONTreeWalker:
 
     @classmethod
     def _get_json_key(cls, parent, child):
-        if isinstance(parent, dict):
+        if cls.is_object(parent):
             key = next(
                 key for (key, value) in parent.items() if value is child
             )
             return f'.{key}'
-        if isinstance(parent, list):
+        if cls.is_array(parent):
             index = parent.index(child)
             return f'[{index}]'
         type_ = type(parent)
         raise ValueError(f'unsupported JSON container type {type_}')
 
-    @classmethod
+    @hybridmethod
     def parents(cls, item):
         for chain in cls._traverse_graph(item, cls._walk_up):
             topmost = chain[0]
             if isinstance(topmost, JSONTreeRoot):
-                for (parent, child) in pairwise(chain):
-                    cls._cache_parent(child, parent)
+                if not cls.frozen:
+                    for (parent, child) in pairwise(chain):
+                        cls._cache_parent(child, parent)
                 return chain[:-1]
         return None
 
-    @classmethod
-    def traverse(cls, start):
+    @hybridmethod
+    def traverse(cls, start, via=None, predicate=None, record_parents=False):
+        """Iterate depth-first over JSON objects nested in `start`.
+
+        Arrays are always descended, objects only through values of
+        `via` key(s) if given. Objects rejected by `predicate` are
+        neither yielded nor descended. With `record_parents` parents
+        of visited containers are cached for `parents()`.
+
+        Visited containers are not tracked, so containers referenced from
+        several places, like subtrees shared by hash-consing (see
+        hashcons.Interner), are yielded once per place, and the last
+        place is recorded as their parent."""
+        if isinstance(via, str):
+            via = (via,)
+        items = cls._traverse(start, via, predicate, record_parents)
+        if metrics.enabled:
+            items = cls._count_traversed(items, via)
+        return items
+
+    @staticmethod
+    def _count_traversed(items, via):
+        count = 0
+        try:
+            for count, item in enumerate(items, 1):
+                yield item
+        finally:
+            TRAVERSED_OBJECTS.observe(count, ','.join(via or ('*',)))
+
+    @hybridmethod
+    def _traverse(cls, start, via, predicate, record_parents):
         if not cls.is_json_container(start):
             return
-        for (item, *_) in cls._traverse_graph(start, cls._walk_down):
-            if cls.is_object(item):
+        parents = cls._parents
+        object_types = cls.object_types
+        container_types = cls.container_types
+        # children are pushed in reverse for stable document order
+        stack = [start]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            item = pop()
+            if type(item) in object_types or isinstance(item, dict):
+                if predicate is not None and not predicate(item):
+                    continue
                 yield item
-
-    @classmethod
+                if via is None:
+                    children = reversed(item.values())
+                else:
+                    children = reversed([
+                        item[key] for key in via if key in item
+                    ])
+            else:
+                children = reversed(item)
+            for child in children:
+                child_type = type(child)
+                # scalars are told apart from subclasses by type alone
+                if child_type in container_types or (
+                    child_type not in SCALAR_TYPES
+                    and isinstance(child, (dict, list))
+                ):
+                    push(child)
+                    if record_parents:
+                        parents[id(child)] = item
+
+    @hybridmethod
     def json_path(cls, item):
         parents = cls.parents(item)
         return ''.join(
@@ -121,32 +250,128 @@ class JSONTreeWalker:
             for parent, child in pairwise(parents + (item,))
         ) if parents else '<broken_json_path>'
 
-    json_keys = re.compile(r'\.?(\w+)|\[(\d+)\]')
+
+class JSONPath:
+    """Compiled JSON path.
+
+    Supported steps are `.key`, `[index]`, `[*]` or `.*` for all
+    children of array or object, and `..key` for the key at any depth.
+    The leading dot is optional. Paths are immutable, use `compile()`
+    to share them between calls."""
+
+    steps_syntax = re.compile(
+        r'(?P<descendant>\.\.\w+)|(?P<key>\.?\w+)|\[(?P<index>\d+)\]'
+        r'|(?P<wildcard>\[\*\]|\.\*)'
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = []
+        position = 0
+        while position < len(path):
+            match = self.steps_syntax.match(path, position)
+            if match is None:
+                raise ValueError(
+                    f'invalid JSON path "{path}" at position {position}'
+                )
+            position = match.end()
+            if (key := match['descendant']) is not None:
+                self.steps.append(functools.partial(self._descendants,
+                                                    key[2:]))
+            elif (key := match['key']) is not None:
+                self.steps.append(functools.partial(self._children,
+                                                    key.lstrip('.')))
+            elif (index := match['index']) is not None:
+                self.steps.append(functools.partial(self._children,
+                                                    int(index)))
+            else:
+                self.steps.append(self._all_children)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path!r})'
 
     @classmethod
-    def parse_json_path(cls, path):
-        result = []
-        for key, index in cls.json_keys.findall(path):
-            if key:
-                result.append(key)
-            elif index:
-                result.append(int(index))
-        return result
+    @functools.lru_cache(maxsize=256)
+    def compile(cls, path):
+        return cls(path)
+
+    @staticmethod
+    def _children(key, items):
+        for item in items:
+            try:
+                yield item[key]
+            except (IndexError, KeyError, TypeError):
+                pass
+
+    @staticmethod
+    def _all_children(items):
+        for item in items:
+            if JSONTreeWalker.is_object(item):
+                yield from item.values()
+            elif JSONTreeWalker.is_array(item):
+                yield from item
+
+    @staticmethod
+    def _descendants(key, items):
+        for item in items:
+            # matches are yielded when reached, before their own
+            # descendants and after preceding siblings
+            stack = [(item, False)]
+            while stack:
+                (item, matched) = stack.pop()
+                if matched:
+                    yield item
+                if JSONTreeWalker.is_object(item):
+                    stack.extend(reversed([
+                        (value, name == key) for (name, value) in item.items()
+                    ]))
+                elif JSONTreeWalker.is_array(item):
+                    stack.extend((value, False) for value in reversed(item))
+
+    def select(self, item):
+        """Iterate over items matching the path, in document order."""
+        items = iter((item,))
+        for step in self.steps:
+            items = step(items)
+        return items
+
+    def first(self, item, default=None):
+        return next(self.select(item), default)
 
 
 class JSONTree(JSONTreeWalker):
 
-    def __init__(self, data):
-        if isinstance(data, io.IOBase) or (
+    locate_cache_size = 128
+    # with metrics enabled parent caches of live trees are measured
+    # at exit, those of released trees are added up when released
+    instances = weakref.WeakSet()
+    released_parents = 0
+    _metered = False
+
+    def __init__(self, data, **load_options):
+        # load_options are passed to json.load(), if data needs parsing
+        if isinstance(data, (bytes, bytearray)):
+            data = self.from_json_bytes(data, **load_options)
+        elif isinstance(data, io.IOBase) or (
             # pytest on Windows passes tempfile._TemporaryFileWrapper
             # which is not io.IOBase
             hasattr(data, 'read') and callable(data.read)
         ):
-            data = self.from_json_file(data)
+            data = self.from_json_file(data, **load_options)
         self.tree = JSONTreeRoot(data)
+        self._parents = {}
+        self._locate_cache = OrderedDict()
+        if metrics.enabled:
+            self.instances.add(self)
+            self._metered = True
+
+    def __del__(self):
+        if self._metered:
+            with RELEASED_LOCK:
+                JSONTree.released_parents += len(self._parents)
 
     @staticmethod
-    def from_json_file(input_file):
+    def from_json_file(input_file, **load_options):
         try:
             size = pformat_size(os.fstat(input_file.fileno()).st_size)
             logger.info('loading %s, size %s', input_file.name, size)
@@ -154,36 +379,75 @@ class JSONTree(JSONTreeWalker):
             # unit test, ignore
             pass
         try:
-            return json.load(input_file)
+            return json.load(input_file, **load_options)
         except (json.decoder.JSONDecodeError, UnicodeDecodeError) as exc:
             # handle known cases of wrong encoding:
             # 1. Windows opens texts with sys.getdefaultencoding() == 'cp1252',
             # 2. BOM mark added into beginning of JSON file
             # both cases are well handled by json binary decoder
             with open(input_file.name, 'rb') as input_fallback:
-                return json.load(input_fallback)
+                return json.load(input_fallback, **load_options)
         finally:
             logger.debug('(meta)data loading complete')
 
+    @staticmethod
+    def from_json_bytes(source, **load_options):
+        logger.info('loading %s bytes', pformat_size(len(source)))
+        # binary decoder detects UTF-8/16/32 encoding and BOM mark
+        result = json.loads(source, **load_options)
+        logger.debug('(meta)data loading complete')
+        return result
+
     def __getitem__(self, key):
         return self.tree[key]
 
-    @functools.cache
+    def freeze(self):
+        """Make the tree read-only, to be shared by threads. Lookups are
+        then cached per thread."""
+        self.frozen = True
+        self._thread_local = threading.local()
+        return self
+
+    def invalidate(self, *changed):
+        """Drop cached lookups, must be called after the tree is modified.
+
+        The containers that have been changed may be given for subclasses
+        keeping finer grained state, this class ignores them."""
+        if self.frozen:
+            raise TypeError('frozen tree cannot be modified')
+        self._locate_cache.clear()
+
+    def select(self, path):
+        return JSONPath.compile(path).select(self.tree)
+
     def locate(self, path):
-        item = self.tree
-        for key in self.parse_json_path(path):
-            try:
-                item = item[key]
-            except (IndexError, KeyError):
-                return None
-        return item
+        """Return the first item matching the path or None."""
+        cache = self._locate_cache
+        if self.frozen:
+            cache = getattr(self._thread_local, 'locate_cache', None)
+            if cache is None:
+                cache = self._thread_local.locate_cache = OrderedDict()
+        try:
+            cache.move_to_end(path)
+            return cache[path]
+        except KeyError:
+            pass
+        result = JSONPath.compile(path).first(self.tree)
+        cache[path] = result
+        if len(cache) > self.locate_cache_size:
+            cache.popitem(last=False)
+        return result
+
+    def json_value(self):
+        """Return the tree to be encoded by dump()."""
+        return self.tree
 
     def dump(self, *args, **kwargs):
-        if not kwargs.get('indend'):
-            kwargs['indent'] = 4
-        return json.dump(self.tree, *args, **kwargs)
+        kwargs.setdefault('indent', 4)
+        kwargs.setdefault('default', self.encode_object)
+        return json.dump(self.json_value(), *args, **kwargs)
 
-    @classmethod
+    @hybridmethod
     def collect_uids(cls, item):
         uids = {child.get('uid') for child in cls.traverse(item)}
         for parent in cls.parents(item):
@@ -194,17 +458,86 @@ class JSONTree(JSONTreeWalker):
 
 NOT_PRESENT = object()  # marker of absent value
 
+PARENTS_CACHE_SIZE = metrics.REGISTRY.gauge(
+    'etf_parents_cache_size', 'JSON containers with cached parent',
+    callback=lambda: {(): len(JSONTreeWalker._parents)
+                      + JSONTree.released_parents + sum(
+                          len(tree._parents) for tree in JSONTree.instances
+                      )}
+)
+
 
 class JSONCatalog:
+    """Hash indexes of JSON objects by values of their attributes.
 
-    def __init__(self, indexes, data=None):
+    Composite indexes, declared as tuples of attributes, answer
+    searches by all of their attributes with a single lookup."""
+
+    # with metrics enabled index cardinalities of live catalogs are
+    # exported at exit, those of released catalogs are added up
+    # when released
+    instances = weakref.WeakSet()
+    released_cardinalities = {}
+    frozen = False
+    _metered = False
+
+    def __init__(self, indexes, data=None, name=None, composite=()):
+        self.name = name or 'unnamed'
         self.items = {}
         self.indexes = {attr: {} for attr in indexes}
+        # the widest composite indexes are tried first
+        self.composite = sorted((tuple(attrs) for attrs in composite),
+                                key=len, reverse=True)
+        for attrs in self.composite:
+            self.indexes[attrs] = {}
         self.values = {}
+        if metrics.enabled:
+            self.instances.add(self)
+            self._metered = True
         if data is not None:
             self.index_iterable(data)
 
+    def __del__(self):
+        if self._metered:
+            with RELEASED_LOCK:
+                self.add_cardinalities(JSONCatalog.released_cardinalities)
+
+    def add_cardinalities(self, result):
+        for attr, index in self.indexes.items():
+            if isinstance(attr, tuple):
+                attr = '+'.join(attr)
+            key = (self.name, attr)
+            result[key] = result.get(key, 0) + len(index)
+
+    @staticmethod
+    def index_cardinalities():
+        with RELEASED_LOCK:
+            result = dict(JSONCatalog.released_cardinalities)
+        for catalog in JSONCatalog.instances:
+            catalog.add_cardinalities(result)
+        return result
+
+    def freeze(self):
+        """Make the catalog read-only, so that it can be searched
+        by threads concurrently."""
+        self.frozen = True
+        self.indexes = types.MappingProxyType({
+            attr: types.MappingProxyType({
+                value: frozenset(object_ids)
+                for (value, object_ids) in index.items()
+            })
+            for (attr, index) in self.indexes.items()
+        })
+        self.items = types.MappingProxyType(self.items)
+        self.values = types.MappingProxyType(self.values)
+        return self
+
+    def check_mutable(self):
+        if self.frozen:
+            raise TypeError(f'catalog "{self.name}" is frozen')
+
     def clear(self):
+        self.check_mutable()
         self.items.clear()
         for index in self.indexes.values():
             index.clear()
@@ -215,19 +548,26 @@ class JSONCatalog:
             self.index(item)
 
     def index(self, item):
+        self.check_mutable()
         object_id = id(item)
         if object_id in self.items:
             self.unindex(item)
         self.items[object_id] = item
         values = self.values.setdefault(object_id, {})
         for attr, index in self.indexes.items():
-            value = item.get(attr, NOT_PRESENT)
-            if value is not NOT_PRESENT:
-                object_ids = index.setdefault(value, set())
-                object_ids.add(object_id)
-                values[attr] = value
+            if isinstance(attr, tuple):
+                value = tuple(item.get(part, NOT_PRESENT) for part in attr)
+                if NOT_PRESENT in value:
+                    continue
+            else:
+                value = item.get(attr, NOT_PRESENT)
+                if value is NOT_PRESENT:
+                    continue
+            index.setdefault(value, set()).add(object_id)
+            values[attr] = value
 
     def unindex(self, item):
+        self.check_mutable()
         object_id = id(item)
         if object_id not in self.items:
             return
@@ -238,34 +578,87 @@ class JSONCatalog:
         del self.values[object_id]
         del self.items[object_id]
 
-    def search(self, **criteria):
-        result = None
+    def plan(self, criteria):
+        """Return posting sets of object ids matching criteria,
+        the smallest first, or None if some of them is empty."""
+        postings = []
+        if self.composite and len(criteria) > 1:
+            criteria = dict(criteria)
+            for attrs in self.composite:
+                if criteria.keys() >= set(attrs):
+                    postings.append(self.indexes[attrs].get(
+                        tuple([criteria.pop(attr) for attr in attrs])
+                    ))
+        indexes = self.indexes
         for attr, value in criteria.items():
-            object_ids = self.indexes[attr].get(value, None)
-            if not object_ids:
-                return []
-            result = object_ids if result is None \
-                else result.intersection(object_ids)
-            if not result:
-                return []
-        return [] if result is None \
-            else [self.items[object_id] for object_id in result]
+            postings.append(indexes[attr].get(value))
+        if metrics.enabled:
+            for object_ids in postings:
+                CATALOG_POSTINGS.observe(len(object_ids or ()),
+                                              self.name)
+        if not all(postings):
+            return None
+        if len(postings) > 1:
+            postings.sort(key=len)
+        return postings
+
+    def _matches(self, postings):
+        (smallest, *others) = postings
+        items = self.items
+        for object_id in smallest:
+            for object_ids in others:
+                if object_id not in object_ids:
+                    break
+            else:
+                yield items[object_id]
+
+    def _count_search(self, method, found):
+        if metrics.enabled:
+            CATALOG_SEARCHES.inc(self.name, method,
+                                 'hit' if found else 'miss')
+
+    def _search(self, method, criteria):
+        postings = self.plan(criteria)
+        found = False
+        if postings:
+            for item in self._matches(postings):
+                if not found:
+                    self._count_search(method, True)
+                    found = True
+                yield item
+        if not found:
+            self._count_search(method, False)
+
+    def search(self, **criteria):
+        """Iterate over items matching all criteria. The catalog
+        must not be modified until iteration is over."""
+        return self._search('search', criteria)
 
     def first(self, **criteria):
-        """Return first item matching given criteria or None.
-        Consume items from data iterator if needed,
-        stop iteration on first match."""
-        items = self.search(**criteria)
-        if items:
-            return items[0]
+        """Return first item matching given criteria or None,
+        stop search on first match."""
+        postings = self.plan(criteria)
+        result = None
+        if postings:
+            result = next(self._matches(postings), None) \
+                if len(postings) > 1 \
+                else self.items[next(iter(postings[0]))]
+        self._count_search('first', result is not None)
+        return result
 
     def one(self, **criteria):
-        items = self.search(**criteria)
+        items = list(itertools.islice(self._search('one', criteria), 2))
         if len(items) < 1:
             raise ValueError(
                 f'No items have been found matching criteria {criteria}'
             )
         if len(items) > 1:
-            raise ValueError(f'Multiple ({len(items)}) items have been found '
+            raise ValueError(f'Multiple items have been found '
                              f'matching criteria {criteria}')
         return items[0]
+
+
+INDEX_CARDINALITY = metrics.REGISTRY.gauge(
+    'etf_catalog_index_cardinality', 'distinct values per JSONCatalog index',
+    ['catalog', 'attribute'], callback=JSONCatalog.index_cardinalities
+)
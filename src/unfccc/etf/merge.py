@@ -0,0 +1,171 @@
+import logging
+
+from .countrydata import CountryData
+from .json import JSONCatalog, JSONTree
+
+
+logger = logging.getLogger(__name__)
+
+
+class MergeConflict(ValueError):
+    pass
+
+
+class CountryDataMerger:
+    """Union of several country data files into one.
+
+    Collections of country specific data are joined by the first key
+    attribute present in the item, yearly data values are joined by
+    (inventory_year, variable_uid). The first input is parsed whole
+    into the merged result. Data values of later inputs are parsed and
+    merged one inventory year at a time, where their source can be cut,
+    so that besides the merged result, which keeps items added from
+    all inputs, only one inventory year of an input is resident."""
+
+    collections = {
+        'dimension_instances': ('uid',),
+        'nodes': ('uid',),
+        'variables': ('uid',),
+        'grids': ('uid', 'node_uid'),
+        'drop_downs': ('uid',),
+        'line_description': ('uid', 'variable_uid'),
+    }
+
+    policies = ('first', 'last', 'error')
+
+    def __init__(self, policy='error'):
+        if policy not in self.policies:
+            raise ValueError(f'unknown conflict policy "{policy}"')
+        self.policy = policy
+        self.tree = None
+        self.catalogs = {}
+        self.years = {}
+        self.conflicts = []
+
+    @classmethod
+    def item_key(cls, collection, item):
+        for attr in cls.collections[collection]:
+            value = item.get(attr)
+            if value is not None:
+                return attr, value
+        return None, None
+
+    def merge_files(self, input_files):
+        for input_file in input_files:
+            source = getattr(input_file, 'name', None)
+            if self.tree is None:
+                self.merge(JSONTree(input_file).tree, source)
+                continue
+            (skeleton, inventories) = CountryData.cut_years(input_file)
+            self.merge(JSONTree(skeleton).tree, source)
+            if inventories is None:
+                continue
+            base_values = self.tree['data']['values']
+            for inventory in inventories:
+                self.merge_inventory(base_values, inventory, source)
+        return self.tree
+
+    def merge(self, tree, source=None):
+        logger.info('merging %s', source or 'country data')
+        if self.tree is None:
+            self.tree = tree
+            self.index_base()
+            return self.tree
+        for key, value in tree.items():
+            if key not in self.tree:
+                self.tree[key] = value
+        base_metadata = self.tree.setdefault('country_specific_data', {})
+        for collection, items in \
+                tree.get('country_specific_data', {}).items():
+            if collection not in self.collections:
+                if collection not in base_metadata:
+                    base_metadata[collection] = items
+                continue
+            self.merge_collection(collection, items, source)
+        base_values = self.tree.setdefault('data', {}) \
+            .setdefault('values', [])
+        for inventory in tree.get('data', {}).get('values', []):
+            self.merge_inventory(base_values, inventory, source)
+        return self.tree
+
+    def index_base(self):
+        base_metadata = self.tree.setdefault('country_specific_data', {})
+        for collection, attrs in self.collections.items():
+            items = base_metadata.get(collection, [])
+            if collection == 'nodes':
+                # nodes may have been already reparented into a tree
+                items = JSONTree.traverse(items, via='node')
+            self.catalogs[collection] = JSONCatalog(attrs, items)
+        for inventory in self.tree.get('data', {}).get('values', []):
+            self.years[inventory['inventory_year']] = (
+                inventory,
+                {value['variable_uid']: value
+                 for value in inventory['values']}
+            )
+
+    def merge_collection(self, collection, items, source):
+        base_items = self.tree['country_specific_data'] \
+            .setdefault(collection, [])
+        catalog = self.catalogs[collection]
+        added = 0
+        for item in items:
+            attr, key = self.item_key(collection, item)
+            existing = None if attr is None \
+                else catalog.first(**{attr: key})
+            if existing is None:
+                base_items.append(item)
+                catalog.index_iterable(self.indexed_items(collection, item))
+                added += 1
+            elif existing != item:
+                self.resolve(existing, item, (collection, key), source)
+        logger.debug('merged %s new %s from %s',
+                     added, collection, source)
+
+    @staticmethod
+    def indexed_items(collection, item):
+        # nested nodes are indexed together with their parent
+        if collection == 'nodes':
+            return list(JSONTree.traverse(item, via='node'))
+        return [item]
+
+    def merge_inventory(self, base_values, inventory, source):
+        year = inventory['inventory_year']
+        if year not in self.years:
+            base_values.append(inventory)
+            self.years[year] = (
+                inventory,
+                {value['variable_uid']: value
+                 for value in inventory['values']}
+            )
+            return
+        (base_inventory, index) = self.years[year]
+        added = 0
+        for value in inventory['values']:
+            variable_uid = value['variable_uid']
+            existing = index.get(variable_uid)
+            if existing is None:
+                base_inventory['values'].append(value)
+                index[variable_uid] = value
+                added += 1
+            elif existing != value:
+                self.resolve(existing, value,
+                             ('values', (year, variable_uid)), source)
+        logger.debug('merged %s new data values for year %s from %s',
+                     added, year, source)
+
+    def resolve(self, existing, item, key, source):
+        self.conflicts.append((key, source))
+        if self.policy == 'error':
+            raise MergeConflict(f'conflicting {key[0]} {key[1]} in {source}')
+        logger.warning('conflicting %s %s in %s, keeping %s value',
+                       key[0], key[1], source, self.policy)
+        if self.policy == 'last':
+            catalog = self.catalogs.get(key[0])
+            if catalog is not None:
+                for indexed in self.indexed_items(key[0], existing):
+                    catalog.unindex(indexed)
+            # replace content in place to preserve position in the tree
+            existing.clear()
+            existing.update(item)
+            if catalog is not None:
+                catalog.index_iterable(self.indexed_items(key[0], existing))
@@ -1,11 +1,18 @@
+from collections.abc import Mapping
 import functools
+import hashlib
 from importlib.resources import path as resource_path
 import logging
 import lzma
+import os
 import re
 from uuid import UUID
 
+from .bundle import MetadataBundle
+from .diff import fingerprint
+from .hashcons import Interner
 from .json import JSONTree, JSONCatalog
+from .records import Grid, Node, Variable, convert_list, record_hook
 
 
 logger = logging.getLogger(__name__)
@@ -21,7 +28,13 @@ def is_uuid4(value):
 
 class Metadata(JSONTree):
 
-    def __init__(self, data):
+    bundle = None  # MetadataBundle sectors are loaded from on demand
+
+    def __init__(self, data, records=False, frozen=False, shared=False):
+        if records and shared:
+            raise ValueError('shared metadata cannot be loaded as records')
+        self.records = records
+        self.shared = shared
         if data is None:
             # no metadata file given, read the bundled one
             with resource_path(__package__ + '.assets',
@@ -30,16 +43,113 @@ class Metadata(JSONTree):
                 data = lzma.LZMAFile(bundled_metadata_path, 'rb')
                 if not hasattr(data, 'name'):
                     data.name = 'bundled metadata.json.lzma'
-        super().__init__(data)
+                self.source_path = str(bundled_metadata_path)
+        else:
+            self.source_path = getattr(data, 'name', None)
+        if records:
+            super().__init__(data, object_pairs_hook=record_hook)
+        elif shared:
+            # identical subtrees are stored once, read-only; the table
+            # of distinct values is dropped after loading
+            interner = Interner()
+            if isinstance(data, Mapping):
+                data = interner.freeze(data)
+            super().__init__(data,
+                             object_pairs_hook=interner.object_pairs_hook)
+            logger.debug('shared %s distinct of %s metadata containers',
+                         interner.distinct, interner.containers)
+        else:
+            super().__init__(data)
         self.debug_version()
         self.node_index = JSONCatalog(
             ['uid', 'parent_uid', 'template_node_uid', 'name_prefix', 'name'],
-            self.traverse(self.nodes)
+            # parents are needed to report paths of found nodes
+            self.traverse(self.nodes, via='node', record_parents=True),
+            name='metadata_nodes'
         )
         self.dimension_instance_index = JSONCatalog(
-            ['uid', 'name'], self.traverse(self.navigation_root)
+            ['uid', 'name'],
+            self.traverse(self.navigation_root, via='children',
+                          record_parents=True),
+            name='metadata_dimension_instances'
         )
-        self.grid_index = JSONCatalog(['node_uid'], iter(self.grids))
+        self.grid_index = JSONCatalog(['node_uid'], iter(self.grids),
+                                      name='metadata_grids')
+        if frozen:
+            self.freeze()
+
+    @classmethod
+    def from_bundle(cls, path, frozen=False):
+        """Return metadata of bundle built by MetadataBundle.build(),
+        with the core loaded and sectors loaded on demand."""
+        bundle = MetadataBundle(path)
+        result = cls(bundle.read_core())
+        result.bundle = bundle
+        result.loaded_sectors = set()
+        if frozen:
+            result.freeze()
+        return result
+
+    def load_sector(self, uid):
+        """Load sector of given top level node UID from the bundle,
+        unless it is loaded or unknown."""
+        if self.bundle is None or uid in self.loaded_sectors \
+                or uid not in self.bundle.sectors:
+            return
+        self.invalidate()
+        part = self.bundle.read_sector(uid)
+        self.loaded_sectors.add(uid)
+        # sectors are kept in the order of the original metadata
+        positions = self.bundle.sectors
+        nodes = self.root['node']
+        index = sum(1 for node in nodes
+                    if positions[node['uid']][0] < positions[uid][0])
+        nodes[index:index] = part['node']
+        self.root['grid'].extend(part['grid'])
+        self.root['variable'].extend(part['variable'])
+        for node in part['node']:
+            self._cache_parent(node, nodes)
+            self.node_index.index_iterable(
+                self.traverse(node, via='node', record_parents=True)
+            )
+        self.grid_index.index_iterable(part['grid'])
+        logger.debug('loaded metadata sector %s from %s', uid,
+                     self.bundle.path)
+
+    def load_sectors(self, node_uid=None):
+        """Load sector of given node from the bundle, all sectors
+        if not given."""
+        if self.bundle is None:
+            return False
+        if node_uid is not None:
+            sector_uid = self.bundle.sector_of(node_uid)
+            if sector_uid is None or sector_uid in self.loaded_sectors:
+                return False
+            self.load_sector(sector_uid)
+            return True
+        missing = [uid for uid in self.bundle.sectors
+                   if uid not in self.loaded_sectors]
+        for uid in missing:
+            self.load_sector(uid)
+        return bool(missing)
+
+    def freeze(self):
+        """Build all derived structures upfront and make them read-only,
+        so that metadata can be shared by threads without locking."""
+        self.load_sectors()
+        for name in ('root', 'fingerprint', 'dimensions',
+                     'dimension_instances', 'variables', 'grids', 'nodes',
+                     'navigation_dimension', 'navigation_root'):
+            getattr(self, name)
+        # complete parent chains recorded by indexing up to the tree root,
+        # so that paths of found items are known without gc lookups
+        for item in (*self.nodes[:1], self.navigation_root):
+            if item is not None:
+                self.parents(item)
+        for catalog in (self.node_index, self.dimension_instance_index,
+                        self.grid_index):
+            catalog.freeze()
+        return super().freeze()
 
     def debug_version(self):
         if version := self.root.get('version'):
@@ -53,6 +163,21 @@ class Metadata(JSONTree):
     def root(self):
         return self.tree['Metadata'][0]
 
+    @functools.cached_property
+    def fingerprint(self):
+        if self.bundle is not None:
+            # of the whole metadata, whichever sectors are loaded
+            return self.bundle.fingerprint
+        # hashing the source file is much cheaper than the parsed tree
+        if isinstance(self.source_path, str) \
+                and os.path.isfile(self.source_path):
+            digest = hashlib.sha256()
+            with open(self.source_path, 'rb') as source:
+                while (block := source.read(1024 * 1024)):
+                    digest.update(block)
+            return digest.hexdigest()
+        return fingerprint(self.tree).hex()
+
     @functools.cached_property
     def dimensions(self):
         return self.root['dimension']
@@ -61,17 +186,21 @@ class Metadata(JSONTree):
     def dimension_instances(self):
         return self.root['dimension_instance']
 
+    def as_records(self, items, record_type, via=None):
+        return convert_list(items, record_type, via) if self.records \
+            else items
+
     @functools.cached_property
     def variables(self):
-        return self.root['variable']
+        return self.as_records(self.root['variable'], Variable)
 
     @functools.cached_property
     def grids(self):
-        return self.root['grid']
+        return self.as_records(self.root['grid'], Grid)
 
     @functools.cached_property
     def nodes(self):
-        return self.root['node']
+        return self.as_records(self.root['node'], Node, 'node')
 
     @functools.cached_property
     def navigation_dimension(self):
@@ -119,13 +248,21 @@ class Metadata(JSONTree):
             prefix, name = name.split(' ', 1)
             logger.debug('searching for unprefixed node name "%s"', name)
             filter_ = dict(filter_, name=name, name_prefix=prefix)
+        # UIDs are found in their own sector, names in any
+        self.load_sectors(filter_.get('uid'))
         yield from self.node_index.search(**filter_)
 
     def get_node(self, uid):
-        return self.node_index.first(uid=uid)
+        result = self.node_index.first(uid=uid)
+        if result is None and self.load_sectors(uid):
+            result = self.node_index.first(uid=uid)
+        return result
 
     def get_grid(self, node_uid):
-        return self.grid_index.first(node_uid=node_uid)
+        result = self.grid_index.first(node_uid=node_uid)
+        if result is None and self.load_sectors(node_uid):
+            result = self.grid_index.first(node_uid=node_uid)
+        return result
 
     def collect_sector_uids(self, filter_):
         result = {
@@ -0,0 +1,185 @@
+import bisect
+import logging
+import math
+import os
+import tempfile
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# checked by instrumented code before touching any metric,
+# so disabled metrics cost one global lookup per call
+enabled = False
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"')
+         .replace('\n', r'\n'))
+        for (name, value) in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"'
+                          for (name, value) in escaped) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+class Metric:
+
+    type_ = None
+
+    def __init__(self, name, help_, labels=()):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        for (labels, value) in sorted(self.values.items()):
+            yield self.name, labels, (), value
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.type_}'
+        for (name, values, extra, value) in self.samples():
+            yield (f'{name}{_format_labels(self.labels, values, extra)} '
+                   f'{_format_value(value)}')
+
+
+class Counter(Metric):
+
+    type_ = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge set explicitly, or collected by callback at export time.
+    The callback returns mapping of label value tuples to values."""
+
+    type_ = 'gauge'
+
+    def __init__(self, name, help_, labels=(), callback=None):
+        super().__init__(name, help_, labels)
+        self.callback = callback
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self):
+        if self.callback is not None:
+            with self.lock:
+                self.values = dict(self.callback())
+        yield from super().samples()
+
+
+class Histogram(Metric):
+
+    type_ = 'histogram'
+    default_buckets = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+    def __init__(self, name, help_, labels=(), buckets=default_buckets):
+        super().__init__(name, help_, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # per bucket counts, sum, count
+                state = self.values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0, 0
+                ]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        for (labels, (counts, total, count)) in sorted(self.values.items()):
+            cumulative = 0
+            for (bound, bucket_count) in zip(
+                self.buckets + (math.inf,), counts
+            ):
+                cumulative += bucket_count
+                yield (f'{self.name}_bucket', labels,
+                       [('le', _format_value(float(bound)))], cumulative)
+            yield f'{self.name}_sum', labels, (), total
+            yield f'{self.name}_count', labels, (), count
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        existing = self.metrics.setdefault(metric.name, metric)
+        if existing is not metric:
+            raise ValueError(f'metric "{metric.name}" already registered')
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+    def expose(self):
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].expose())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """Write metrics in Prometheus text format, replacing the file
+        atomically, as expected by node exporter textfile collector."""
+        directory = os.path.dirname(os.path.abspath(path))
+        (fd, temp_path) = tempfile.mkstemp(dir=directory, prefix='.',
+                                           suffix='.prom.tmp')
+        try:
+            with open(fd, 'w', encoding='utf-8') as output:
+                output.write(self.expose())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        logger.debug('metrics written into %s', path)
+
+
+REGISTRY = Registry()
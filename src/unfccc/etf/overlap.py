@@ -0,0 +1,254 @@
+import bz2
+import functools
+import itertools
+import logging
+import lzma
+import queue
+import threading
+import time
+import zlib
+
+from . import metrics
+from .util import pformat_size
+
+
+logger = logging.getLogger(__name__)
+
+IO_STAGE_SECONDS = metrics.REGISTRY.counter(
+    'etf_io_stage_seconds_total',
+    'time spent in stages of overlapped input and output', ['stage']
+)
+
+BLOCK_SIZE = 1024 * 1024
+QUEUE_DEPTH = 4
+
+# magic bytes -> decompressor factory; streams may be concatenated
+DECOMPRESSORS = [
+    (b'\x1f\x8b', lambda: zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)),
+    (b'\xfd7zXZ\x00', lzma.LZMADecompressor),
+    (b'BZh', bz2.BZ2Decompressor),
+]
+
+
+def decompressor_factory(head):
+    """Return factory of decompressor for data starting with `head`,
+    or None if the data is not compressed."""
+    for (magic, factory) in DECOMPRESSORS:
+        if head.startswith(magic):
+            return factory
+    return None
+
+
+def is_compressed(input_file):
+    """Check magic bytes of binary file, without consuming them."""
+    if hasattr(input_file, 'peek'):
+        head = input_file.peek(8)[:8]
+    else:
+        position = input_file.tell()
+        head = input_file.read(8)
+        input_file.seek(position)
+    return decompressor_factory(head) is not None
+
+
+class Stage:
+    """Worker thread exchanging blocks with the calling thread through
+    a bounded queue, so that I/O of one overlaps with work of the other.
+
+    Exceptions of the worker are raised again in the calling thread."""
+
+    def __init__(self, name, depth):
+        self.name = name
+        self.queue = queue.Queue(maxsize=max(depth, 1))
+        self.stopped = threading.Event()
+        self.error = None
+        self.busy = 0.0  # seconds spent in I/O by the worker
+        self.waited = 0.0  # seconds the calling thread waited for it
+        self.thread = threading.Thread(target=self._run,
+                                       name=f'etf-{name}', daemon=True)
+
+    def _run(self):
+        try:
+            self.work()
+        except BaseException as exc:
+            self.error = exc
+        finally:
+            self.done()
+
+    def _put(self, block):
+        """Put block into the queue unless the stage has been stopped,
+        return false if it has been."""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(block, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def log_timings(self, size):
+        logger.debug('%s: %s in %.2fs of I/O, %.2fs waited', self.name,
+                     pformat_size(size), self.busy, self.waited)
+        if metrics.enabled:
+            IO_STAGE_SECONDS.inc(self.name, amount=self.busy)
+            IO_STAGE_SECONDS.inc(f'{self.name} wait', amount=self.waited)
+
+
+class BlockReader(Stage):
+    """Iterable over blocks of a binary file, read ahead on a thread."""
+
+    def __init__(self, raw, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH):
+        super().__init__('reader', depth)
+        self.raw = raw
+        self.block_size = block_size
+
+    def work(self):
+        read = self.raw.read
+        while True:
+            started = time.perf_counter()
+            block = read(self.block_size)
+            self.busy += time.perf_counter() - started
+            if not block or not self._put(block):
+                return
+
+    def done(self):
+        # end of blocks, also after errors; taken by the consumer
+        # or by its cleanup
+        self.queue.put(None)
+
+    def __iter__(self):
+        self.thread.start()
+        try:
+            while True:
+                started = time.perf_counter()
+                block = self.queue.get()
+                self.waited += time.perf_counter() - started
+                if block is None:
+                    break
+                yield block
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.stopped.set()
+            while self.thread.is_alive():
+                try:
+                    self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+
+class BlockWriter(Stage):
+    """Text file collecting written chunks into blocks, which are
+    written to the output file by the worker, while the caller goes on
+    encoding. Use as context manager, which waits for the last block."""
+
+    def __init__(self, output, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH):
+        super().__init__('writer', depth)
+        self.output = output
+        self.block_size = block_size
+        self.chunks = []
+        self.pending = 0  # size of collected chunks
+        self.size = 0
+
+    def work(self):
+        while (block := self.queue.get()) is not None:
+            if self.stopped.is_set():
+                continue
+            started = time.perf_counter()
+            self.output.write(block)
+            self.busy += time.perf_counter() - started
+
+    def done(self):
+        # writes of the caller fail fast after errors
+        self.stopped.set()
+
+    def write(self, chunk):
+        self.chunks.append(chunk)
+        self.pending += len(chunk)
+        if self.pending >= self.block_size:
+            self._send()
+        return len(chunk)
+
+    def _send(self):
+        block = ''.join(self.chunks)
+        self.chunks = []
+        self.pending = 0
+        self.size += len(block)
+        started = time.perf_counter()
+        sent = self._put(block)
+        self.waited += time.perf_counter() - started
+        if not sent:
+            raise self.error
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None and self.chunks:
+            self._send()
+        if exc_type is not None:
+            # blocks in the queue are skipped
+            self.stopped.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+        if exc_type is not None:
+            return
+        if self.error is not None:
+            raise self.error
+        self.output.flush()
+        self.log_timings(self.size)
+
+
+def read_input(input_file, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH):
+    """Return whole content of input file as bytes, decompressing gzip,
+    xz or bzip2 data recognised by magic bytes.
+
+    With non-zero queue `depth` blocks are read on a thread ahead of
+    their decompression, both release the GIL and overlap."""
+    logger.info('reading %s', getattr(input_file, 'name', 'input'))
+    raw = getattr(input_file, 'buffer', input_file)
+    reader = None
+    if depth:
+        blocks = iter(reader := BlockReader(raw, block_size, depth))
+    else:
+        blocks = iter(functools.partial(raw.read, block_size), b'')
+    started = time.perf_counter()
+    first = next(blocks, b'')
+    factory = decompressor_factory(first)
+    decompressor = factory and factory()
+    size = 0
+    parts = []
+    for block in itertools.chain([first], blocks):
+        size += len(block)
+        if decompressor is None:
+            parts.append(block)
+            continue
+        while block:
+            parts.append(decompressor.decompress(block))
+            if not decompressor.eof:
+                break
+            # concatenated streams, like of `cat a.gz b.gz`
+            block = decompressor.unused_data
+            decompressor = factory()
+    result = b''.join(parts)
+    if reader is not None:
+        reader.log_timings(size)
+    if factory is not None:
+        logger.debug('decompressed %s into %s', pformat_size(size),
+                     pformat_size(len(result)))
+    logger.debug('input read in %.2fs', time.perf_counter() - started)
+    return result
+
+
+def write_output(dump, output, block_size=BLOCK_SIZE, depth=QUEUE_DEPTH):
+    """Call `dump(file)` to write output, with non-zero queue `depth`
+    through a BlockWriter."""
+    if not depth:
+        return dump(output)
+    with BlockWriter(output, block_size, depth) as writer:
+        return dump(writer)
@@ -0,0 +1,189 @@
+from collections.abc import Mapping, MutableMapping
+import sys
+
+from .json import JSONTreeWalker
+
+
+def slot_name(field):
+    return f'_f_{field}'
+
+
+class Record(MutableMapping):
+    """Compact JSON object with a fixed set of fields.
+
+    Known fields are stored in slots, unknown keys go to overflow dict.
+    Key order is kept as a tuple shared by all records of the same shape,
+    so records serialise back into identical JSON."""
+
+    __slots__ = ('_keys', '_extra')
+    fields = ()
+    signature = None  # keys identifying the record type in decoder hook
+
+    _slots = {}  # field name -> slot name
+    _shapes = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # slots are prefixed to not shadow Mapping methods like values()
+        cls._slots = {field: slot_name(field) for field in cls.fields}
+        JSONTreeWalker.register_object_type(cls)
+
+    def __init__(self, pairs=()):
+        self._keys = ()
+        self._extra = None
+        if isinstance(pairs, Mapping):
+            pairs = pairs.items()
+        keys = []
+        slots = self._slots
+        for key, value in pairs:
+            if key in slots:
+                setattr(self, slots[key], value)
+            else:
+                if self._extra is None:
+                    self._extra = {}
+                self._extra[key] = value
+            keys.append(key)
+        self._keys = self._intern(tuple(keys))
+
+    @classmethod
+    def _intern(cls, keys):
+        return cls._shapes.setdefault(keys, keys)
+
+    @classmethod
+    def from_dict(cls, item):
+        return item if isinstance(item, cls) else cls(item)
+
+    def __getitem__(self, key):
+        if key in self._slots:
+            try:
+                return getattr(self, self._slots[key])
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def get(self, key, default=None):
+        if key in self._slots:
+            return getattr(self, self._slots[key], default)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._keys = self._intern(self._keys + (key,))
+        if key in self._slots:
+            setattr(self, self._slots[key], value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._keys = self._intern(
+            tuple(other for other in self._keys if other != key)
+        )
+        if key in self._slots:
+            delattr(self, self._slots[key])
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in self._slots:
+            return hasattr(self, self._slots[key])
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def values(self):
+        return [self[key] for key in self._keys]
+
+    def items(self):
+        return [(key, self[key]) for key in self._keys]
+
+    def clear(self):
+        for key in self._keys:
+            if key in self._slots:
+                delattr(self, self._slots[key])
+        self._keys = ()
+        self._extra = None
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()!r})'
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + (
+            0 if self._extra is None else sys.getsizeof(self._extra)
+        )
+
+    def __reduce__(self):
+        return (self.__class__, (self.items(),))
+
+
+class Node(Record):
+    fields = ('uid', 'parent_uid', 'template_node_uid', 'name_prefix',
+              'name', 'node')
+    __slots__ = tuple(slot_name(field) for field in fields)
+    signature = frozenset(['uid', 'name_prefix'])
+
+
+class Variable(Record):
+    fields = ('id', 'uid', 'node_uid', 'template_var_uid', 'name')
+    __slots__ = tuple(slot_name(field) for field in fields)
+    signature = frozenset(['uid', 'node_uid'])
+
+
+class Grid(Record):
+    fields = ('uid', 'node_uid', 'group')
+    __slots__ = tuple(slot_name(field) for field in fields)
+    signature = frozenset(['node_uid', 'group'])
+
+
+class LineDescription(Record):
+    fields = ('uid', 'variable_uid', 'description')
+    __slots__ = tuple(slot_name(field) for field in fields)
+
+
+class Value(Record):
+    fields = ('variable_uid', 'value')
+    __slots__ = tuple(slot_name(field) for field in fields)
+    signature = frozenset(['variable_uid', 'value'])
+
+
+class Inventory(Record):
+    fields = ('inventory_year', 'values')
+    __slots__ = tuple(slot_name(field) for field in fields)
+    signature = frozenset(['inventory_year', 'values'])
+
+
+# decoder hook candidates, the most specific signatures first
+hook_types = (Value, Inventory, Grid, Variable, Node)
+
+
+def record_hook(pairs):
+    """`object_pairs_hook` for `json.load()` producing records
+    for recognised objects and plain dicts for the rest."""
+    keys = {key for (key, _) in pairs}
+    for record_type in hook_types:
+        if record_type.signature <= keys:
+            return record_type(pairs)
+    return dict(pairs)
+
+
+def convert_list(items, record_type, via=None):
+    """Replace objects of the list with records in place."""
+    for index, item in enumerate(items):
+        record = items[index] = record_type.from_dict(item)
+        if via is not None and isinstance(record.get(via), list):
+            convert_list(record[via], record_type, via)
+    return items
@@ -0,0 +1,186 @@
+import itertools
+import json
+import re
+
+# Structural scanning of UTF-8 JSON in bytes-like buffers (bytes, mmap)
+# without building Python objects. Strings are skipped by the regular
+# expression engine, so Python code only runs once per bracket.
+
+
+WHITESPACE = re.compile(rb'[ \t\n\r]*')
+STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+SCALAR = re.compile(rb'[^,:\[\]{}" \t\n\r]+')
+# next bracket outside of strings
+BRACKET = re.compile(
+    rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*([\[\]{}])', re.S
+)
+
+OPENING = frozenset(b'[{')
+WHITESPACE_BYTES = frozenset(b' \t\n\r')
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def skip_whitespace(buffer, position):
+    return WHITESPACE.match(buffer, position).end()
+
+
+def start_position(buffer):
+    """Return position of the top level value, skipping BOM mark."""
+    position = len(UTF8_BOM) if buffer[:len(UTF8_BOM)] == UTF8_BOM else 0
+    return skip_whitespace(buffer, position)
+
+
+def _error(buffer, position, expected):
+    found = bytes(buffer[position:position + 10])
+    return ValueError(f'malformed JSON at position {position}: '
+                      f'expected {expected}, found {found!r}')
+
+
+def skip_value(buffer, position, known=None):
+    """Return end position of JSON value starting at `position`.
+    Nested values with start position in `known` mapping
+    are skipped to the mapped end position without scanning."""
+    first = buffer[position:position + 1]
+    if first in (b'{', b'['):
+        depth = 0
+        match_bracket = BRACKET.match
+        while True:
+            match = match_bracket(buffer, position)
+            if match is None:
+                raise _error(buffer, position, 'closing bracket')
+            position = match.end()
+            if buffer[position - 1] in OPENING:
+                if known and position - 1 in known:
+                    position = known[position - 1]
+                    if depth == 0:
+                        return position
+                    continue
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return position
+    match = (STRING if first == b'"' else SCALAR).match(buffer, position)
+    if match is None:
+        raise _error(buffer, position, 'JSON value')
+    return match.end()
+
+
+def _expect(buffer, position, token):
+    if buffer[position:position + 1] != token:
+        raise _error(buffer, position, token)
+    return skip_whitespace(buffer, position + 1)
+
+
+def iter_members(buffer, position, skip=None):
+    """Iterate over (key, start, end) of members of the object
+    starting at `position`. If given, `skip(key, start)` returns
+    end positions of member values."""
+    position = _expect(buffer, position, b'{')
+    if buffer[position:position + 1] == b'}':
+        return
+    while True:
+        match = STRING.match(buffer, position)
+        if match is None:
+            raise _error(buffer, position, 'object key')
+        key = json.loads(buffer[match.start():match.end()])
+        position = _expect(buffer, skip_whitespace(buffer, match.end()),
+                           b':')
+        end = skip_value(buffer, position) if skip is None \
+            else skip(key, position)
+        yield key, position, end
+        position = skip_whitespace(buffer, end)
+        if buffer[position:position + 1] == b'}':
+            return
+        position = _expect(buffer, position, b',')
+
+
+def iter_elements(buffer, position, skip=None):
+    """Iterate over (start, end) of elements of the array
+    starting at `position`. If given, `skip(index, start)` returns
+    end positions of elements."""
+    position = _expect(buffer, position, b'[')
+    if buffer[position:position + 1] == b']':
+        return
+    for index in itertools.count():
+        end = skip_value(buffer, position) if skip is None \
+            else skip(index, position)
+        yield position, end
+        position = skip_whitespace(buffer, end)
+        if buffer[position:position + 1] == b']':
+            return
+        position = _expect(buffer, position, b',')
+
+
+def locate(buffer, *keys, position=None):
+    """Return (start, end) of the value at nested object `keys`,
+    or None if any of the keys is missing."""
+    if position is None:
+        position = start_position(buffer)
+    span = None
+    for key in keys:
+        if buffer[position:position + 1] != b'{':
+            return None
+        for (member, start, end) in iter_members(buffer, position):
+            if member == key:
+                span = (start, end)
+                position = start
+                break
+        else:
+            return None
+    return span or (position, skip_value(buffer, position))
+
+
+def skip_back(buffer, position):
+    """Return position of the last non-whitespace byte before `position`."""
+    position -= 1
+    while position >= 0 and buffer[position] in WHITESPACE_BYTES:
+        position -= 1
+    return position
+
+
+def anchored_elements(buffer, key):
+    """Locate the array of objects starting with member `key`.
+
+    The key is searched literally, so the content of array elements
+    is not scanned, except the last one. Return (start, end, elements)
+    where elements is a list of (key value, start, end) tuples,
+    or None if occurrences of the key do not form such an array."""
+    anchor = re.compile(rb'"' + re.escape(key.encode('utf-8')) + rb'"\s*:\s*')
+    elements = []
+    for match in anchor.finditer(buffer):
+        start = skip_back(buffer, match.start())
+        if buffer[start:start + 1] != b'{':
+            # not the first member, or key quoted inside a string
+            return None
+        value_end = skip_value(buffer, match.end())
+        elements.append([json.loads(buffer[match.end():value_end]), start])
+    if not elements:
+        return None
+    array_start = skip_back(buffer, elements[0][1])
+    if buffer[array_start:array_start + 1] != b'[':
+        return None
+    for (element, next_element) in zip(elements, elements[1:]):
+        comma = skip_back(buffer, next_element[1])
+        end = skip_back(buffer, comma)
+        if buffer[comma:comma + 1] != b',' or buffer[end:end + 1] != b'}':
+            return None
+        element.append(end + 1)
+    elements[-1].append(skip_value(buffer, elements[-1][1]))
+    array_end = skip_whitespace(buffer, elements[-1][2])
+    if buffer[array_end:array_end + 1] != b']':
+        return None
+    return array_start, array_end + 1, [tuple(item) for item in elements]
+
+
+def member_value(buffer, key, position):
+    """Return parsed value of `key` member of the object
+    at `position`, or None."""
+    span = locate(buffer, key, position=position)
+    return None if span is None else json.loads(buffer[span[0]:span[1]])
+
+
+def is_scannable(buffer):
+    """Check that buffer holds UTF-8 JSON object."""
+    position = start_position(buffer)
+    return buffer[position:position + 1] == b'{'
@@ -0,0 +1,235 @@
+import errno
+import json
+import logging
+import os
+import re
+
+from . import scanner
+from .cow import OVERLAY_TYPES, unwrap
+from .json import JSONTreeWalker
+
+
+logger = logging.getLogger(__name__)
+
+# separator of adjacent array elements in the source
+ELEMENT_SEPARATOR = re.compile(rb'[ \t\n\r]*,[ \t\n\r]*')
+# ranges shorter than this are written from memory, not copied by kernel
+MIN_KERNEL_COPY = 64 * 1024
+BUFFER_SIZE = 1024 * 1024
+# errors of copy_file_range() and sendfile() meaning "not supported here"
+UNSUPPORTED_COPY = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ESPIPE,
+                    errno.EBADF, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+class SourceSpans:
+    """Byte ranges of parsed JSON containers in the source buffer.
+
+    Containers are recorded together with their recorded parent, so
+    marking a container dirty also marks all recorded ancestors.
+    Containers which are clean can be copied from the source
+    instead of being serialised again."""
+
+    def __init__(self, buffer, source_file=None):
+        self.buffer = buffer
+        # file holding exactly the buffer, for copying in kernel
+        self.source_file = source_file
+        self.spans = {}  # id -> (item, start, end)
+        self.parents = {}  # id -> parent item
+        self.dirty = set()
+        # start -> end positions of located values, not to be scanned
+        self.known = {}
+
+    def add(self, item, start, end, parent=None):
+        self.spans[id(item)] = (item, start, end)
+        self.known[start] = end
+        if parent is not None:
+            self.parents[id(item)] = parent
+
+    def scan(self, item, start, depth, parent=None):
+        """Record span of container `item` starting at `start`, and of
+        containers nested up to `depth` levels below it. Return end
+        position of the item."""
+        buffer = self.buffer
+        is_container = JSONTreeWalker.is_json_container(item)
+        if start in self.known:
+            end = self.known[start]
+        elif depth <= 0 or not is_container:
+            end = scanner.skip_value(buffer, start, self.known)
+        else:
+            if JSONTreeWalker.is_object(item):
+                members = scanner.iter_members(
+                    buffer, start,
+                    lambda key, position: self.scan(
+                        item.get(key), position, depth - 1, item
+                    )
+                )
+            else:
+                members = scanner.iter_elements(
+                    buffer, start,
+                    lambda index, position: self.scan(
+                        item[index] if index < len(item) else None,
+                        position, depth - 1, item
+                    )
+                )
+            end = start + 1
+            for member in members:
+                end = member[-1]
+            # closing bracket
+            end = scanner.skip_whitespace(buffer, end) + 1
+        if is_container:
+            self.add(item, start, end, parent)
+        return end
+
+    def mark_dirty(self, item):
+        if type(item) in OVERLAY_TYPES:
+            # overlays know whether they differ from their base
+            return
+        dirty = self.dirty
+        parents = self.parents
+        while item is not None and id(item) not in dirty:
+            dirty.add(id(item))
+            item = parents.get(id(item))
+
+    def clean_span(self, item):
+        """Return (start, end) of item if it can be copied, else None."""
+        object_id = id(unwrap(item))
+        span = self.spans.get(object_id)
+        if span is None or object_id in self.dirty:
+            return None
+        return span[1], span[2]
+
+
+class SpliceWriter:
+    """JSON writer copying clean containers from the source.
+
+    Dirty containers are serialised member by member, so only the
+    modified parts of the tree pass through the JSON encoder. Copied
+    ranges keep formatting of the source."""
+
+    def __init__(self, spans, indent=4, default=None):
+        self.spans = spans
+        self.indent = indent
+        self.encoder = json.JSONEncoder(indent=indent, default=default)
+        self.output = None
+        self.pending = []
+        self.pending_size = 0
+        self.copied = self.encoded = 0
+        self.kernel_copy = spans.source_file is not None
+
+    def write(self, tree, output):
+        output.flush()
+        binary = getattr(output, 'buffer', None)
+        self.output = output if binary is None else binary
+        self.text = binary is None
+        self._write(tree, 0)
+        self.flush()
+        logger.debug('spliced %s bytes from source, encoded %s bytes',
+                     self.copied, self.encoded)
+
+    def emit(self, chunk):
+        data = chunk.encode('utf-8')
+        self.encoded += len(data)
+        self.append(data)
+
+    def append(self, data):
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            data = b''.join(self.pending)
+            self.output.write(data.decode('utf-8') if self.text else data)
+            self.pending = []
+            self.pending_size = 0
+        self.output.flush()
+
+    def copy(self, start, end):
+        self.copied += end - start
+        if self.kernel_copy and not self.text \
+                and end - start >= MIN_KERNEL_COPY:
+            self.flush()
+            start = self.copy_range(start, end)
+            if start == end:
+                return
+        self.append(self.spans.buffer[start:end])
+
+    def copy_range(self, start, end):
+        """Copy source range by the kernel, return position up to which
+        it has been copied."""
+        try:
+            source_fd = self.spans.source_file.fileno()
+            output_fd = self.output.fileno()
+        except (AttributeError, OSError, ValueError):
+            self.kernel_copy = False
+            return start
+        for copy in (self._copy_file_range, self._sendfile):
+            try:
+                while start < end:
+                    copied = copy(source_fd, output_fd, start, end - start)
+                    if not copied:
+                        break
+                    start += copied
+                return start
+            except OSError as exc:
+                if exc.errno not in UNSUPPORTED_COPY:
+                    raise
+                logger.debug('%s is not supported: %s', copy.__name__, exc)
+        self.kernel_copy = False
+        return start
+
+    @staticmethod
+    def _copy_file_range(source_fd, output_fd, offset, count):
+        if not hasattr(os, 'copy_file_range'):
+            raise OSError(errno.ENOSYS, 'copy_file_range() is not available')
+        return os.copy_file_range(source_fd, output_fd, count, offset)
+
+    @staticmethod
+    def _sendfile(source_fd, output_fd, offset, count):
+        if not hasattr(os, 'sendfile'):
+            raise OSError(errno.ENOSYS, 'sendfile() is not available')
+        return os.sendfile(output_fd, source_fd, offset, count)
+
+    def newline(self, level):
+        return '\n' + ' ' * (self.indent * level)
+
+    def _write(self, item, level):
+        span = self.spans.clean_span(item)
+        if span is not None:
+            self.copy(*span)
+        elif JSONTreeWalker.is_object(item) and item:
+            self.emit('{')
+            for index, (key, value) in enumerate(item.items()):
+                self.emit((',' if index else '') + self.newline(level + 1)
+                          + json.dumps(key) + ': ')
+                self._write(value, level + 1)
+            self.emit(self.newline(level) + '}')
+        elif JSONTreeWalker.is_array(item) and item:
+            self.emit('[')
+            self._write_elements(item, level + 1)
+            self.emit(self.newline(level) + ']')
+        else:
+            self.emit(self.encoder.encode(item)
+                      .replace('\n', self.newline(level)))
+
+    def _write_elements(self, items, level):
+        # runs of clean elements adjacent in the source are copied at once
+        run = None
+        for index, item in enumerate(items):
+            span = self.spans.clean_span(item)
+            if span is not None and run is not None \
+                    and ELEMENT_SEPARATOR.fullmatch(
+                        self.spans.buffer, run[1], span[0]):
+                run[1] = span[1]
+                continue
+            if run is not None:
+                self.copy(*run)
+                run = None
+            self.emit((',' if index else '') + self.newline(level))
+            if span is not None:
+                run = list(span)
+            else:
+                self._write(item, level)
+        if run is not None:
+            self.copy(*run)
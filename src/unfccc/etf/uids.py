@@ -0,0 +1,54 @@
+from hashlib import blake2b
+import os
+
+
+UID_BYTES = 12  # 24 hex digits, as generated by the reporting tool
+
+
+class RandomUIDs:
+    """Random UIDs cut from a block of randomness, which is fetched
+    with a single `os.urandom` call per `block_size` UIDs."""
+
+    def __init__(self, block_size=4096):
+        self.block_size = block_size
+        self.block = b''
+        self.position = 0
+
+    def __call__(self, *name):
+        if self.position >= len(self.block):
+            self.block = os.urandom(UID_BYTES * self.block_size)
+            self.position = 0
+        position = self.position
+        self.position += UID_BYTES
+        return self.block[position:self.position].hex()
+
+
+class DeterministicUIDs:
+    """Name-based UIDs derived from the hash of the object name, like
+    (kind, node uid, template uid), so repeated runs on the same input
+    produce identical output. Repeated names get a sequence number."""
+
+    def __init__(self, namespace=''):
+        self.namespace = namespace
+        self.attempts = {}
+
+    def __call__(self, *name):
+        key = ':'.join([self.namespace, *map(str, name)])
+        attempt = self.attempts.get(key, 0)
+        self.attempts[key] = attempt + 1
+        if attempt:
+            key = f'{key}#{attempt}'
+        return blake2b(key.encode('utf-8'), digest_size=UID_BYTES).hexdigest()
+
+
+uid_modes = {
+    'random': RandomUIDs,
+    'deterministic': DeterministicUIDs,
+}
+
+
+def make_allocator(mode='random'):
+    try:
+        return uid_modes[mode]()
+    except KeyError:
+        raise ValueError(f'unknown UID mode "{mode}"') from None
@@ -1,4 +1,5 @@
 from collections.abc import Iterator
+from importlib import metadata as package_metadata
 import itertools
 import logging
 import sys
@@ -21,6 +22,13 @@ def pformat_size(size):
     )
 
 
+def package_version():
+    try:
+        return package_metadata.version('unfccc-etf-cli')
+    except package_metadata.PackageNotFoundError:
+        return 'unknown'
+
+
 def sizeof_dict(obj):
     result = sys.getsizeof(obj)
     for (key, value) in obj.items():
@@ -97,3 +97,52 @@ def raw_metadata(nodes):
             }
         ]
     }
+
+
+@pytest.fixture
+def raw_country_data(uid):
+    node_uid = uid()
+    variable_uid = uid()
+    return {
+        'country_specific_data': {
+            'nodes': [
+                {
+                    'uid': node_uid,
+                    'parent_uid': 'db7b9be0-76bc-497e-a4ee-9334ec2429d2',
+                    'template_node_uid': uid(),
+                    'name_prefix': '4.A.1.',
+                    'name': 'Forest land remaining forest land',
+                }
+            ],
+            'variables': [
+                {
+                    'uid': variable_uid,
+                    'node_uid': node_uid,
+                    'template_var_uid': uid(),
+                }
+            ],
+            'grids': [],
+            'line_description': [],
+        },
+        'data': {
+            'values': [
+                {
+                    'inventory_year': 1990,
+                    'values': [
+                        {'variable_uid': variable_uid, 'value': 1.0},
+                        {
+                            'variable_uid':
+                                'de6fab87-82f6-46d5-b8f5-73190d8e4ace',
+                            'value': 2.0
+                        },
+                    ]
+                },
+                {
+                    'inventory_year': 2020,
+                    'values': [
+                        {'variable_uid': variable_uid, 'value': 3.0},
+                    ]
+                },
+            ]
+        }
+    }
@@ -0,0 +1,42 @@
+from copy import deepcopy
+
+import pytest
+
+from unfccc.etf.bundle import MetadataBundle
+from unfccc.etf.countrydata import CountryData
+from unfccc.etf.metadata import Metadata
+
+
+@pytest.fixture
+def metadata(raw_metadata):
+    return Metadata(raw_metadata)
+
+
+@pytest.fixture
+def bundled(tmp_path, metadata):
+    MetadataBundle.build(metadata, tmp_path / 'bundle')
+    return Metadata.from_bundle(tmp_path / 'bundle')
+
+
+def test_load_on_demand(metadata, bundled, metadata_node):
+    assert bundled.nodes == []
+    assert bundled.fingerprint == metadata.fingerprint
+    node = bundled.get_node(metadata_node['uid'])
+    assert node == metadata_node
+    assert bundled.loaded_sectors == {metadata_node['uid']}
+    assert bundled.get_node('unknown') is None
+    # names may be found in any sector
+    (found,) = bundled.find_nodes({'name': 'Waste'})
+    assert bundled.tree == metadata.tree
+    assert bundled.json_path(found) == '.Metadata[0].node[4]'
+
+
+def test_filter_sector(metadata, bundled, raw_country_data):
+    results = []
+    for source in (metadata, bundled):
+        country_data = CountryData(source, deepcopy(raw_country_data))
+        country_data.filter_sector('lulucf')
+        results.append(country_data.tree)
+    assert results[0] == results[1]
+    assert len(bundled.loaded_sectors) == 1
+    assert bundled.freeze().nodes == metadata.nodes
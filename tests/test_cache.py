@@ -0,0 +1,54 @@
+import io
+import os
+
+import pytest
+
+from unfccc.etf.cache import ResultCache, parse_size
+
+
+@pytest.fixture
+def result_cache(tmp_path):
+    return ResultCache(str(tmp_path / 'cache'), '1k')
+
+
+def test_parse_size():
+    assert parse_size('512') == 512
+    assert parse_size('2k') == 2048
+    assert parse_size('1.5M') == 1536 * 1024
+
+
+def test_cache_key():
+    key = ResultCache.make_key(b'{}', 'meta', 'etf data fix',
+                               {'requirements': ('ALL',)})
+    assert key == ResultCache.make_key(b'{}', 'meta', 'etf data fix',
+                                       {'requirements': ('ALL',)})
+    assert key != ResultCache.make_key(b'{}', 'meta', 'etf data fix',
+                                       {'requirements': ('GRIDS',)})
+    assert key != ResultCache.make_key(b'{ }', 'meta', 'etf data fix',
+                                       {'requirements': ('ALL',)})
+
+
+def test_cache_store_copy(result_cache):
+    output = io.StringIO()
+    assert not result_cache.copy('ab' * 32, output)
+    with result_cache.store('ab' * 32) as cache_file:
+        cache_file.write('{"result": 1}')
+    assert result_cache.copy('ab' * 32, output)
+    assert output.getvalue() == '{"result": 1}'
+    assert result_cache.stats()['entries'] == 1
+
+
+def test_cache_prune_lru(result_cache):
+    for index, key in enumerate(['aa' * 32, 'bb' * 32, 'cc' * 32]):
+        with result_cache.store(key) as cache_file:
+            cache_file.write('x' * 400)
+        path = result_cache.entry_path(key)
+        os.utime(path, (index, index))
+    # the oldest entry has been evicted on the last store
+    assert not os.path.exists(result_cache.entry_path('aa' * 32))
+    # reading refreshes the entry, so the other one gets evicted
+    result_cache.open('bb' * 32).close()
+    assert result_cache.prune(500) == 1
+    assert os.path.exists(result_cache.entry_path('bb' * 32))
+    assert result_cache.prune(0) == 1
+    assert result_cache.stats()['entries'] == 0
@@ -0,0 +1,137 @@
+import gzip
+import io
+import json
+
+import click
+import click.testing
+import pytest
+
+from unfccc.etf import cli
+from unfccc.etf.metadata import Metadata
+
+
+def test_parse_pipeline():
+    ctx = click.Context(cli.run, info_name='run')
+    pipeline = cli.parse_pipeline(ctx, [
+        'filter', '-s', '1', 'then', 'fix', '-r', 'GRIDS', 'then', 'stats'
+    ])
+    assert pipeline == [
+        (cli.filter_step, {'sector': '1'}),
+        (cli.fix_step, {'requirements': ('GRIDS',), 'uid_mode': None}),
+        (cli.stats_step, {}),
+    ]
+
+
+@pytest.mark.parametrize('args', [[], ['then'], ['bogus'], ['filter']])
+def test_parse_pipeline_errors(args):
+    ctx = click.Context(cli.run, info_name='run')
+    with pytest.raises(click.UsageError):
+        cli.parse_pipeline(ctx, args)
+
+
+@pytest.mark.parametrize('name, stem', [
+    ('data/country.json', 'country'), ('-', 'country_data'),
+    ('<stdin>', 'country_data'),
+])
+def test_file_stem(name, stem):
+    assert cli.file_stem(name) == stem
+
+
+@pytest.mark.parametrize('compress', [bytes, gzip.compress])
+def test_load_spliced(tmp_path, raw_metadata, raw_country_data, compress):
+    path = tmp_path / 'data.json'
+    path.write_bytes(compress(json.dumps(raw_country_data).encode('utf-8')))
+    ctx = click.Context(cli.fix, info_name='fix')
+    ctx.params = {'splice': True}
+    with open(path, 'rb') as input_file:
+        country_data = cli.load_country_data(ctx, Metadata(raw_metadata),
+                                             input_file, io.StringIO())
+    assert country_data.tree == raw_country_data
+    assert country_data.spans is not None
+
+
+def test_load_parse_jobs(tmp_path, raw_metadata, raw_country_data,
+                         monkeypatch):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps(raw_country_data))
+    # regular files are mapped by parsing workers, not read
+    monkeypatch.setattr(cli, 'read_input', None)
+    ctx = click.Context(cli.fix, info_name='fix')
+    ctx.meta['etf.parse_jobs'] = 2
+    with open(path, 'rb') as input_file:
+        country_data = cli.load_country_data(ctx, Metadata(raw_metadata),
+                                             input_file, io.StringIO())
+    assert country_data.tree == raw_country_data
+
+
+def test_run_rejects_nested_jobs(tmp_path, raw_metadata):
+    metadata_path = tmp_path / 'metadata.json'
+    metadata_path.write_text(json.dumps(raw_metadata))
+    result = click.testing.CliRunner().invoke(cli.main, [
+        '-m', str(metadata_path), '--parse-jobs', '2', 'data', 'run',
+        '-j', '2', '-o', str(tmp_path / '{stem}.out.json'),
+        '-i', 'a.json', '-i', 'b.json', 'fix'
+    ])
+    assert result.exit_code == 2
+    assert '--parse-jobs cannot be combined' in result.output
+
+
+@pytest.mark.parametrize('args', [
+    ['--cache-size', 'lots', 'cache', 'stats'],
+    ['cache', 'prune', '--max-size', '1X'],
+])
+def test_size_errors(tmp_path, raw_metadata, args):
+    metadata_path = tmp_path / 'metadata.json'
+    metadata_path.write_text(json.dumps(raw_metadata))
+    result = click.testing.CliRunner().invoke(cli.main, [
+        '-m', str(metadata_path), '--cache-dir', str(tmp_path)
+    ] + args)
+    assert result.exit_code == 2
+    assert 'is not a size like 1M' in result.output
+
+
+def test_years():
+    assert cli.YEARS.convert('1990,2020-2022', None, None) == \
+        {1990, 2020, 2021, 2022}
+    for value in ('2022-2020', '1990,x'):
+        with pytest.raises(click.BadParameter):
+            cli.YEARS.convert(value, None, None)
+
+
+def test_filter_from_index(tmp_path, raw_metadata, raw_country_data,
+                           metadata_node):
+    metadata_path = tmp_path / 'metadata.json'
+    metadata_path.write_text(json.dumps(raw_metadata))
+    data_path = tmp_path / 'data.json'
+    data_path.write_text(json.dumps(raw_country_data))
+    options = ['-m', str(metadata_path), 'data']
+    runner = click.testing.CliRunner()
+    result = runner.invoke(cli.main, options + [
+        'index', str(data_path), str(tmp_path / 'data.sqlite')
+    ])
+    assert result.exit_code == 0
+    filter_ = ['filter', '-s', metadata_node['uid'],
+               '--from-index', str(tmp_path / 'data.sqlite')]
+    result = runner.invoke(cli.main, options + filter_ + [
+        str(tmp_path / 'energy.json')
+    ])
+    assert result.exit_code == 0
+    runner.invoke(cli.main, options + [
+        'filter', '-s', metadata_node['uid'], str(data_path),
+        str(tmp_path / 'expected.json')
+    ])
+    assert json.loads((tmp_path / 'energy.json').read_text()) == \
+        json.loads((tmp_path / 'expected.json').read_text())
+    result = runner.invoke(cli.main, options + filter_ + [
+        str(data_path), str(tmp_path / 'energy.json')
+    ])
+    assert result.exit_code == 2
+    assert 'cannot be given with --from-index' in result.output
+
+
+def test_cache_without_metadata(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli, 'Metadata', None)
+    result = click.testing.CliRunner().invoke(cli.main, [
+        '--cache-dir', str(tmp_path), 'cache', 'prune', '--max-size', '0'
+    ])
+    assert result.exit_code == 0
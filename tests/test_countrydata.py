@@ -0,0 +1,200 @@
+from copy import deepcopy
+import gc
+import io
+import json
+
+import pytest
+
+from unfccc.etf import scanner
+from unfccc.etf.countrydata import CountryData
+from unfccc.etf.metadata import Metadata
+
+
+@pytest.fixture
+def metadata(raw_metadata):
+    return Metadata(raw_metadata)
+
+
+@pytest.mark.parametrize('source', ['object', 'json', 'utf-16'])
+def test_select_years(metadata, raw_country_data, source):
+    data = raw_country_data
+    if source != 'object':
+        data = json.dumps(data, indent=4).encode(
+            'utf-8' if source == 'json' else 'utf-16'
+        )
+    country_data = CountryData(metadata, data, years={2020, 2021})
+    assert [inventory['inventory_year']
+            for inventory in country_data.data] == [2020]
+
+
+def test_iter_years(raw_country_data):
+    source = json.dumps(raw_country_data).encode('utf-8')
+    years = list(CountryData.iter_years(source))
+    assert [year for (year, _) in years] == [1990, 2020]
+    for (year, tree) in years:
+        assert tree['country_specific_data'] == \
+            raw_country_data['country_specific_data']
+        assert [inventory['inventory_year']
+                for inventory in tree['data']['values']] == [year]
+
+
+@pytest.mark.parametrize('source', ['bytes', 'file'])
+@pytest.mark.parametrize('records', [False, True])
+def test_parse_parallel(metadata, raw_country_data, tmp_path, caplog, source,
+                        records):
+    data = json.dumps(raw_country_data, indent=4).encode('utf-8')
+    expected = CountryData(metadata, data, records=records).tree
+    caplog.set_level('INFO')
+    if source == 'file':
+        path = tmp_path / 'data.json'
+        path.write_bytes(data)
+        with open(path, 'rb') as data_file:
+            country_data = CountryData(metadata, data_file, records=records,
+                                       parse_jobs=2)
+    else:
+        country_data = CountryData(metadata, data, records=records,
+                                   parse_jobs=2)
+    assert 'parsing 2 inventory years in 2 processes' in caplog.text
+    assert country_data.tree == expected
+
+
+def test_parse_parallel_fallback(metadata, raw_country_data, caplog,
+                                 monkeypatch):
+    anchored_elements = scanner.anchored_elements
+
+    def miscut_elements(source, key):
+        (start, end, elements) = anchored_elements(source, key)
+        return start, end, [(year, begin + 1, finish)
+                            for (year, begin, finish) in elements]
+
+    monkeypatch.setattr(scanner, 'anchored_elements', miscut_elements)
+    caplog.set_level('DEBUG')
+    data = json.dumps(raw_country_data).encode('utf-8')
+    country_data = CountryData(metadata, data, parse_jobs=2)
+    assert 'parallel parsing failed' in caplog.text
+    assert country_data.tree == raw_country_data
+
+
+def test_parse_parallel_closes_map(metadata, raw_country_data, tmp_path,
+                                   monkeypatch):
+    path = tmp_path / 'data.json'
+    path.write_bytes(json.dumps(raw_country_data).encode('utf-8'))
+    maps = []
+    map_source = CountryData.map_source.__func__
+
+    def recording_map_source(cls, data):
+        maps.append(map_source(cls, data))
+        return maps[-1]
+
+    monkeypatch.setattr(CountryData, 'map_source',
+                        classmethod(recording_map_source))
+    with open(path, 'rb') as data_file:
+        country_data = CountryData(metadata, data_file, parse_jobs=2)
+    assert country_data.tree == raw_country_data
+    assert len(maps) == 1 and maps[0].closed
+
+
+def test_filter_out_keeps_indexes(metadata, raw_country_data):
+    country_data = CountryData(metadata, raw_country_data)
+    node = country_data.nodes[0]
+    variable = country_data.variables[0]
+    deleted = country_data.filter_out(country_data.nodes, lambda _: False)
+    assert deleted == [0]
+    assert country_data.nodes == []
+    assert country_data.get_node(node['uid'], False) is None
+    # other collections are intact
+    assert country_data.variable_index.first(uid=variable['uid']) \
+        is variable
+
+
+def test_fix(raw_metadata, raw_country_data):
+    node = raw_country_data['country_specific_data']['nodes'][0]
+    raw_metadata['Metadata'][0]['grid'].append({
+        'node_uid': node['template_node_uid'],
+        'group': [{'uid': 'group', 'variable_uid': 'template_variable'}]
+    })
+    country_data = CountryData(Metadata(raw_metadata), raw_country_data)
+    country_data.fix(['GRIDS'], uid_mode='deterministic')
+    grid = country_data.get_grid(node['uid'], False)
+    assert grid in country_data.grids
+    variable = country_data.variable_index.one(
+        node_uid=node['uid'], template_var_uid='template_variable'
+    )
+    assert grid['group'][0]['variable_uid'] == variable['uid']
+    template_grid = raw_metadata['Metadata'][0]['grid'][-1]
+    assert template_grid['group'][0]['uid'] == 'group'
+    # grids cloned from templates are traversed by statistics
+    assert country_data.count_statistics() == \
+        CountryData(Metadata(raw_metadata),
+                    country_data.json_value()).count_statistics()
+
+
+def test_fix_nested_groups(raw_metadata, raw_country_data):
+    node = raw_country_data['country_specific_data']['nodes'][0]
+    raw_metadata['Metadata'][0]['grid'].append({
+        'node_uid': node['template_node_uid'],
+        'group': [{'uid': 'row', 'variable_uid': None, 'columns': [
+            {'uid': 'column', 'variable_uid': 'template_variable'}
+        ]}]
+    })
+    country_data = CountryData(Metadata(raw_metadata), raw_country_data)
+    country_data.fix(['GRIDS'], uid_mode='deterministic')
+    grid = country_data.get_grid(node['uid'], False)
+    # groups are found under any key, not only nested groups
+    column = grid['group'][0]['columns'][0]
+    assert column['template_group_uid'] == 'column'
+    assert column['uid'] != 'column'
+
+
+def test_fix_paths_without_gc(raw_metadata, raw_country_data, caplog,
+                               monkeypatch):
+    nodes = raw_country_data['country_specific_data']['nodes']
+    template = nodes[0]
+    del template['parent_uid']
+    nodes.extend(dict(template, uid=f'node{i}') for i in range(100))
+    raw_metadata['Metadata'][0]['grid'].append({
+        'node_uid': template['template_node_uid'],
+        'group': [{'uid': 'group', 'variable_uid': 'template_variable'}]
+    })
+    country_data = CountryData(Metadata(raw_metadata), raw_country_data)
+    lookups = []
+    get_referrers = gc.get_referrers
+    monkeypatch.setattr(gc, 'get_referrers',
+                        lambda *items: lookups.append(items)
+                        or get_referrers(*items))
+    caplog.set_level('DEBUG')
+    country_data.fix(['GRIDS'], uid_mode='deterministic')
+    assert len(country_data.grids) == len(nodes)
+    assert '.country_specific_data.nodes[100]' in caplog.text
+    # only ancestors of the node list are looked up in the heap
+    assert len(lookups) < 5
+
+
+def test_variant(raw_metadata, raw_country_data):
+    node = raw_country_data['country_specific_data']['nodes'][0]
+    raw_metadata['Metadata'][0]['grid'].append({
+        'node_uid': node['template_node_uid'],
+        'group': [{'uid': 'group', 'variable_uid': 'template_variable'}]
+    })
+    metadata = Metadata(raw_metadata)
+    original = deepcopy(raw_country_data)
+    country_data = CountryData(metadata, raw_country_data)
+    fixed = country_data.variant(uid_mode='deterministic')
+    fixed.fix()
+    filtered = country_data.variant()
+    filtered.filter_sector('energy')
+    assert country_data.tree == original
+    expected = CountryData(metadata, deepcopy(original),
+                           uid_mode='deterministic')
+    expected.fix()
+    assert fixed.tree == expected.tree
+    expected = CountryData(metadata, deepcopy(original))
+    expected.filter_sector('energy')
+    assert filtered.tree == expected.tree
+    output = io.StringIO()
+    filtered.dump(output)
+    assert json.loads(output.getvalue()) == expected.tree
+    # sizes of overlays differ from those of plain containers
+    assert [dict(point, size=None) for point in fixed.count_statistics()] \
+        == [dict(point, size=None) for point in
+            CountryData(metadata, fixed.json_value()).count_statistics()]
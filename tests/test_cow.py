@@ -0,0 +1,52 @@
+from copy import deepcopy
+import json
+
+from unfccc.etf.cow import CowDict, CowList, overlay, resolve
+from unfccc.etf.json import JSONTreeWalker
+
+
+def test_overlay():
+    base = {'nodes': [{'uid': 'a', 'node': []}, {'uid': 'b'}],
+            'shared': {'uid': 'c'}}
+    original = deepcopy(base)
+    tree = overlay(base)
+    nodes = tree['nodes']
+    assert isinstance(nodes, CowList)
+    assert nodes[0] is nodes[0]
+    nodes[0]['name'] = 'A'
+    nodes.append({'uid': 'd'})
+    assert base == original
+    assert tree == dict(original, nodes=[
+        {'uid': 'a', 'node': [], 'name': 'A'}, {'uid': 'b'}, {'uid': 'd'}
+    ])
+    # unmodified parts are shared
+    assert resolve(tree)['shared'] is base['shared']
+    assert resolve(tree)['nodes'][1] is base['nodes'][1]
+    assert not tree['shared'].modified
+
+
+def test_move():
+    base = {'nodes': [{'uid': 'a'}, {'uid': 'b', 'parent_uid': 'a'}]}
+    original = deepcopy(base)
+    tree = overlay(base)
+    nodes = tree['nodes']
+    (parent, child) = nodes
+    parent.setdefault('node', []).append(child)
+    del child['parent_uid']
+    del nodes[1]
+    assert base == original
+    expected = {'nodes': [{'uid': 'a', 'node': [{'uid': 'b'}]}]}
+    assert resolve(tree) == expected
+    assert json.loads(json.dumps(
+        tree, default=JSONTreeWalker.encode_object
+    )) == expected
+    assert child.parent is parent['node']
+
+
+def test_deepcopy():
+    base = {'group': [{'uid': 'a'}]}
+    tree = overlay(base)
+    tree['group'][0]['uid'] = 'b'
+    copied = deepcopy(tree)
+    assert type(copied) is dict and not isinstance(copied, CowDict)
+    assert copied == {'group': [{'uid': 'b'}]}
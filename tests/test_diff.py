@@ -0,0 +1,49 @@
+import copy
+
+import pytest
+
+from unfccc.etf.diff import TreeFingerprints, diff, fingerprint
+from unfccc.etf.records import Node
+
+
+def test_fingerprint():
+    assert fingerprint({'a': 1, 'b': [1, 'x']}) == \
+        fingerprint({'b': [1, 'x'], 'a': 1})
+    assert fingerprint([1, 2]) != fingerprint([2, 1])
+    assert fingerprint({'a': '1'}) != fingerprint({'a': 1})
+    assert fingerprint({'a': True}) != fingerprint({'a': 1})
+    assert fingerprint(Node({'uid': 'a'})) == fingerprint({'uid': 'a'})
+    with pytest.raises(TypeError):
+        fingerprint({'a': {'é'}})
+
+
+def test_diff_identical(raw_country_data):
+    other = copy.deepcopy(raw_country_data)
+    old = TreeFingerprints(raw_country_data)
+    assert old.digest == TreeFingerprints(other).digest
+    assert list(diff(old, other)) == []
+
+
+def test_diff_changes(raw_country_data, uid):
+    new = copy.deepcopy(raw_country_data)
+    node = new['country_specific_data']['nodes'][0]
+    node['name'] = 'changed'
+    new_uid = uid()
+    node['node'] = [{'uid': new_uid, 'name': 'nested'}]
+    del new['data']['values'][0]['values'][1]
+    changes = list(diff(raw_country_data, new))
+    assert {
+        'change': 'changed', 'section': 'nodes', 'key': node['uid'],
+        'json_path': '.country_specific_data.nodes[0]',
+        'fields': ['name', 'node']
+    } in changes
+    assert {
+        'change': 'added', 'section': 'nodes', 'key': new_uid,
+        'json_path': '.country_specific_data.nodes[0].node[0]'
+    } in changes
+    assert {
+        'change': 'removed', 'section': 'values',
+        'key': (1990, 'de6fab87-82f6-46d5-b8f5-73190d8e4ace'),
+        'json_path': '.data.values[0].values[1]'
+    } in changes
+    assert len(changes) == 3
@@ -0,0 +1,57 @@
+import csv
+import io
+import json
+
+import pytest
+
+from unfccc.etf.countrydata import CountryData
+from unfccc.etf.export import ValueExport
+from unfccc.etf.metadata import Metadata
+
+
+@pytest.fixture
+def metadata(raw_metadata):
+    return Metadata(raw_metadata)
+
+
+@pytest.fixture
+def source(raw_country_data):
+    return json.dumps(raw_country_data, indent=4).encode('utf-8')
+
+
+def test_stream(metadata, raw_country_data, source):
+    (country_data, inventories) = CountryData.stream(metadata, source,
+                                                     years={2020})
+    assert country_data['data']['values'] == []
+    assert list(inventories) == raw_country_data['data']['values'][1:]
+
+
+def test_export_ndjson(metadata, raw_country_data, source):
+    (country_data, inventories) = CountryData.stream(metadata, source)
+    output = io.StringIO()
+    assert ValueExport(country_data).write(inventories, output) == 3
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    node = raw_country_data['country_specific_data']['nodes'][0]
+    variable = raw_country_data['country_specific_data']['variables'][0]
+    assert rows[0] == {
+        'inventory_year': 1990,
+        'variable_uid': variable['uid'],
+        'value': 1.0,
+        'node_uid': node['uid'],
+        'name_prefix': node['name_prefix'],
+        'name': node['name'],
+        # country node belongs to the sector of its parent
+        'sector': '4. Land use, land-use change and forestry',
+        'template_var_uid': variable['template_var_uid'],
+    }
+
+
+def test_export_csv(metadata, raw_country_data, source):
+    (country_data, inventories) = CountryData.stream(metadata, source)
+    export = ValueExport(country_data)
+    export.chunk_rows = 1
+    output = io.StringIO()
+    export.write(inventories, output, 'csv')
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    assert rows[0] == list(ValueExport.columns)
+    assert [row[0] for row in rows[1:]] == ['1990', '1990', '2020']
@@ -0,0 +1,48 @@
+from copy import deepcopy
+import json
+
+import pytest
+
+from unfccc.etf.hashcons import (FrozenDict, FrozenList, Interner, measure,
+                                 thaw)
+
+
+def test_interner():
+    interner = Interner()
+    tree = json.loads(
+        '[{"a": [1, "x"], "b": {"c": 1}}, {"a": [1, "x"], "b": {"c": 1.0}},'
+        ' {"b": {"c": true}, "a": [1, "x"]}, {"c": 1}]',
+        object_pairs_hook=interner.object_pairs_hook
+    )
+    tree = interner.value(tree)
+    assert isinstance(tree, FrozenList)
+    assert tree[0]['a'] is tree[1]['a'] is tree[2]['a']
+    assert tree[3] is tree[0]['b']
+    # equal values of other types are kept apart
+    assert tree[1]['b'] is not tree[0]['b']
+    assert type(tree[1]['b']['c']) is float
+    assert tree[2]['b']['c'] is True
+    zeros = interner.freeze([{'z': 0.0}, {'z': -0.0}, [0.0], [-0.0]])
+    assert json.dumps(zeros) == '[{"z": 0.0}, {"z": -0.0}, [0.0], [-0.0]]'
+    assert json.loads(json.dumps(tree)) == thaw(tree)
+    assert interner.freeze(thaw(tree)) is tree
+
+
+def test_read_only():
+    item = Interner().freeze({'a': [{'b': 1}]})
+    assert isinstance(item, FrozenDict)
+    with pytest.raises(TypeError):
+        item['a'] = 1
+    with pytest.raises(TypeError):
+        item.update(a=1)
+    assert deepcopy(item) is item
+    plain = thaw(item)
+    plain['a'][0]['b'] = 2
+    assert item == {'a': [{'b': 1}]}
+
+
+def test_measure():
+    plain = {'a': [{'b': 'c'}, {'b': 'c'}], 'd': [{'b': 'c'}]}
+    result = measure(Interner().freeze(plain))
+    assert (result['objects'], result['arrays']) == (2, 2)
+    assert measure(plain)['objects'] == 4
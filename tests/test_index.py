@@ -0,0 +1,84 @@
+from copy import deepcopy
+import json
+import sqlite3
+
+import pytest
+
+from unfccc.etf.countrydata import CountryData
+from unfccc.etf.index import CountryIndex
+from unfccc.etf.metadata import Metadata
+from unfccc.etf.records import Value
+
+
+@pytest.fixture
+def metadata(raw_metadata):
+    return Metadata(raw_metadata)
+
+
+@pytest.fixture
+def index(tmp_path, metadata, raw_country_data):
+    source = json.dumps(raw_country_data).encode('utf-8')
+    return CountryIndex.build(tmp_path / 'data.sqlite', metadata, source)
+
+
+def test_restore(index, metadata, raw_country_data):
+    assert index.restore(metadata).tree == raw_country_data
+    restored = index.restore(metadata, years={2020})
+    assert restored.data == raw_country_data['data']['values'][1:]
+
+
+def test_query(index, raw_country_data):
+    (columns, rows) = index.query(
+        'SELECT inventory_year, count(*) FROM "values" GROUP BY 1'
+    )
+    assert columns == ['inventory_year', 'count(*)']
+    assert list(rows) == [
+        (inventory['inventory_year'], len(inventory['values']))
+        for inventory in raw_country_data['data']['values']
+    ]
+    with pytest.raises(sqlite3.OperationalError):
+        index.query('DELETE FROM nodes')
+
+
+def test_filter_sector(index, metadata, metadata_node, raw_country_data):
+    expected = CountryData(metadata, deepcopy(raw_country_data))
+    expected.filter_sector(metadata_node['uid'])
+    result = index.filter_sector(metadata, metadata_node['uid'])
+    assert result.tree == expected.tree
+
+
+def test_other_metadata(index, metadata, raw_metadata, raw_country_data,
+                        caplog):
+    index.restore(metadata)
+    assert 'other metadata' not in caplog.text
+    other = deepcopy(raw_metadata)
+    other['Metadata'][0]['node'][0]['name'] += ' changed'
+    assert index.restore(Metadata(other)).tree == raw_country_data
+    assert 'has been built with other metadata' in caplog.text
+
+
+def test_special_path(tmp_path, metadata, raw_country_data):
+    source = json.dumps(raw_country_data).encode('utf-8')
+    index = CountryIndex.build(tmp_path / 'data #1?.sqlite', metadata,
+                               source)
+    assert index.restore(metadata).tree == raw_country_data
+
+
+def test_value_rows():
+    inventories = [{'inventory_year': 2020, 'values': [
+        {'variable_uid': 'a', 'value': 1},
+        {'uid': 'b', 'value': 2},
+    ]}]
+    rows = list(CountryIndex.value_rows(inventories, []))
+    assert rows == [(2020, 0, 'a', 1, None),
+                    (2020, 1, None, None, '{"uid": "b", "value": 2}')]
+
+
+def test_restore_records(index, metadata, metadata_node, raw_country_data):
+    restored = index.restore(metadata, records=True)
+    assert restored.tree == raw_country_data
+    filtered = index.filter_sector(metadata, metadata_node['uid'],
+                                   records=True)
+    for country_data in (restored, filtered):
+        for inventory in country_data.data:
+            assert all(type(value) is Value for value in inventory['values'])
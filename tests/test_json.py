@@ -1,3 +1,4 @@
+from collections import OrderedDict
 import copy
 import json
 import pytest
@@ -6,7 +7,7 @@ from io import StringIO
 import tempfile
 from unittest import mock
 
-from unfccc.etf.json import JSONCatalog, JSONTree
+from unfccc.etf.json import JSONCatalog, JSONPath, JSONTree, JSONTreeWalker
 from unfccc.etf.util import pairwise
 
 
@@ -109,29 +110,63 @@ def test_catalog_search(catalog, metadata_node, country_specific_nodes,
                         parent_uid):
     # check empty catalog
     catalog.clear()
-    assert catalog.search(parent_uid=parent_uid) == []
+    assert list(catalog.search(parent_uid=parent_uid)) == []
     # check catalog with one non-matching object
     catalog.index(metadata_node)
-    assert catalog.search(parent_uid=parent_uid) == []
+    assert list(catalog.search(parent_uid=parent_uid)) == []
     # check catalog with matching object
     node = metadata_node.copy()
     node['parent_uid'] = parent_uid
     catalog.index(node)
-    assert catalog.search(parent_uid=parent_uid) == [node]
+    assert list(catalog.search(parent_uid=parent_uid)) == [node]
     catalog.unindex(node)
     # check matching in multiple items
     nodes = country_specific_nodes
     catalog.index_iterable(nodes)
-    assert catalog.search(uid=nodes[1]['uid']) == [nodes[1]]
-    assert catalog.search(name='Agriculture') == [nodes[2]]
-    assert catalog.search(name='cannot be found') == []
-    items = catalog.search(parent_uid=parent_uid)
+    assert list(catalog.search(uid=nodes[1]['uid'])) == [nodes[1]]
+    assert list(catalog.search(name='Agriculture')) == [nodes[2]]
+    assert list(catalog.search(name='cannot be found')) == []
+    items = list(catalog.search(parent_uid=parent_uid))
     assert len(items) == 3
     for node in [nodes[1], nodes[3], nodes[4]]:
         assert node in items
     template_node_uid = nodes[4]['template_node_uid']
-    assert catalog.search(parent_uid=parent_uid,
-                          template_node_uid=template_node_uid) == [nodes[4]]
+    assert list(catalog.search(
+        parent_uid=parent_uid, template_node_uid=template_node_uid
+    )) == [nodes[4]]
+
+
+def test_catalog_search_plan(catalog, country_specific_nodes, parent_uid):
+    nodes = country_specific_nodes
+    catalog.index_iterable(nodes)
+    postings = catalog.plan({'parent_uid': parent_uid,
+                             'uid': nodes[1]['uid']})
+    assert [len(object_ids) for object_ids in postings] == [1, 3]
+    assert catalog.plan({'parent_uid': parent_uid, 'uid': 'missing'}) is None
+    # search is lazy and first() stops on the first match
+    items = catalog.search(parent_uid=parent_uid)
+    assert next(items) in nodes
+    assert catalog.first(parent_uid=parent_uid) in nodes
+
+
+def test_catalog_composite_index(country_specific_nodes, parent_uid):
+    nodes = country_specific_nodes
+    catalog = JSONCatalog(['uid'], nodes,
+                          composite=[('parent_uid', 'template_node_uid')])
+    template_node_uid = nodes[4]['template_node_uid']
+    key = ('parent_uid', 'template_node_uid')
+    assert catalog.indexes[key][(parent_uid, template_node_uid)] \
+        == {id(nodes[4])}
+    # a single lookup of the composite index
+    postings = catalog.plan({'parent_uid': parent_uid,
+                             'template_node_uid': template_node_uid})
+    assert postings == [{id(nodes[4])}]
+    assert catalog.first(parent_uid=parent_uid,
+                         template_node_uid=template_node_uid) is nodes[4]
+    catalog.unindex(nodes[4])
+    assert (parent_uid, template_node_uid) not in catalog.indexes[key]
+    assert catalog.first(parent_uid=parent_uid,
+                         template_node_uid=template_node_uid) is None
 
 
 def test_catalof_get(catalog, country_specific_nodes, parent_uid):
@@ -157,3 +192,70 @@ def test_load_utf8_on_windows(raw_metadata, tmp_path):
         metadata_path.write_bytes(source.encode('utf-8'))
         with metadata_path.open('rt', encoding=wrong_encoding ) as input_file:
             metadata = JSONTree(input_file)
+
+
+def test_json_path_compile():
+    assert JSONPath.compile('.a[0]') is JSONPath.compile('.a[0]')
+    with pytest.raises(ValueError):
+        JSONPath('.a[x]')
+
+
+def test_select_wildcards(raw_metadata):
+    metadata = JSONTree(raw_metadata)
+    nodes = metadata['Metadata'][0]['node']
+    assert list(metadata.select('Metadata[0].node[*].name')) == \
+        [node['name'] for node in nodes]
+    assert list(metadata.select('.Metadata.*')) == metadata['Metadata']
+    assert list(metadata.select('..name_prefix')) == \
+        [node['name_prefix'] for node in nodes]
+    # descendant step matches the key at any depth, in document order
+    assert list(metadata.select('..uid'))[:len(nodes)] == \
+        [node['uid'] for node in nodes]
+    nested = JSONTree({'a': {'k': 1, 'b': [{'k': 2}]}, 'k': {'k': 3}})
+    assert list(nested.select('..k')) == [1, 2, {'k': 3}, 3]
+
+
+def test_locate_cache(raw_metadata):
+    metadata = JSONTree(raw_metadata)
+    nodes = metadata['Metadata'][0]['node']
+    assert metadata.locate('.Metadata[0].node[4].name') == 'Waste'
+    del nodes[4]
+    # stale until invalidated
+    assert metadata.locate('.Metadata[0].node[4].name') == 'Waste'
+    metadata.invalidate()
+    assert metadata.locate('.Metadata[0].node[4].name') is None
+    for index in range(metadata.locate_cache_size + 10):
+        metadata.locate(f'.Metadata[0].node[{index}]')
+    assert len(metadata._locate_cache) == metadata.locate_cache_size
+
+
+def test_traverse_via(raw_metadata):
+    metadata = JSONTree(raw_metadata)
+    nodes = metadata['Metadata'][0]['node']
+    nested = {'uid': 'nested', 'node': [], 'attributes': {'unit': 'kt'}}
+    nodes[3]['node'].append(nested)
+    assert list(metadata.traverse(nodes, via='node')) == \
+        nodes[:4] + [nested] + nodes[4:]
+    assert nested['attributes'] in list(metadata.traverse(nodes))
+    # rejected objects are not descended
+    assert list(metadata.traverse(
+        nodes, via='node', predicate=lambda node: node is not nodes[3]
+    )) == nodes[:3] + nodes[4:]
+
+
+def test_traverse_record_parents(raw_metadata):
+    metadata = JSONTree(raw_metadata)
+    nodes = metadata['Metadata'][0]['node']
+    nested = {'uid': 'nested'}
+    nodes[3]['node'].append(nested)
+    for _ in metadata.traverse(nodes, via='node', record_parents=True):
+        pass
+    assert metadata._cached_parent(nested) is nodes[3]['node']
+    assert metadata.json_path(nested) == '.Metadata[0].node[3].node[0]'
+
+
+def test_traverse_dict_subclasses():
+    nested = OrderedDict(uid='nested')
+    tree = {'uid': 'root', 'node': [nested]}
+    assert JSONTreeWalker.is_json_container(nested)
+    assert list(JSONTreeWalker.traverse(tree)) == [tree, nested]
@@ -0,0 +1,112 @@
+import copy
+import json
+
+import pytest
+
+from unfccc.etf.merge import CountryDataMerger, MergeConflict
+
+
+@pytest.fixture
+def partial_data(raw_country_data, uid):
+    # second file: one overlapping node, one new variable and year
+    other = copy.deepcopy(raw_country_data)
+    other_metadata = other['country_specific_data']
+    new_variable_uid = uid()
+    other_metadata['variables'] = [{
+        'uid': new_variable_uid,
+        'node_uid': other_metadata['nodes'][0]['uid'],
+        'template_var_uid': uid(),
+    }]
+    other['data']['values'] = [
+        {
+            'inventory_year': 2020,
+            'values': [{'variable_uid': new_variable_uid, 'value': 4.0}]
+        },
+        {
+            'inventory_year': 2021,
+            'values': [{'variable_uid': new_variable_uid, 'value': 5.0}]
+        },
+    ]
+    return other
+
+
+def test_merge_union(raw_country_data, partial_data):
+    base = copy.deepcopy(raw_country_data)
+    merger = CountryDataMerger()
+    merger.merge(base)
+    result = merger.merge(partial_data)
+    country_metadata = result['country_specific_data']
+    assert len(country_metadata['nodes']) == 1
+    assert len(country_metadata['variables']) == 2
+    years = {inventory['inventory_year']: inventory['values']
+             for inventory in result['data']['values']}
+    assert sorted(years) == [1990, 2020, 2021]
+    assert len(years[1990]) == 2
+    assert [value['value'] for value in years[2020]] == [3.0, 4.0]
+    assert merger.conflicts == []
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('first', 1.0),
+    ('last', 10.0),
+])
+def test_merge_conflict_policy(raw_country_data, policy, expected):
+    other = copy.deepcopy(raw_country_data)
+    other['data']['values'][0]['values'][0]['value'] = 10.0
+    merger = CountryDataMerger(policy)
+    merger.merge(copy.deepcopy(raw_country_data))
+    result = merger.merge(other, 'other.json')
+    assert result['data']['values'][0]['values'][0]['value'] == expected
+    assert len(merger.conflicts) == 1
+    ((collection, key), source) = merger.conflicts[0]
+    assert collection == 'values'
+    assert key[0] == 1990
+    assert source == 'other.json'
+
+
+def test_merge_conflict_error(raw_country_data):
+    other = copy.deepcopy(raw_country_data)
+    other['country_specific_data']['nodes'][0]['name'] = 'changed'
+    merger = CountryDataMerger()
+    merger.merge(copy.deepcopy(raw_country_data))
+    with pytest.raises(MergeConflict):
+        merger.merge(other)
+
+
+def test_merge_last_reindexes(raw_country_data):
+    other = copy.deepcopy(raw_country_data)
+    other_node = other['country_specific_data']['nodes'][0]
+    other_node['name'] = 'changed'
+    other_node['node'] = [{'uid': 'nested', 'name': 'nested'}]
+    merger = CountryDataMerger('last')
+    merger.merge(copy.deepcopy(raw_country_data))
+    result = merger.merge(other)
+    node = result['country_specific_data']['nodes'][0]
+    catalog = merger.catalogs['nodes']
+    assert catalog.first(uid=node['uid']) is node
+    assert catalog.first(uid='nested') is node['node'][0]
+    # a later input resolves against the replaced content
+    merger.merge(copy.deepcopy(other))
+    assert len(merger.conflicts) == 1
+
+
+def test_merge_files(tmp_path, raw_country_data, partial_data):
+    expected = CountryDataMerger()
+    expected.merge(copy.deepcopy(raw_country_data))
+    expected.merge(copy.deepcopy(partial_data))
+    paths = [tmp_path / 'base.json', tmp_path / 'partial.json']
+    for (path, tree) in zip(paths, [raw_country_data, partial_data]):
+        path.write_text(json.dumps(tree))
+    merger = CountryDataMerger()
+    # later inputs are merged one inventory year at a time
+    inventories = []
+    merge_inventory = merger.merge_inventory
+
+    def recording_merge_inventory(base_values, inventory, source):
+        inventories.append(inventory['inventory_year'])
+        merge_inventory(base_values, inventory, source)
+
+    merger.merge_inventory = recording_merge_inventory
+    with open(paths[0], 'rb') as base, open(paths[1], 'rb') as partial:
+        assert merger.merge_files([base, partial]) == expected.tree
+    assert inventories == [2020, 2021]
@@ -1,4 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+
 import pytest
+
+from unfccc.etf.countrydata import CountryData
 from unfccc.etf.metadata import Metadata
 
 
@@ -23,3 +28,55 @@ def test_collect_sector_uids(metadata, uid):
         'variables': {'de6fab87-82f6-46d5-b8f5-73190d8e4ace'},
         'dimension_instances': {'db7b9be0-76bc-497e-a4ee-9334ec2429d2'},
     }
+
+
+def test_freeze(metadata):
+    metadata.freeze()
+    with pytest.raises(TypeError):
+        metadata.node_index.index({'uid': 'new'})
+    with pytest.raises(TypeError):
+        metadata.invalidate()
+    node = metadata.nodes[3]
+    assert metadata.json_path(node) == '.Metadata[0].node[3]'
+    assert metadata.get_node(node['uid']) is node
+
+
+def test_concurrent_filters(raw_metadata, raw_country_data):
+    metadata = Metadata(raw_metadata, frozen=True)
+    sectors = ['energy', 'ippu', 'agriculture', 'lulucf', 'waste'] * 20
+
+    def filter_sector(sector):
+        country_data = CountryData(metadata, deepcopy(raw_country_data))
+        country_data.filter_sector(sector)
+        return country_data.tree
+
+    expected = {sector: filter_sector(sector) for sector in set(sectors)}
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(filter_sector, sectors))
+    assert results == [expected[sector] for sector in sectors]
+
+
+def test_shared(raw_metadata, raw_country_data):
+    node = raw_country_data['country_specific_data']['nodes'][0]
+    raw_metadata['Metadata'][0]['grid'].append({
+        'node_uid': node['template_node_uid'],
+        'group': [{'uid': 'group', 'variable_uid': 'template_variable'}]
+    })
+    plain = Metadata(deepcopy(raw_metadata))
+    shared = Metadata(raw_metadata, shared=True)
+    assert shared.tree == plain.tree
+    assert shared.fingerprint == plain.fingerprint
+    with pytest.raises(TypeError):
+        shared.nodes[0]['name'] = 'changed'
+    node_uid = plain.nodes[3]['uid']
+    assert shared.json_path(shared.get_node(node_uid)) == \
+        '.Metadata[0].node[3]'
+    # templates are copied on write into country data
+    results = []
+    for metadata in (plain, shared):
+        country_data = CountryData(metadata, deepcopy(raw_country_data))
+        country_data.fix(['GRIDS'], uid_mode='deterministic')
+        results.append(country_data.tree)
+    assert results[0] == results[1]
+    with pytest.raises(ValueError):
+        Metadata(raw_metadata, records=True, shared=True)
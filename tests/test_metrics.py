@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from unfccc.etf import metrics
+from unfccc.etf.json import JSONCatalog, JSONTree, JSONTreeWalker
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.enable()
+    yield metrics.REGISTRY
+    metrics.disable()
+    metrics.REGISTRY.clear()
+    JSONCatalog.instances.clear()
+    JSONTree.instances.clear()
+    JSONCatalog.released_cardinalities.clear()
+    JSONTree.released_parents = 0
+
+
+def test_counter_exposition(registry):
+    counter = registry.counter('test_total', 'test counter', ['kind'])
+    counter.inc('a')
+    counter.inc('a', amount=2)
+    counter.inc('b "quoted"')
+    assert registry.expose().splitlines() == [
+        '# HELP test_total test counter',
+        '# TYPE test_total counter',
+        'test_total{kind="a"} 3',
+        'test_total{kind="b \\"quoted\\""} 1'
+    ]
+
+
+def test_histogram_exposition(registry):
+    histogram = registry.histogram('test_size', 'test histogram',
+                                   buckets=(1, 10))
+    for value in (0, 5, 50):
+        histogram.observe(value)
+    assert registry.expose().splitlines()[2:] == [
+        'test_size_bucket{le="1.0"} 1',
+        'test_size_bucket{le="10.0"} 2',
+        'test_size_bucket{le="+Inf"} 3',
+        'test_size_sum 55',
+        'test_size_count 3'
+    ]
+
+
+def test_gauge_callback(registry):
+    registry.gauge('test_items', 'test gauge', ['name'],
+                   callback=lambda: {('x',): 7})
+    assert 'test_items{name="x"} 7' in registry.expose()
+
+
+def test_duplicate_metric(registry):
+    registry.counter('test_total', 'test counter')
+    with pytest.raises(ValueError):
+        registry.counter('test_total', 'test counter')
+
+
+def test_write_textfile(registry, tmp_path):
+    registry.counter('test_total', 'test counter').inc()
+    path = tmp_path / 'etf.prom'
+    registry.write_textfile(str(path))
+    assert path.read_text().endswith('test_total 1\n')
+    assert os.listdir(tmp_path) == ['etf.prom']
+
+
+def test_disabled_catalog_search(nodes):
+    catalog = JSONCatalog(['uid'], nodes, name='test')
+    assert catalog.first(uid=nodes[0]['uid']) is nodes[0]
+    assert catalog not in JSONCatalog.instances
+    assert 'catalog="test"' not in metrics.REGISTRY.expose()
+
+
+def test_catalog_search_metrics(enabled_metrics, nodes):
+    catalog = JSONCatalog(['uid', 'name'], nodes, name='test')
+    catalog.first(uid=nodes[0]['uid'])
+    list(catalog.search(uid='missing'))
+    exposed = enabled_metrics.expose()
+    assert ('etf_catalog_searches_total{catalog="test",method="first",'
+            'result="hit"} 1') in exposed
+    assert ('etf_catalog_searches_total{catalog="test",method="search",'
+            'result="miss"} 1') in exposed
+    assert (f'etf_catalog_index_cardinality{{catalog="test",'
+            f'attribute="uid"}} {len(nodes)}') in exposed
+
+
+def test_released_instances(enabled_metrics, nodes):
+    catalog = JSONCatalog(['uid'], nodes, name='test')
+    tree = JSONTree({'node': nodes})
+    assert catalog in JSONCatalog.instances and tree in JSONTree.instances
+    list(tree.traverse(tree.tree, record_parents=True))
+    parents = len(JSONTreeWalker._parents) + len(tree._parents)
+    assert len(tree._parents) > 0
+    del catalog, tree
+    assert len(JSONCatalog.instances) == len(JSONTree.instances) == 0
+    # released instances are still measured
+    exposed = enabled_metrics.expose()
+    assert (f'etf_catalog_index_cardinality{{catalog="test",'
+            f'attribute="uid"}} {len(nodes)}') in exposed
+    assert f'etf_parents_cache_size {parents}\n' in exposed
+
+
+def test_traverse_metrics(enabled_metrics, nodes):
+    count = len(list(JSONTreeWalker.traverse(nodes, via='node')))
+    assert (f'etf_traverse_objects_sum{{via="node"}} {count}'
+            in enabled_metrics.expose())
@@ -0,0 +1,52 @@
+import bz2
+import functools
+import gzip
+import io
+import json
+import lzma
+
+import pytest
+
+from unfccc.etf.overlap import BlockWriter, read_input, write_output
+
+
+DATA = b'{"values": [' + b','.join(b'%d' % i for i in range(10000)) + b']}'
+
+
+@pytest.mark.parametrize('compress', [
+    bytes, gzip.compress, lzma.compress, bz2.compress,
+    # concatenated streams
+    lambda data: gzip.compress(data[:100]) + gzip.compress(data[100:]),
+])
+@pytest.mark.parametrize('depth', [0, 2])
+def test_read_input(compress, depth):
+    source = io.BytesIO(compress(DATA))
+    assert read_input(source, block_size=1000, depth=depth) == DATA
+
+
+class FailingFile(io.BytesIO):
+
+    def read(self, size=-1):
+        if self.tell() > 1000:
+            raise OSError('read failed')
+        return super().read(size)
+
+    def write(self, data):
+        raise OSError('write failed')
+
+
+def test_errors():
+    with pytest.raises(OSError, match='read failed'):
+        read_input(FailingFile(DATA), block_size=100, depth=2)
+    with pytest.raises(OSError, match='write failed'):
+        with BlockWriter(FailingFile(), block_size=10, depth=1) as writer:
+            for _ in range(100):
+                writer.write('0123456789')
+
+
+def test_write_output():
+    output = io.StringIO()
+    value = {'values': list(range(10000))}
+    write_output(functools.partial(json.dump, value), output,
+                 block_size=100, depth=2)
+    assert json.loads(output.getvalue()) == value
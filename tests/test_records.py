@@ -0,0 +1,66 @@
+import copy
+import io
+import json
+
+import pytest
+
+from unfccc.etf.countrydata import CountryData
+from unfccc.etf.json import JSONCatalog, JSONTree
+from unfccc.etf.metadata import Metadata
+from unfccc.etf.records import Node, Value, Variable, record_hook
+
+
+def test_record_mapping():
+    node = Node({'uid': 'a', 'custom': 1, 'name': 'x'})
+    assert list(node) == ['uid', 'custom', 'name']
+    assert node['custom'] == 1
+    assert node.get('parent_uid') is None
+    assert 'parent_uid' not in node
+    node['parent_uid'] = 'b'
+    del node['custom']
+    assert node.items() == [('uid', 'a'), ('name', 'x'), ('parent_uid', 'b')]
+    assert node == {'uid': 'a', 'name': 'x', 'parent_uid': 'b'}
+    with pytest.raises(KeyError):
+        node['custom']
+    # records of the same shape share key order tuple
+    assert Node(node)._keys is node._keys
+    # keys are a view, supporting set operations like dict keys
+    assert node.keys() | {'custom'} == {'uid', 'name', 'parent_uid', 'custom'}
+    clone = copy.deepcopy(node)
+    assert clone == node and type(clone) is Node
+
+
+def test_record_hook():
+    tree = json.loads(
+        '{"values": [{"variable_uid": "v", "value": 1}],'
+        ' "variables": [{"uid": "v", "node_uid": "n"}], "other": {}}',
+        object_pairs_hook=record_hook
+    )
+    assert type(tree['values'][0]) is Value
+    assert type(tree['variables'][0]) is Variable
+    assert type(tree['other']) is dict
+
+
+def test_catalog_and_traverse(nodes):
+    records = [Node(node) for node in nodes]
+    records[3]['node'] = [Node({'uid': 'nested', 'name_prefix': '4.A.'})]
+    assert [node['uid'] for node in JSONTree.traverse(records, via='node')] \
+        == [node['uid'] for node in nodes[:4]] + ['nested', nodes[4]['uid']]
+    catalog = JSONCatalog(['uid', 'name'], JSONTree.traverse(records))
+    assert catalog.first(uid='nested') is records[3]['node'][0]
+    assert catalog.first(name='Waste') is records[4]
+
+
+@pytest.mark.parametrize('source', ['object', 'json'])
+def test_records_dump_identical(raw_metadata, raw_country_data, source):
+    metadata = Metadata(raw_metadata)
+    expected = io.StringIO()
+    CountryData(metadata, copy.deepcopy(raw_country_data)).dump(expected)
+    data = copy.deepcopy(raw_country_data) if source == 'object' \
+        else json.dumps(raw_country_data).encode('utf-8')
+    country_data = CountryData(metadata, data, records=True)
+    assert type(country_data.nodes[0]) is Node
+    assert type(country_data.data[0]['values'][0]) is Value
+    result = io.StringIO()
+    country_data.dump(result)
+    assert result.getvalue() == expected.getvalue()
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from unfccc.etf import scanner
+
+
+@pytest.fixture
+def source():
+    return json.dumps({
+        'text': 'brackets ]}{[ and "quotes" in strings',
+        'data': {'values': [
+            {'inventory_year': 1990, 'values': [{'value': '}'}]},
+            {'inventory_year': 2020, 'values': []},
+        ]},
+        'flag': True,
+    }, indent=2).encode('utf-8')
+
+
+def test_iter_members(source):
+    members = list(scanner.iter_members(source, 0))
+    assert [key for (key, _, _) in members] == ['text', 'data', 'flag']
+    assert [json.loads(source[start:end])
+            for (_, start, end) in members] == list(json.loads(source)
+                                                    .values())
+
+
+def test_locate(source):
+    (start, end) = scanner.locate(source, 'data', 'values')
+    values = json.loads(source)['data']['values']
+    assert json.loads(source[start:end]) == values
+    assert [json.loads(source[begin:finish]) for (begin, finish)
+            in scanner.iter_elements(source, start)] == values
+    assert scanner.locate(source, 'data', 'missing') is None
+    assert scanner.locate(source, 'flag', 'values') is None
+    assert scanner.locate(b'\xef\xbb\xbf {"a": 1}', 'a') == (10, 11)
+
+
+def test_anchored_elements(source):
+    (start, end, elements) = scanner.anchored_elements(source,
+                                                       'inventory_year')
+    assert (start, end) == scanner.locate(source, 'data', 'values')
+    assert [year for (year, _, _) in elements] == [1990, 2020]
+    assert [json.loads(source[begin:finish])
+            for (_, begin, finish) in elements] == \
+        json.loads(source)['data']['values']
+    # key not being the first member cannot be anchored
+    reordered = json.dumps({'values': [
+        {'inventory_year': 1990, 'values': []},
+        {'values': [], 'inventory_year': 2020},
+    ]}).encode('utf-8')
+    assert scanner.anchored_elements(reordered, 'inventory_year') is None
+
+
+def test_malformed():
+    with pytest.raises(ValueError):
+        scanner.skip_value(b'[1, [2]', 0)
+
+
+def test_skip_known_value(source):
+    (data_start, data_end) = scanner.locate(source, 'data')
+    (start, end) = scanner.locate(source, 'data', 'values')
+    # unbalanced brackets prove that the known value is not scanned
+    broken = source[:start + 1] + b'[' * (end - start - 2) \
+        + source[end - 1:]
+    assert scanner.skip_value(broken, data_start, {start: end}) == data_end
+    with pytest.raises(ValueError):
+        scanner.skip_value(broken, data_start)
@@ -0,0 +1,76 @@
+import io
+import json
+from unittest import mock
+
+import pytest
+
+from unfccc.etf import splice
+from unfccc.etf.countrydata import CountryData
+from unfccc.etf.metadata import Metadata
+
+
+@pytest.fixture
+def metadata(raw_metadata):
+    return Metadata(raw_metadata)
+
+
+@pytest.fixture
+def source(raw_country_data):
+    # compact formatting tells copied parts from serialised ones
+    return json.dumps(raw_country_data, separators=(',', ':')) \
+        .encode('utf-8')
+
+
+def test_scan_spans(metadata, source):
+    country_data = CountryData(metadata, source, splice=True)
+    spans = country_data.spans
+    for item in [country_data.tree, country_data.nodes[0],
+                 country_data.data[0], country_data.data[1]['values']]:
+        (start, end) = spans.clean_span(item)
+        assert json.loads(source[start:end]) == item
+
+
+def test_unchanged_dump(metadata, source):
+    country_data = CountryData(metadata, source, splice=True)
+    output = io.StringIO()
+    country_data.dump(output)
+    assert output.getvalue().encode('utf-8') == source
+
+
+def test_changed_dump(metadata, raw_country_data, source):
+    country_data = CountryData(metadata, source, splice=True)
+    country_data.make_variable(country_data.nodes[0]['uid'], 'template')
+    country_data.filter_out(country_data.data[0]['values'],
+                            lambda value: value['value'] > 1)
+    output = io.StringIO()
+    country_data.dump(output)
+    result = json.loads(output.getvalue())
+    assert result == country_data.tree
+    # clean containers are copied as they are
+    text = output.getvalue()
+    assert json.dumps(country_data.nodes, separators=(',', ':')) in text
+    assert json.dumps(country_data.data[1], separators=(',', ':')) in text
+    assert json.dumps(country_data.variables[-1], indent=4) \
+        .replace('\n', '\n' + ' ' * 12) in text
+
+
+def test_kernel_copy(metadata, source, tmp_path):
+    input_path = tmp_path / 'input.json'
+    input_path.write_bytes(source)
+    output_path = tmp_path / 'output.json'
+    with open(input_path, 'rb') as input_file, \
+            open(output_path, 'w') as output_file, \
+            mock.patch.object(splice, 'MIN_KERNEL_COPY', 0), \
+            mock.patch.object(splice.SpliceWriter, 'copy_range',
+                              autospec=True,
+                              side_effect=splice.SpliceWriter.copy_range
+                              ) as copy_range:
+        country_data = CountryData(metadata, input_file, splice=True)
+        assert country_data.spans.source_file is input_file
+        country_data.filter_out(country_data.data, lambda _: False)
+        country_data.dump(output_file)
+    assert copy_range.called
+    result = json.loads(output_path.read_bytes())
+    assert result['data'] == {'values': []}
+    assert result['country_specific_data'] == \
+        json.loads(source)['country_specific_data']
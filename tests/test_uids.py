@@ -0,0 +1,52 @@
+from copy import deepcopy
+import os
+from unittest import mock
+
+import pytest
+
+from unfccc.etf.countrydata import CountryData
+from unfccc.etf.metadata import Metadata
+from unfccc.etf.uids import DeterministicUIDs, RandomUIDs, make_allocator
+
+
+def test_random_uids():
+    allocator = RandomUIDs(block_size=4)
+    with mock.patch('os.urandom', wraps=os.urandom) as urandom:
+        uids = [allocator() for _ in range(10)]
+    assert urandom.call_count == 3
+    assert len(set(uids)) == 10
+    assert all(len(uid) == 24 for uid in uids)
+
+
+def test_deterministic_uids():
+    uids = [DeterministicUIDs()('group', 'node', 'template')
+            for _ in range(2)]
+    assert uids[0] == uids[1]
+    allocator = DeterministicUIDs()
+    assert allocator('group', 'node', 'template') == uids[0]
+    # repeated name gets another UID
+    assert allocator('group', 'node', 'template') != uids[0]
+    assert allocator('variable', 'node', 'template') != uids[0]
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        make_allocator('sequential')
+
+
+def test_country_data_uids(raw_metadata, raw_country_data):
+    metadata = Metadata(raw_metadata)
+    country_data = CountryData(metadata, raw_country_data,
+                               uid_mode='deterministic')
+    variable = country_data.variables[0]
+    # collision with existing variable is avoided
+    with mock.patch.object(country_data, 'uid_allocator',
+                           side_effect=[variable['uid'], 'new']):
+        assert country_data.make_uid('variable') == 'new'
+    uids = [
+        CountryData(
+            metadata, deepcopy(raw_country_data), uid_mode='deterministic'
+        ).make_variable('node', 'template')['uid']
+        for _ in range(2)
+    ]
+    assert uids[0] == uids[1]